@@ -0,0 +1,34 @@
+"""order_risk listing indexes
+
+Revision ID: 0002_order_risk_listing_indexes
+Revises: 0001_initial
+Create Date: 2025-10-01 00:00:00
+"""
+from alembic import op
+
+revision = "0002_order_risk_listing_indexes"
+down_revision = "0001_initial"
+branch_labels = None
+depends_on = None
+
+# Built CONCURRENTLY so large order_risk tables stay writable during the migration.
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        # /v1/orders?shop_id=&verdict= keyset pages: WHERE shop_id, verdict, id < cursor ORDER BY id DESC
+        op.create_index("ix_order_risk_shop_verdict_id", "order_risk", ["shop_id", "verdict", "id"],
+                        postgresql_concurrently=True)
+        # unfiltered listing and export; supersedes the single-column shop_id index
+        op.create_index("ix_order_risk_shop_id_id", "order_risk", ["shop_id", "id"],
+                        postgresql_concurrently=True)
+        # ?q=<email>
+        op.create_index("ix_order_risk_shop_email", "order_risk", ["shop_id", "email"],
+                        postgresql_concurrently=True)
+        op.drop_index("ix_order_risk_shop_id", table_name="order_risk", postgresql_concurrently=True)
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.create_index("ix_order_risk_shop_id", "order_risk", ["shop_id"], postgresql_concurrently=True)
+        op.drop_index("ix_order_risk_shop_email", table_name="order_risk", postgresql_concurrently=True)
+        op.drop_index("ix_order_risk_shop_id_id", table_name="order_risk", postgresql_concurrently=True)
+        op.drop_index("ix_order_risk_shop_verdict_id", table_name="order_risk", postgresql_concurrently=True)
@@ -0,0 +1,43 @@
+"""compact evidence tables
+
+Revision ID: 0003_compact_evidence
+Revises: 0002_order_risk_listing_indexes
+Create Date: 2025-10-08 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003_compact_evidence"
+down_revision = "0002_order_risk_listing_indexes"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table(
+        "evidence_blob",
+        sa.Column("hash", sa.LargeBinary(32), primary_key=True),
+        sa.Column("codec", sa.SmallInteger, nullable=False),
+        sa.Column("data", sa.LargeBinary, nullable=False),
+    )
+
+    op.create_table(
+        "reason_dict",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("text", sa.String, nullable=False, unique=True),
+    )
+
+    op.create_table(
+        "order_evidence",
+        sa.Column("order_id", sa.String, primary_key=True),
+        sa.Column("shop_id", sa.String),
+        sa.Column("input_hash", sa.LargeBinary(32), nullable=False),
+        sa.Column("scores_hash", sa.LargeBinary(32), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.text("NOW()")),
+    )
+    op.create_index("ix_order_evidence_shop_created", "order_evidence", ["shop_id", "created_at"])
+
+def downgrade():
+    op.drop_index("ix_order_evidence_shop_created", table_name="order_evidence")
+    op.drop_table("order_evidence")
+    op.drop_table("reason_dict")
+    op.drop_table("evidence_blob")
@@ -0,0 +1,24 @@
+"""risk_identity outcome counters
+
+Revision ID: 0004_vault_outcomes
+Revises: 0003_compact_evidence
+Create Date: 2025-10-10 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004_vault_outcomes"
+down_revision = "0003_compact_evidence"
+branch_labels = None
+depends_on = None
+
+OUTCOME_COLUMNS = ("chargeback_count", "refund_count", "approved_count")
+
+def upgrade():
+    # constant defaults: no table rewrite on Postgres 11+
+    for name in OUTCOME_COLUMNS:
+        op.add_column("risk_identity", sa.Column(name, sa.Integer, nullable=False, server_default="0"))
+
+def downgrade():
+    for name in reversed(OUTCOME_COLUMNS):
+        op.drop_column("risk_identity", name)
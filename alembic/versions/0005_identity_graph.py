@@ -0,0 +1,47 @@
+"""identity graph tables
+
+Revision ID: 0005_identity_graph
+Revises: 0004_vault_outcomes
+Create Date: 2025-10-12 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005_identity_graph"
+down_revision = "0004_vault_outcomes"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table(
+        "identity_node",
+        sa.Column("id", sa.BigInteger, primary_key=True),
+        sa.Column("kind", sa.String, nullable=False),
+        sa.Column("hash", sa.String, nullable=False),
+        sa.Column("root", sa.BigInteger),
+        sa.Column("size", sa.Integer, nullable=False, server_default="1"),
+        sa.UniqueConstraint("kind", "hash", name="uq_identity_node_kind_hash"),
+    )
+    op.create_index("ix_identity_node_root", "identity_node", ["root"])
+
+    op.create_table(
+        "identity_edge",
+        sa.Column("id", sa.BigInteger, primary_key=True),
+        sa.Column("a_kind", sa.String, nullable=False),
+        sa.Column("a_hash", sa.String, nullable=False),
+        sa.Column("b_kind", sa.String, nullable=False),
+        sa.Column("b_hash", sa.String, nullable=False),
+        sa.Column("seen_count", sa.Integer, nullable=False, server_default="1"),
+        sa.Column("last_seen", sa.DateTime(timezone=True), server_default=sa.text("NOW()")),
+        sa.Column("applied", sa.Boolean, nullable=False, server_default=sa.text("false")),
+        sa.UniqueConstraint("a_kind", "a_hash", "b_kind", "b_hash", name="uq_identity_edge"),
+    )
+    # apply_identity_links scans only the unapplied tail
+    op.create_index("ix_identity_edge_pending", "identity_edge", ["id"],
+                    postgresql_where=sa.text("applied IS false"))
+
+def downgrade():
+    op.drop_index("ix_identity_edge_pending", table_name="identity_edge")
+    op.drop_table("identity_edge")
+    op.drop_index("ix_identity_node_root", table_name="identity_node")
+    op.drop_table("identity_node")
@@ -0,0 +1,137 @@
+"""monthly partitions for webhook_events and device_captures
+
+Revision ID: 0006_time_partitions
+Revises: 0005_identity_graph
+Create Date: 2025-10-20 00:00:00
+
+Postgres only. Each table is rebuilt as a parent partitioned by range on
+its timestamp, with one partition per month (see app/partitions.py, which
+keeps them from here on). The primary key becomes (id, <timestamp>), and
+event_id becomes unique per partition, since Postgres cannot enforce a
+unique key across partitions. order_risk is left alone: its table-wide
+unique order_id is what makes a redelivered order a no-op.
+
+The existing rows are copied into the partitions, so run this in a quiet
+window on large tables.
+"""
+import os
+from datetime import datetime, timezone
+
+from alembic import op
+
+revision = "0006_time_partitions"
+down_revision = "0005_identity_graph"
+branch_labels = None
+depends_on = None
+
+# months created ahead, as the maintain_partitions task does afterwards
+try:
+    from app.config import settings
+    PREMAKE_MONTHS = settings.PARTITION_PREMAKE_MONTHS
+except Exception:  # app settings incomplete in this environment, as in env.py
+    PREMAKE_MONTHS = int(os.getenv("PARTITION_PREMAKE_MONTHS", "3"))
+
+# table -> (columns as in 0001, partition key, unique per partition, parent indexes)
+TABLES = {
+    "webhook_events": (
+        """id BIGINT NOT NULL,
+           shop_id VARCHAR(128),
+           event_id VARCHAR(128) NOT NULL,
+           topic VARCHAR(128),
+           processed BOOLEAN NOT NULL DEFAULT false,
+           processed_at TIMESTAMPTZ NOT NULL DEFAULT NOW()""",
+        "processed_at", ("event_id",),
+        {"ix_webhook_events_shop_id": "shop_id"},
+    ),
+    "device_captures": (
+        """id BIGINT NOT NULL,
+           shop_id VARCHAR(64) NOT NULL,
+           session_id VARCHAR(128) NOT NULL,
+           device_id VARCHAR(128),
+           cart_token VARCHAR(128),
+           email VARCHAR(256),
+           created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()""",
+        "created_at", (),
+        {},
+    ),
+}
+
+# the unique indexes these tables had before 0006, restored on downgrade
+LEGACY_UNIQUE = {"webhook_events": ("event_id",)}
+LEGACY_INDEXES = {  # name -> (columns, unique)
+    "webhook_events": {"ix_webhook_events_shop_id": ("shop_id", False)},
+    "device_captures": {},
+}
+
+def _add_months(month, n):
+    y, m = divmod(month.month - 1 + n, 12)
+    return month.replace(year=month.year + y, month=m + 1)
+
+def _rename_away(conn, table):
+    """Rename <table> (and its primary key) to <table>_unpartitioned; returns its id sequence."""
+    seq = conn.exec_driver_sql(f"SELECT pg_get_serial_sequence('{table}', 'id')").scalar()
+    op.execute(f"ALTER TABLE {table} RENAME TO {table}_unpartitioned")
+    op.execute(f"ALTER TABLE {table}_unpartitioned RENAME CONSTRAINT {table}_pkey TO {table}_unpartitioned_pkey")
+    return seq
+
+def _own_sequence(table, seq):
+    op.execute(f"ALTER TABLE {table} ALTER COLUMN id SET DEFAULT nextval('{seq}'::regclass)")
+    op.execute(f"ALTER SEQUENCE {seq} OWNED BY {table}.id")
+
+def upgrade():
+    conn = op.get_bind()
+    if conn.dialect.name != "postgresql":
+        return
+    now = datetime.now(timezone.utc)
+    for table, (columns, key, unique, indexes) in TABLES.items():
+        seq = _rename_away(conn, table)
+        for name in LEGACY_INDEXES[table]:
+            op.execute(f"DROP INDEX IF EXISTS {name}")
+        op.execute(f"CREATE TABLE {table} ({columns}, PRIMARY KEY (id, {key})) PARTITION BY RANGE ({key})")
+        if seq:
+            _own_sequence(table, seq)
+        for name, cols in indexes.items():
+            op.execute(f"CREATE INDEX {name} ON {table} ({cols})")
+
+        op.execute(f"UPDATE {table}_unpartitioned SET {key} = NOW() WHERE {key} IS NULL")
+        first = conn.exec_driver_sql(f"SELECT MIN({key}) FROM {table}_unpartitioned").scalar() or now
+        first = first.astimezone(timezone.utc)
+        month = datetime(first.year, first.month, 1, tzinfo=timezone.utc)
+        last = _add_months(datetime(now.year, now.month, 1, tzinfo=timezone.utc), PREMAKE_MONTHS)
+        while month <= last:
+            name = f"{table}_p{month:%Y%m}"
+            op.execute(f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES "
+                       f"FROM ('{month:%Y-%m-%d} 00:00:00+00') TO ('{_add_months(month, 1):%Y-%m-%d} 00:00:00+00')")
+            for col in unique:
+                op.execute(f"CREATE UNIQUE INDEX {name}_{col}_key ON {name} ({col})")
+            month = _add_months(month, 1)
+
+        op.execute(f"INSERT INTO {table} SELECT * FROM {table}_unpartitioned")
+        op.execute(f"DROP TABLE {table}_unpartitioned")
+
+def downgrade():
+    conn = op.get_bind()
+    if conn.dialect.name != "postgresql":
+        return
+    for table, (columns, key, _, indexes) in TABLES.items():
+        seq = conn.exec_driver_sql(f"SELECT pg_get_serial_sequence('{table}', 'id')").scalar()
+        op.execute(f"ALTER TABLE {table} RENAME TO {table}_partitioned")
+        for name in indexes:
+            op.execute(f"ALTER INDEX IF EXISTS {name} RENAME TO {name}_partitioned")
+        op.execute(f"ALTER TABLE {table}_partitioned RENAME CONSTRAINT {table}_pkey TO {table}_partitioned_pkey")
+        op.execute(f"CREATE TABLE {table} ({columns}, PRIMARY KEY (id))")
+        # 0001 allowed NULL timestamps
+        op.execute(f"ALTER TABLE {table} ALTER COLUMN {key} DROP NOT NULL")
+        for col in LEGACY_UNIQUE.get(table, ()):
+            op.execute(f"ALTER TABLE {table} ADD CONSTRAINT {table}_{col}_key UNIQUE ({col})")
+        if seq:
+            _own_sequence(table, seq)
+        for name, (cols, is_unique) in LEGACY_INDEXES[table].items():
+            op.execute(f"CREATE {'UNIQUE ' if is_unique else ''}INDEX {name} ON {table} ({cols})")
+
+        # a redelivery across a month boundary may have left duplicates; keep the first
+        distinct = LEGACY_UNIQUE.get(table)
+        select = (f"SELECT DISTINCT ON ({', '.join(distinct)}) * FROM {table}_partitioned "
+                  f"ORDER BY {', '.join(distinct)}, id" if distinct else f"SELECT * FROM {table}_partitioned")
+        op.execute(f"INSERT INTO {table} {select}")
+        op.execute(f"DROP TABLE {table}_partitioned")
@@ -0,0 +1,189 @@
+# app/adapters/executor.py
+"""Concurrent adapter fan-out for defender3d.
+
+Adapters run in parallel on a shared thread pool. Each call has its own
+timeout and the whole fan-out has a deadline. Whatever has not answered by
+then is left out, so scoring goes ahead with partial adapter signals. Every
+vendor has a circuit breaker. Results are cached by the vault lookup key,
+so a repeat identity does not pay for a second vendor call.
+"""
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from ..config import settings
+from ..utils import metrics
+from ..utils.logging import logger
+from ..utils.ttlcache import TTLCache
+from ..vault.keys import lookup_key
+
+ADAPTER_SECONDS = metrics.histogram("fp_adapter_seconds", "Adapter call latency (including late answers)",
+                                    labels=("adapter",))
+ADAPTER_CALLS = metrics.counter("fp_adapter_calls_total", "Adapter lookups by outcome",
+                                labels=("adapter", "outcome"))
+
+class CircuitBreaker:
+    """closed -> open after `failure_threshold` consecutive failures;
+    open -> half-open (one trial call) after `reset_timeout` seconds."""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+@dataclass
+class AdapterRun:
+    scores: Dict[str, float] = field(default_factory=dict)
+    cached: List[str] = field(default_factory=list)
+    timed_out: List[str] = field(default_factory=list)
+    failed: List[str] = field(default_factory=list)
+    circuit_open: List[str] = field(default_factory=list)
+
+    @property
+    def degraded(self) -> List[str]:
+        return self.timed_out + self.failed + self.circuit_open
+
+
+class AdapterRunner:
+    def __init__(self, adapters: Dict[str, Callable[[str], float]],
+                 timeout: float = 0.3, deadline: float = 0.8,
+                 timeouts: Optional[Dict[str, float]] = None,
+                 cache: Optional[TTLCache] = None,
+                 failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 max_workers: int = 16,
+                 kinds: Optional[Dict[str, str]] = None):
+        self.adapters = adapters
+        # identity kind each adapter looks up (vault/keys.py); defaults to the adapter's name
+        self.kinds = kinds or {}
+        self.timeout = timeout
+        self.timeouts = timeouts or {}
+        self.deadline = deadline
+        self.cache = cache if cache is not None else TTLCache()
+        self.breakers = {name: CircuitBreaker(failure_threshold, reset_timeout) for name in adapters}
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="adapter")
+
+    def _call(self, name: str, value: str, key) -> float:
+        with ADAPTER_SECONDS.time(adapter=name):
+            score = float(self.adapters[name](value))
+        self.cache.put(key, score)  # late answers still warm the cache
+        return score
+
+    @staticmethod
+    def _settle(breaker: CircuitBreaker) -> Callable[[Future], None]:
+        def settle(fut: Future) -> None:
+            if fut.exception() is None:
+                breaker.record_success()
+            else:
+                breaker.record_failure()
+        return settle
+
+    def run(self, values: Dict[str, Optional[str]], budget: Optional[float] = None) -> AdapterRun:
+        """Score {adapter name: identifier}; empty identifiers score 0 without a call.
+
+        `budget` (seconds) is the caller's own, tighter limit (checkout
+        scoring). Calls it cuts off keep running: their answers warm the
+        cache and settle the breaker when they arrive, so a short budget
+        is not counted as a vendor failure.
+        """
+        out = AdapterRun()
+        started = time.monotonic()
+        futures: Dict[str, Future] = {}
+        for name, value in values.items():
+            if not value:
+                out.scores[name] = 0.0
+                continue
+            key = (name, lookup_key(value, self.kinds.get(name, name)))
+            hit = self.cache.get(key)
+            if hit is not None:
+                out.scores[name] = hit
+                out.cached.append(name)
+            elif not self.breakers[name].allow():
+                out.circuit_open.append(name)
+            else:
+                futures[name] = self._pool.submit(self._call, name, value, key)
+
+        for name, fut in futures.items():
+            # Per-adapter timeout, capped by the overall deadline (both from `started`)
+            limit = min(self.timeouts.get(name, self.timeout), self.deadline)
+            cut = budget is not None and budget < limit
+            left = (budget if cut else limit) - (time.monotonic() - started)
+            if left > 0:
+                wait([fut], timeout=left)
+            if not fut.done():
+                out.timed_out.append(name)
+                if cut:
+                    fut.add_done_callback(self._settle(self.breakers[name]))
+                else:
+                    self.breakers[name].record_failure()
+            elif fut.exception() is not None:
+                out.failed.append(name)
+                self.breakers[name].record_failure()
+                logger.warning("Adapter %s failed: %r", name, fut.exception())
+            else:
+                out.scores[name] = fut.result()
+                self.breakers[name].record_success()
+        for outcome, names in (("cached", out.cached), ("timeout", out.timed_out), ("error", out.failed),
+                               ("circuit_open", out.circuit_open)):
+            for name in names:
+                ADAPTER_CALLS.inc(adapter=name, outcome=outcome)
+        for name in futures.keys() - set(out.degraded):
+            ADAPTER_CALLS.inc(adapter=name, outcome="ok")
+        return out
+
+
+_runner: Optional[AdapterRunner] = None
+
+def get_adapter_runner() -> AdapterRunner:
+    global _runner
+    if _runner is None:
+        from .botcheck import score_device
+        from .emailrep import score_email
+        from .ipintel import score_ip
+        _runner = AdapterRunner(
+            {"email": score_email, "ip": score_ip, "device": score_device},
+            kinds={"email": "email", "ip": "ip", "device": "device"},
+            timeout=settings.ADAPTER_TIMEOUT_MS / 1000.0,
+            deadline=settings.ADAPTER_DEADLINE_MS / 1000.0,
+            cache=TTLCache(maxsize=settings.ADAPTER_CACHE_SIZE, ttl=settings.ADAPTER_CACHE_TTL),
+            failure_threshold=settings.ADAPTER_BREAKER_FAILURES,
+            reset_timeout=settings.ADAPTER_BREAKER_RESET_SECONDS,
+            max_workers=settings.ADAPTER_MAX_WORKERS,
+        )
+    return _runner
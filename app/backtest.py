@@ -0,0 +1,331 @@
+"""Replay historical orders through candidate rules and compare verdicts.
+
+    python -m app.backtest --candidate rules/next.json [--shop a.myshopify.com]
+        [--since 2025-06-01] [--until 2025-09-01] [--flips-out flips.csv] [--json]
+
+Reads the exact scoring inputs stored as `evidence_log` rows with
+key="input" (Postgres extracts only the fields the rules reference) and as
+compact `order_evidence` blobs (decoded positionally, see app/evidence), and
+streams them in chunks into NumPy columns. Both rulesets (baseline:
+the shop's current definition unless --baseline is given) are evaluated as
+vectorised masks over each chunk, so no per-order dict is ever built.
+Verdicts compare rules-only scores; adapter scores are not replayed.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.evidence import codec
+from app.models import EvidenceBlob, EvidenceLog, OrderEvidence
+from app.rules.engine import RuleError
+
+NUM, TEXT = "num", "text"
+_ORDERING = {"gt": np.greater, "gte": np.greater_equal, "lt": np.less, "lte": np.less_equal}
+
+
+class Columns:
+    """One chunk of orders as arrays, with derived views built on first use."""
+
+    def __init__(self, order_ids: np.ndarray, raw: Dict[Tuple[str, str], np.ndarray]):
+        self.order_ids = order_ids
+        self.n = len(order_ids)
+        self._raw = raw
+        self._views: Dict[tuple, np.ndarray] = {}
+
+    def num(self, field: str) -> np.ndarray:
+        key = (field, NUM)
+        if key not in self._views:
+            self._views[key] = np.nan_to_num(self._raw[key].astype(np.float64), nan=0.0)
+        return self._views[key]
+
+    def text(self, field: str) -> np.ndarray:
+        """Strings with missing values as ''."""
+        key = (field, TEXT)
+        if key not in self._views:
+            col = self._raw[key]
+            self._views[key] = np.where(col == None, "", col).astype(str)  # noqa: E711
+        return self._views[key]
+
+    def lower(self, field: str) -> np.ndarray:
+        key = (field, "lower")
+        if key not in self._views:
+            self._views[key] = np.char.lower(self.text(field))
+        return self._views[key]
+
+    def present(self, field: str) -> np.ndarray:
+        return self.text(field) != ""
+
+
+class VectorRuleset:
+    """A ruleset definition (same JSON as app/rules/engine) evaluated over Columns."""
+
+    def __init__(self, definition: dict, name: str = "ruleset"):
+        self.name = name
+        self.rules = [(r.get("id") or f"rule_{i}", float(r["score"]), r["when"])
+                      for i, r in enumerate(definition.get("rules") or [])]
+        self.max_score = float(definition.get("max_score", 100.0))
+        cutoffs = definition.get("verdicts", {"red": 70, "amber": 30})
+        self.verdict_cutoffs = sorted(((float(t), v) for v, t in cutoffs.items()), reverse=True)
+        self.fields: Dict[Tuple[str, str], None] = {}
+        for _, _, cond in self.rules:
+            self._collect(cond)
+
+    def _collect(self, c: dict) -> None:
+        for key in ("all", "any"):
+            if key in c:
+                for x in c[key]:
+                    self._collect(x)
+                return
+        if "not" in c:
+            return self._collect(c["not"])
+        op, value = c.get("op"), c.get("value")
+        numeric = op in _ORDERING or (op in ("eq", "ne") and isinstance(value, (int, float))
+                                      and not isinstance(value, bool))
+        self.fields[(c["field"], NUM if numeric else TEXT)] = None
+        if op in ("eq_field", "ne_field"):
+            self.fields[(value, TEXT)] = None
+
+    def _mask(self, c: dict, cols: Columns) -> np.ndarray:
+        if "all" in c:
+            out = np.ones(cols.n, dtype=bool)
+            for x in c["all"]:
+                out &= self._mask(x, cols)
+            return out
+        if "any" in c:
+            out = np.zeros(cols.n, dtype=bool)
+            for x in c["any"]:
+                out |= self._mask(x, cols)
+            return out
+        if "not" in c:
+            return ~self._mask(c["not"], cols)
+
+        f, op, value = c["field"], c["op"], c.get("value")
+        if op in _ORDERING:
+            return _ORDERING[op](cols.num(f), float(value))
+        if op in ("eq", "ne"):
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                hit = cols.num(f) == float(value)
+            elif value is None:
+                hit = ~cols.present(f)
+            else:
+                hit = cols.text(f) == str(value)
+            return hit if op == "eq" else ~hit
+        if op in ("in", "not_in"):
+            hit = np.isin(cols.text(f), [str(v) for v in value if v is not None])
+            if None in value:
+                hit |= ~cols.present(f)
+            return hit if op == "in" else ~hit
+        if op in ("endswith", "startswith"):
+            values = value if isinstance(value, list) else [value]
+            fn = np.char.endswith if op == "endswith" else np.char.startswith
+            low = cols.lower(f)
+            out = np.zeros(cols.n, dtype=bool)
+            for v in values:
+                out |= fn(low, v.lower())
+            return out
+        if op == "present":
+            return cols.present(f)
+        if op == "absent":
+            return ~cols.present(f)
+        if op in ("eq_field", "ne_field"):
+            both = cols.present(f) & cols.present(value)
+            same = cols.text(f) == cols.text(value)
+            return both & (same if op == "eq_field" else ~same)
+        raise RuleError(f"Unknown op: {op!r}")
+
+    def evaluate(self, cols: Columns) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (scores, fired) where fired is a (n_rules, n_orders) bool matrix."""
+        fired = np.zeros((len(self.rules), cols.n), dtype=bool)
+        scores = np.zeros(cols.n, dtype=np.float64)
+        for i, (_, score, cond) in enumerate(self.rules):
+            fired[i] = self._mask(cond, cols)
+            scores += fired[i] * score
+        return np.minimum(scores, self.max_score), fired
+
+    def verdicts(self, scores: np.ndarray) -> np.ndarray:
+        conds = [scores >= t for t, _ in self.verdict_cutoffs]
+        return np.select(conds, [v for _, v in self.verdict_cutoffs], default="green")
+
+
+def _columns(fields: List[Tuple[str, str]], order_ids, columns) -> Columns:
+    raw = {}
+    for (f, kind), col in zip(fields, columns):
+        if kind == NUM:
+            raw[(f, kind)] = np.array([np.nan if v is None else v for v in col], dtype=np.float64)
+        else:
+            raw[(f, kind)] = np.array(col, dtype=object)
+    return Columns(np.array(order_ids, dtype=object), raw)
+
+
+def _stream_legacy(db: Session, fields: List[Tuple[str, str]], chunk: int, shop: Optional[str],
+                   since: Optional[datetime], until: Optional[datetime]) -> Iterator[Columns]:
+    exprs = [EvidenceLog.value[f].as_float() if kind == NUM else EvidenceLog.value[f].as_string()
+             for f, kind in fields]
+    stmt = select(EvidenceLog.order_id, *exprs).where(EvidenceLog.key == "input")
+    if shop:
+        stmt = stmt.where(EvidenceLog.value["shop_id"].as_string() == shop)
+    if since:
+        stmt = stmt.where(EvidenceLog.created_at >= since)
+    if until:
+        stmt = stmt.where(EvidenceLog.created_at < until)
+    result = db.execute(stmt.order_by(EvidenceLog.id).execution_options(yield_per=chunk))
+    for rows in result.partitions(chunk):
+        columns = list(zip(*rows))
+        yield _columns(fields, columns[0], columns[1:])
+
+
+def _stream_compact(db: Session, fields: List[Tuple[str, str]], chunk: int, shop: Optional[str],
+                    since: Optional[datetime], until: Optional[datetime]) -> Iterator[Columns]:
+    stmt = (select(OrderEvidence.order_id, OrderEvidence.shop_id, EvidenceBlob.codec, EvidenceBlob.data)
+            .join(EvidenceBlob, EvidenceBlob.hash == OrderEvidence.input_hash))
+    if shop:
+        stmt = stmt.where(OrderEvidence.shop_id == shop)
+    if since:
+        stmt = stmt.where(OrderEvidence.created_at >= since)
+    if until:
+        stmt = stmt.where(OrderEvidence.created_at < until)
+    # (width, position of each field) per input layout; ROW_FIELDS missing from a layout come from the row
+    layouts = {c: (len(names), [names.index(f) if f in names else None for f, _ in fields])
+               for c, names in codec.INPUT_FIELDS.items()}
+    result = db.execute(stmt.order_by(OrderEvidence.order_id).execution_options(yield_per=chunk))
+    for rows in result.partitions(chunk):
+        order_ids, decoded = [], []
+        for order_id, shop_id, c, data in rows:
+            row = json.loads(codec.unpack(c, data))
+            width, positions = layouts[c]
+            extra = row[width] if len(row) > width else {}
+            known = {"order_id": order_id, "shop_id": shop_id}
+            order_ids.append(order_id)
+            decoded.append([row[i] if i is not None else extra.get(f, known.get(f))
+                            for i, (f, _) in zip(positions, fields)])
+        yield _columns(fields, order_ids, list(zip(*decoded)))
+
+
+def stream_columns(db: Session, fields: List[Tuple[str, str]], chunk: int = 50_000,
+                   shop: Optional[str] = None, since: Optional[datetime] = None,
+                   until: Optional[datetime] = None) -> Iterator[Columns]:
+    """Yield Columns chunks of stored scoring inputs from both evidence formats."""
+    yield from _stream_legacy(db, fields, chunk, shop, since, until)
+    yield from _stream_compact(db, fields, chunk, shop, since, until)
+
+
+def backtest(db: Session, baseline: VectorRuleset, candidate: VectorRuleset,
+             chunk: int = 50_000, shop: Optional[str] = None,
+             since: Optional[datetime] = None, until: Optional[datetime] = None,
+             show: int = 20, flips_out: Optional[str] = None) -> dict:
+    fields = list(dict.fromkeys(list(baseline.fields) + list(candidate.fields)))
+    total = 0
+    before, after, flips = Counter(), Counter(), Counter()
+    fired_b = np.zeros(len(baseline.rules), dtype=np.int64)
+    fired_c = np.zeros(len(candidate.rules), dtype=np.int64)
+    sample: List[dict] = []
+    writer = fh = None
+    if flips_out:
+        fh = open(flips_out, "w", newline="")
+        writer = csv.writer(fh)
+        writer.writerow(["order_id", "baseline_score", "baseline_verdict", "candidate_score", "candidate_verdict"])
+    started = time.perf_counter()
+    try:
+        for cols in stream_columns(db, fields, chunk=chunk, shop=shop, since=since, until=until):
+            sb, fb = baseline.evaluate(cols)
+            sc, fc = candidate.evaluate(cols)
+            vb, vc = baseline.verdicts(sb), candidate.verdicts(sc)
+            total += cols.n
+            fired_b += fb.sum(axis=1)
+            fired_c += fc.sum(axis=1)
+            for counter, verdicts in ((before, vb), (after, vc)):
+                names, counts = np.unique(verdicts, return_counts=True)
+                counter.update(dict(zip(names.tolist(), counts.tolist())))
+            idx = np.nonzero(vb != vc)[0]
+            if len(idx):
+                pairs, counts = np.unique(np.char.add(np.char.add(vb[idx], "->"), vc[idx]), return_counts=True)
+                flips.update(dict(zip(pairs.tolist(), counts.tolist())))
+                for i in idx[: max(0, show - len(sample))]:
+                    sample.append({"order_id": cols.order_ids[i], "baseline": [float(sb[i]), str(vb[i])],
+                                   "candidate": [float(sc[i]), str(vc[i])]})
+                if writer:
+                    writer.writerows(zip(cols.order_ids[idx], sb[idx], vb[idx], sc[idx], vc[idx]))
+    finally:
+        if fh:
+            fh.close()
+
+    n = total or 1
+    verdicts = sorted(set(before) | set(after))
+    return {
+        "orders": total,
+        "seconds": round(time.perf_counter() - started, 3),
+        "verdicts": {v: {"baseline": before[v], "candidate": after[v], "delta": after[v] - before[v]}
+                     for v in verdicts},
+        "flipped": sum(flips.values()),
+        "flips": dict(flips),
+        "rules": {
+            baseline.name: {rid: round(int(c) / n, 6) for (rid, _, _), c in zip(baseline.rules, fired_b)},
+            candidate.name: {rid: round(int(c) / n, 6) for (rid, _, _), c in zip(candidate.rules, fired_c)},
+        },
+        "flipped_orders": sample,
+    }
+
+
+def _load(path: str) -> dict:
+    with open(path, "rb") as fh:
+        return json.load(fh)
+
+def _print_report(report: dict, baseline: str, candidate: str) -> None:
+    print(f"{report['orders']} orders in {report['seconds']}s")
+    print(f"\n{'verdict':<10}{baseline:>14}{candidate:>14}{'delta':>10}")
+    for v, row in report["verdicts"].items():
+        print(f"{v:<10}{row['baseline']:>14}{row['candidate']:>14}{row['delta']:>+10}")
+    print(f"\nflipped: {report['flipped']}  " + "  ".join(f"{k}: {c}" for k, c in sorted(report["flips"].items())))
+    for name, rates in report["rules"].items():
+        print(f"\nfire rates ({name})")
+        for rid, rate in rates.items():
+            print(f"  {rid:<28}{rate:>10.4%}")
+    if report["flipped_orders"]:
+        print("\nsample flips")
+        for f in report["flipped_orders"]:
+            print(f"  {f['order_id']}: {f['baseline'][1]} ({f['baseline'][0]:g}) -> "
+                  f"{f['candidate'][1]} ({f['candidate'][0]:g})")
+
+def main(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description="Backtest candidate rules against stored order inputs")
+    ap.add_argument("--candidate", required=True, help="candidate ruleset JSON")
+    ap.add_argument("--baseline", help="baseline ruleset JSON (default: the shop's current ruleset)")
+    ap.add_argument("--shop")
+    ap.add_argument("--since", type=datetime.fromisoformat)
+    ap.add_argument("--until", type=datetime.fromisoformat)
+    ap.add_argument("--chunk", type=int, default=50_000)
+    ap.add_argument("--show", type=int, default=20, help="flipped orders to list")
+    ap.add_argument("--flips-out", help="write every flipped order to this CSV")
+    ap.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = ap.parse_args(argv)
+
+    from app.database import get_sessionmaker
+    from app.rules.ruleset import registry
+
+    baseline_path = args.baseline or registry.path_for(args.shop)
+    baseline = VectorRuleset(_load(baseline_path), name=os.path.basename(baseline_path))
+    candidate = VectorRuleset(_load(args.candidate), name=os.path.basename(args.candidate))
+    if baseline.name == candidate.name:
+        baseline.name, candidate.name = "baseline", "candidate"
+
+    with get_sessionmaker()() as db:
+        report = backtest(db, baseline, candidate, chunk=args.chunk, shop=args.shop,
+                          since=args.since, until=args.until, show=args.show, flips_out=args.flips_out)
+    if args.json:
+        json.dump(report, sys.stdout, indent=2, default=str)
+        print()
+    else:
+        _print_report(report, baseline.name, candidate.name)
+
+if __name__ == "__main__":
+    main()
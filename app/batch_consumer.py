@@ -0,0 +1,115 @@
+"""Batched order scoring consumer.
+
+Drains up to ORDER_BATCH_SIZE orders (or whatever arrived within
+ORDER_BATCH_WAIT_MS of the first one) from the Redis order queue, resolves
+every vault lookup in one query, scores them and writes all results in one
+transaction. If the batch fails, each order falls back to its own
+`process_order_async` task, which keeps the per-order retry semantics.
+
+    python -m app.batch_consumer --name scorer-1
+
+Enable with ORDER_BATCH_MODE=true so the webhook feeds this queue instead of
+enqueueing one Celery task per order. Give every consumer a stable --name:
+it owns the processing list that is replayed after a crash.
+"""
+import argparse
+import socket
+import time
+
+from app.celery_worker import (
+    ORDER_STAGE_SECONDS, QUEUE_WAIT_SECONDS, build_order_input, normalize_shop_domain,
+    process_order_async, save_results, score_orders, write_metafields,
+)
+from app.config import settings
+from app.database import get_sessionmaker
+from app.utils import metrics, order_queue
+from app.utils.logging import logger
+
+IDLE_POLL_SECONDS = 0.01
+
+def next_batch(consumer: str, size: int, wait_ms: int) -> list:
+    """Block until at least one order is available, then top up for wait_ms."""
+    batch = order_queue.claim(consumer, size)
+    while not batch:
+        time.sleep(IDLE_POLL_SECONDS)
+        batch = order_queue.claim(consumer, size)
+    deadline = time.monotonic() + wait_ms / 1000.0
+    while len(batch) < size:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        more = order_queue.claim(consumer, size - len(batch))
+        if more:
+            batch += more
+        else:
+            time.sleep(min(remaining, IDLE_POLL_SECONDS / 2))
+    return batch
+
+def _retry_individually(item: dict) -> None:
+    process_order_async.apply_async((item["shop_id"], item["order"], item.get("event_id")), countdown=1)
+
+def process_batch(items: list) -> int:
+    """Score and persist a batch; returns how many orders were written."""
+    ready, inputs, seen = [], [], set()
+    now = time.time()
+    for item in items:
+        if item.get("enqueued_at"):
+            QUEUE_WAIT_SECONDS.observe(max(0.0, now - item["enqueued_at"]), task="batch_consumer")
+        try:
+            data = build_order_input(normalize_shop_domain(item["shop_id"]), item["order"])
+        except Exception:
+            logger.warning("Order from %s not batchable, retrying on its own", item.get("shop_id"), exc_info=True)
+            _retry_individually(item)
+            continue
+        # one copy per order: save_results only takes back the counts of orders already stored,
+        # so a second copy in the same batch would be counted in the vault twice
+        if data["order_id"] in seen:
+            logger.info("Order %s appears twice in the batch, scoring it once", data["order_id"])
+            continue
+        seen.add(data["order_id"])
+        inputs.append(data)
+        ready.append(item)
+
+    SessionLocal = get_sessionmaker()
+    try:
+        with SessionLocal() as db:
+            results = score_orders(db, inputs)
+            with ORDER_STAGE_SECONDS.time(stage="commit"):
+                written = save_results(db, [(data, result, item.get("event_id"))
+                                            for data, result, item in zip(inputs, results, ready)])
+                db.commit()
+    except Exception:
+        logger.exception("Batch of %d orders failed, retrying each order individually", len(ready))
+        for item in ready:
+            _retry_individually(item)
+        return 0
+
+    with ORDER_STAGE_SECONDS.time(stage="metafields"):
+        for data, result, item in zip(inputs, results, ready):
+            write_metafields(data["shop_id"], item["order"].get("admin_graphql_api_id") or data["order_id"], result)
+    return len(written)
+
+def run(consumer: str, size: int, wait_ms: int) -> None:
+    replayed = order_queue.requeue_unacked(consumer)
+    if replayed:
+        logger.warning("Requeued %d unacknowledged orders for consumer %s", replayed, consumer)
+    logger.info("Batch consumer %s started (size=%d, wait=%dms)", consumer, size, wait_ms)
+    while True:
+        batch = next_batch(consumer, size, wait_ms)
+        started = time.perf_counter()
+        written = process_batch(batch)
+        order_queue.ack(consumer)
+        logger.info("Batch of %d orders (%d written) in %.1fms",
+                    len(batch), written, (time.perf_counter() - started) * 1000)
+
+def main():
+    ap = argparse.ArgumentParser(description="Batched order scoring consumer")
+    ap.add_argument("--name", default=socket.gethostname())
+    ap.add_argument("--size", type=int, default=settings.ORDER_BATCH_SIZE)
+    ap.add_argument("--wait-ms", type=int, default=settings.ORDER_BATCH_WAIT_MS)
+    args = ap.parse_args()
+    metrics.set_role("worker")  # exported with the Celery workers' series (needs METRICS_DIR)
+    run(args.name, args.size, args.wait_ms)
+
+if __name__ == "__main__":
+    main()
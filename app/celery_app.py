@@ -0,0 +1,66 @@
+"""The Celery app and its configuration, without any task code.
+
+The API only publishes tasks: it imports this and sends by name
+(celery.send_task("process_order_async", ...)), so the worker module,
+with its scoring pipeline and the requests-based Remix client, stays out
+of the web process. app/celery_worker.py defines the tasks on this app;
+point Celery at that module (celery -A app.celery_worker ...).
+"""
+import time
+from datetime import datetime
+
+from celery import Celery
+from celery.signals import before_task_publish
+
+from app.config import settings
+from app.utils.logging import logger
+
+REDIS_URL = settings.REDIS_URL
+
+celery = Celery("fraudpop", broker=REDIS_URL, backend=REDIS_URL)
+
+def _serializers() -> tuple:
+    """(task serializer, accepted content types); msgpack only when it is installed."""
+    try:
+        import msgpack  # noqa: F401  (kombu registers its serializer when importable)
+    except ImportError:
+        if settings.CELERY_TASK_SERIALIZER == "msgpack":
+            logger.warning("CELERY_TASK_SERIALIZER=msgpack but msgpack is not installed; using json")
+        return "json", ["json"]
+    return settings.CELERY_TASK_SERIALIZER, ["json", "msgpack"]
+
+TASK_SERIALIZER, ACCEPT_CONTENT = _serializers()
+
+celery.conf.update(
+    task_serializer=TASK_SERIALIZER,
+    task_compression=settings.CELERY_TASK_COMPRESSION,
+    result_serializer="json",
+    accept_content=ACCEPT_CONTENT,
+    broker_connection_retry_on_startup=True,
+    broker_pool_limit=settings.CELERY_BROKER_POOL_LIMIT,
+    worker_prefetch_multiplier=1,
+    # scoring and its side effects on separate queues, so a metafield backlog never delays verdicts
+    task_routes={
+        "process_order_async": {"queue": "scoring"},
+        "score_next": {"queue": "scoring"},
+        "flush_metafields": {"queue": "metafields"},
+    },
+    beat_schedule={
+        "webhook-events-flush": {"task": "flush_webhook_events", "schedule": 5.0},
+        "captures-flush": {"task": "flush_captures", "schedule": settings.CAPTURE_FLUSH_SECONDS},
+        "identity-graph-apply": {"task": "apply_identity_links", "schedule": 5.0},
+        "partition-maintenance": {"task": "maintain_partitions", "schedule": 3600.0},
+    },
+)
+
+# ---------- publish side of the queue-wait metric (observed in celery_worker.py) ----------
+ENQUEUED_HEADER = "fp_enqueued_at"
+
+@before_task_publish.connect
+def _stamp_enqueue_time(headers=None, **_):
+    if headers is None:
+        return
+    ready_at = time.time()
+    if headers.get("eta"):
+        ready_at = max(ready_at, datetime.fromisoformat(headers["eta"]).timestamp())
+    headers[ENQUEUED_HEADER] = ready_at
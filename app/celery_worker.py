@@ -1,31 +1,72 @@
-import os, time, json, requests, hashlib, re
-from celery import Celery
-from sqlalchemy import select
+import os, json, re, time
+from collections import Counter
+from datetime import datetime
+from celery.signals import task_prerun, worker_init, worker_process_init
+from sqlalchemy import insert, update
 from sqlalchemy.orm import Session
 
+from app import celery_app, partitions
 from app.config import settings
-from app.database import get_sessionmaker
-from app.models import OrderRisk, EvidenceLog, WebhookEvent, RiskIdentity
+from app.database import get_sessionmaker, dialect_insert, reset_engines, warm_engine
+from app.models import OrderRisk, EvidenceLog, WebhookEvent, DeviceCapture
 from app.rules.defender3d import defender3d
+from app.scoring import IDENTITY_FIELDS, identity_keys
+from app.evidence.repository import write_evidence
+from app.vault import graph, velocity
+from app.vault.keys import get_key_deriver
+from app.vault.repository import cached_lookup_counts, observe_identities, release_counts
+from redis.exceptions import RedisError
 from app.utils.logging import logger
-from urllib.parse import urljoin
+from app.utils import fair_queue, metrics
+from app.utils.idempotency import peek_pending_events, trim_pending_events
+from app.utils.capture_buffer import peek_captures, trim_captures
+from app.utils.redis_client import get_redis, reset_redis
+from app.utils.remix import RemixError, RemixRetryableError, get_remix_client
 
-REDIS_URL = settings.REDIS_URL
+# the app and its config live in app/celery_app.py, which the API imports to publish
+celery = celery_app.celery
+TASK_SERIALIZER, ACCEPT_CONTENT = celery_app.TASK_SERIALIZER, celery_app.ACCEPT_CONTENT
 
-celery = Celery("fraudpop", broker=REDIS_URL, backend=REDIS_URL)
+SHOPIFY_API_VERSION = "2025-01"
 
-celery.conf.update(
-    task_serializer="json",
-    result_serializer="json",
-    accept_content=["json"],
-    broker_connection_retry_on_startup=True,
-    worker_prefetch_multiplier=1,
-)
+# ---------- metrics (app/utils/metrics.py) ----------
+ENQUEUED_HEADER = celery_app.ENQUEUED_HEADER
+QUEUE_WAIT_SECONDS = metrics.histogram(
+    "fp_queue_wait_seconds", "Enqueue to task start, not counting a requested countdown/ETA",
+    labels=("task",), buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0))
+ORDER_STAGE_SECONDS = metrics.histogram(
+    "fp_order_stage_seconds", "Order pipeline stages, per call (one order, or one batch in ORDER_BATCH_MODE)",
+    labels=("stage",))
 
-SHOPIFY_API_VERSION = "2025-01"
+@task_prerun.connect
+def _observe_queue_wait(task=None, **_):
+    enqueued = task.request.get(ENQUEUED_HEADER) or (task.request.headers or {}).get(ENQUEUED_HEADER)
+    if enqueued:
+        QUEUE_WAIT_SECONDS.observe(max(0.0, time.time() - float(enqueued)), task=task.name)
 
-REMIX_URL = settings.REMIX_URL
-INTERNAL_SHARED_SECRET = settings.INTERNAL_SHARED_SECRET
+@worker_init.connect
+def _start_metrics_exporter(**_):
+    metrics.set_role("worker")
+    if not settings.WORKER_METRICS_PORT:
+        return
+    if not settings.METRICS_DIR:
+        logger.warning("METRICS_DIR is not set: the worker exporter only sees its own process, "
+                       "not prefork children")
+    try:
+        metrics.serve(settings.WORKER_METRICS_PORT)
+    except OSError:
+        logger.warning("Worker metrics port %d unavailable; another worker on this host exports it",
+                       settings.WORKER_METRICS_PORT)
+
+@worker_process_init.connect
+def _reset_inherited_connections(**_):
+    # a prefork child must not share the parent's pooled sockets; open its own before the first task
+    reset_engines()
+    reset_redis()
+    try:
+        warm_engine()
+    except Exception:
+        logger.warning("DB warm-up failed in worker process %d", os.getpid(), exc_info=True)
 
 MYSHOPIFY_RE = re.compile(r"^[a-z0-9][a-z0-9-]*\.myshopify\.com$", re.I)
 
@@ -49,18 +90,9 @@ def extract_note_attr(order: dict, key: str):
         return na.get(key)  # fallback if you ever get dict shape
     return None
 
-def metafields_set_via_remix(shop: str, order_id_or_gid, result: dict) -> None:
-    logger.info("metafields_set_via_remix called for shop %s order %s result %s", shop, order_id_or_gid, result)
-    shop = normalize_shop_domain(shop)
-    owner_id = to_order_gid(order_id_or_gid)
-
-    logger.info(
-        "Writing metafields for order %s in shop %s (verdict=%s, score=%s)",
-        owner_id, shop, result.get("verdict"), result.get("final_score")
-    )
-
-    variables = [{
-        "ownerId": owner_id,
+def risk_metafield(order_id_or_gid, result: dict) -> dict:
+    return {
+        "ownerId": to_order_gid(order_id_or_gid),
         "namespace": "fraudpop",
         "key": "risk",
         "type": "json",
@@ -70,75 +102,49 @@ def metafields_set_via_remix(shop: str, order_id_or_gid, result: dict) -> None:
             "verdict": result["verdict"],
             "reasons": result["reasons"],
         }),
-    }]
-
-    base = (REMIX_URL or "").strip().rstrip("/")
-    url = urljoin(base + "/", "api/metafields-set")
-
-    payload = {"shop": shop, "metafields": variables}
-    headers = {
-        "Accept": "application/json",
-        "Content-Type": "application/json",
-        "x-internal-auth": INTERNAL_SHARED_SECRET,
-        "User-Agent": "fraudpop-backend/1.0 (+requests)",
     }
 
-    def _post_once():
-        r = requests.post(url, headers=headers, json=payload, timeout=12, allow_redirects=False)
-        if 300 <= r.status_code < 400:
-            loc = r.headers.get("Location", "")
-            raise RuntimeError(f"Unexpected redirect {r.status_code} to {loc} (POST {url})")
-        try:
-            r.raise_for_status()
-        except requests.HTTPError:
-            snippet = (r.text or "")[:1000]
-            logger.error("metafieldsSet HTTP %s\nURL: %s\nCT: %s\nBody:\n%s",
-                         r.status_code, r.url, r.headers.get("Content-Type"), snippet)
-            raise
-        ct = (r.headers.get("Content-Type") or "").lower()
-        if "application/json" not in ct:
-            snippet = (r.text or "")[:1000]
-            raise RuntimeError(f"Non-JSON response ({ct or 'no content-type'}) from {r.url}:\n{snippet}")
-        try:
-            return r.json()
-        except ValueError:
-            snippet = (r.text or "")[:1000]
-            raise RuntimeError(f"Invalid JSON from {r.url}:\n{snippet}")
-
-    for attempt in range(3):
-        try:
-            data = _post_once()
-            if not data.get("ok"):
-                logger.error("metafieldsSet failed JSON: %s", data)
-                raise RuntimeError(f"metafieldsSet failed: {data}")
-            logger.info("metafieldsSet success: %s", data)
-            return
-        except RuntimeError as e:
-            msg = str(e)
-            if (re.search(r"\b429\b", msg) or re.search(r"\bHTTP 5\d{2}\b", msg)) and attempt < 2:
-                sleep = 1.5 * (attempt + 1)
-                logger.warning("Retrying metafieldsSet in %.1fs due to: %s", sleep, msg)
-                time.sleep(sleep)
-                continue
-            raise
-# ---------- deterministic lookup key for velocity counting ----------
-def lookup_key(value: str, pepper: str = "fraudpop_pepper_v1") -> str:
-    return hashlib.sha256((pepper + value).encode("utf-8")).hexdigest()
+# ---------- vault enrichment ----------
+def enrich_repeat_counts(db: Session, orders: list) -> None:
+    """Count every order in the vault and fill its repeat_* with the prior counts.
 
+    One upsert for the whole batch under the current key version (see
+    observe_identities); counts still held under older key versions are
+    added from a cached lookup, so a pepper rotation does not reset them.
+    """
+    deriver = get_key_deriver()
+    per_order = [identity_keys(d) for d in orders]
+    seen = observe_identities(db, [keys.values() for keys in per_order])
+    older = [{repeat: [(kind, k) for k in deriver.read_keys(d[field], kind)[1:]]
+              for kind, field, repeat in IDENTITY_FIELDS if d.get(field)} for d in orders]
+    wanted = {k for keys in older for ks in keys.values() for k in ks}
+    old_counts = cached_lookup_counts(db, wanted) if wanted else {}
+    for d, keys, prior, old in zip(orders, per_order, seen, older):
+        for repeat, key in keys.items():
+            d[repeat] = prior[key] + sum(old_counts.get(k, 0) for k in old[repeat])
 
-@celery.task(name="ping")
-def ping():
-    logger.info("ping received")
-    return "pong"
+def enrich_velocity(orders: list) -> None:
+    """Add repeat_*_{window} counts from the Redis velocity counters (one round trip)."""
+    per_order = [identity_keys(d) for d in orders]
+    for d in orders:
+        d.update(velocity.empty_fields(repeat for _, _, repeat in IDENTITY_FIELDS))
+    try:
+        windows = velocity.observe_many(
+            [(f"{d['shop_id']}:{d['order_id']}", list(keys.values())) for d, keys in zip(orders, per_order)]
+        )
+    except RedisError:
+        logger.warning("Velocity counters unavailable for %d order(s)", len(orders), exc_info=True)
+        return
+    for d, keys, counts in zip(orders, per_order, windows):
+        for repeat, key in keys.items():
+            for name, count in counts[key].items():
+                d[f"{repeat}_{name}"] = count
 
-@celery.task(name="process_order_async", autoretry_for=(Exception,), retry_backoff=True, max_retries=5)
-def process_order_async(shop_id: str, order: dict):
-    shop_domain = normalize_shop_domain(shop_id)
-    order_id_str = str(order.get("id"))
-    order_gid = order.get("admin_graphql_api_id") or order_id_str
-    data = {
+# ---------- scoring pipeline (shared by the per-order task and the batch consumer) ----------
+def build_order_input(shop_domain: str, order: dict) -> dict:
+    return {
         "shop_id": shop_domain,
-        "order_id": order_id_str,
+        "order_id": str(order.get("id")),
         "total_price": float(order.get("total_price", 0) or 0),
         "currency": order.get("currency"),
         "email": (order.get("email") or "").lower(),
@@ -152,68 +158,281 @@ def process_order_async(shop_id: str, order: dict):
         "repeat_device": 0,
     }
 
+def enrich_cluster_size(db: Session, orders: list) -> None:
+    """cluster_size: distinct identities linked to each order in the identity graph (one query)."""
+    if not settings.IDENTITY_GRAPH_KINDS:
+        return
+    sizes = graph.cluster_sizes(db, [identity_keys(d).values() for d in orders], settings.IDENTITY_GRAPH_KINDS)
+    for d, n in zip(orders, sizes):
+        d["cluster_size"] = n
+
+def score_orders(db: Session, inputs: list) -> list:
+    """Enrich and score many orders with one vault query and one Redis round trip."""
+    with ORDER_STAGE_SECONDS.time(stage="vault"):
+        enrich_repeat_counts(db, inputs)
+        enrich_cluster_size(db, inputs)
+    with ORDER_STAGE_SECONDS.time(stage="velocity"):
+        enrich_velocity(inputs)
+    results = []
+    with ORDER_STAGE_SECONDS.time(stage="defender3d"):
+        for data in inputs:
+            result = defender3d(data)
+            logger.info("Order %s scored %s (%s)", data["order_id"], result["final_score"], result["verdict"])
+            results.append(result)
+    return results
+
+def save_results(db: Session, scored: list) -> set:
+    """Bulk-write (data, result, event_id) triples; no commit.
+
+    One multi-row INSERT per table. Orders that already have an order_risk
+    row are skipped (redelivery); returns the order ids actually written.
+    """
+    if not scored:
+        return set()
+    ins = dialect_insert(db)(OrderRisk).values([{
+        "shop_id": data["shop_id"],
+        "order_id": data["order_id"],
+        "total_price": data["total_price"],
+        "currency": data["currency"],
+        "email": data["email"],
+        "ip": data["ip"],
+        "country": data["country"],
+        "score": result["final_score"],
+        "rules_score": result["rules_score"],
+        "verdict": result["verdict"],
+        "reasons": result["reasons"],
+    } for data, result, _ in scored])
+    written = set(db.execute(
+        ins.on_conflict_do_nothing(index_elements=["order_id"]).returning(OrderRisk.order_id)
+    ).scalars())
+
+    # take back the vault sighting score_orders() counted for a redelivered order
+    redelivered = Counter(k for data, _, _ in scored if data["order_id"] not in written
+                          for k in identity_keys(data).values())
+    if redelivered:
+        release_counts(db, redelivered)
+
+    if settings.IDENTITY_GRAPH_KINDS:
+        graph.record_edges(db, [identity_keys(data).values() for data, _, _ in scored
+                                if data["order_id"] in written], settings.IDENTITY_GRAPH_KINDS)
+
+    evidence = [(data, result) for data, result, _ in scored if data["order_id"] in written]
+    if evidence and settings.EVIDENCE_FORMAT == "compact":
+        write_evidence(db, evidence)
+    elif evidence:
+        db.execute(insert(EvidenceLog).values(
+            [{"order_id": d["order_id"], "key": k, "value": v}
+             for d, r in evidence for k, v in (("input", d), ("scores", r))]))
+
+    events = {event_id: data["shop_id"] for data, _, event_id in scored if event_id}
+    if events:
+        ins = dialect_insert(db)(WebhookEvent).values([
+            {"event_id": e, "shop_id": shop, "topic": "orders/create", "processed": True}
+            for e, shop in sorted(events.items())
+        ])
+        # Insert or mark processed: the batched webhook_events flush may not have written the row yet.
+        # Two statements, as ON CONFLICT DO UPDATE needs a table-wide unique key (app/partitions.py).
+        db.execute(ins.on_conflict_do_nothing())
+        db.execute(update(WebhookEvent).where(WebhookEvent.event_id.in_(sorted(events)),
+                                              WebhookEvent.processed.is_(False)).values(processed=True))
+    return written
+
+# ---------- metafield writer (own queue, coalesced per shop) ----------
+MF_PENDING_PREFIX = "fp:mf:pending:"
+MF_SCHEDULED_PREFIX = "fp:mf:scheduled:"
+MF_BATCH = 25  # metafieldsSet takes at most 25 metafields per call
+MF_SCHEDULED_TTL = 600
+
+def schedule_metafields_flush(shop_domain: str, countdown: float) -> None:
+    # At most one pending flush per shop; later orders ride along with it
+    if get_redis().set(MF_SCHEDULED_PREFIX + shop_domain, 1, nx=True, ex=MF_SCHEDULED_TTL):
+        flush_metafields.apply_async((shop_domain,), countdown=countdown)
+
+def write_metafields(shop_domain: str, order_gid, result: dict) -> None:
+    """Queue the order's risk metafield for the shop's next coalesced write."""
+    try:
+        get_redis().rpush(MF_PENDING_PREFIX + shop_domain, json.dumps(risk_metafield(order_gid, result)))
+        schedule_metafields_flush(shop_domain, settings.METAFIELD_COALESCE_SECONDS)
+    except Exception:
+        logger.exception("Metafield enqueue failed for order %s", order_gid)
+
+@celery.task(name="ping")
+def ping():
+    logger.info("ping received")
+    return "pong"
+
+@celery.task(name="apply_identity_links")
+def apply_identity_links():
+    """Merge newly recorded identity-graph edges into the persisted union-find."""
+    lock = get_redis().lock("fp:graph:apply-lock", timeout=120, blocking=False)
+    if not lock.acquire():
+        return 0
+    applied = 0
+    try:
+        SessionLocal = get_sessionmaker()
+        while True:
+            with SessionLocal() as db:
+                n = graph.apply_links(db)
+                db.commit()
+            applied += n
+            if n < graph.APPLY_BATCH:
+                break
+    finally:
+        lock.release()
+    if applied:
+        logger.info("Applied %d identity graph edges", applied)
+    return applied
+
+WEBHOOK_FLUSH_BATCH = 500
+
+@celery.task(name="flush_webhook_events")
+def flush_webhook_events():
+    """Write admitted webhooks queued in Redis to webhook_events in batches."""
+    lock = get_redis().lock("fp:wh:flush-lock", timeout=60, blocking=False)
+    if not lock.acquire():
+        return 0
+    written = 0
+    try:
+        SessionLocal = get_sessionmaker()
+        while True:
+            batch = peek_pending_events(WEBHOOK_FLUSH_BATCH)
+            if not batch:
+                break
+            with SessionLocal() as db:
+                ins = dialect_insert(db)(WebhookEvent).values(batch)
+                db.execute(ins.on_conflict_do_nothing())
+                db.commit()
+            trim_pending_events(len(batch))
+            written += len(batch)
+    finally:
+        lock.release()
+    if written:
+        logger.info("Flushed %d webhook events", written)
+    return written
+
+@celery.task(name="flush_captures")
+def flush_captures():
+    """Bulk-load buffered /v1/capture events into device_captures."""
+    lock = get_redis().lock("fp:capture:flush-lock", timeout=60, blocking=False)
+    if not lock.acquire():
+        return 0
+    written = 0
+    try:
+        SessionLocal = get_sessionmaker()
+        # bounded per run so the lock cannot outlive a long drain
+        while written < settings.CAPTURE_BUFFER_MAX:
+            batch = peek_captures(settings.CAPTURE_FLUSH_BATCH)
+            if not batch:
+                break
+            for rec in batch:
+                rec["created_at"] = datetime.fromisoformat(rec["created_at"])
+            with SessionLocal() as db:
+                db.execute(insert(DeviceCapture).values(batch))
+                db.commit()
+            trim_captures(len(batch))
+            written += len(batch)
+    finally:
+        lock.release()
+    if written:
+        logger.info("Flushed %d device captures", written)
+    return written
+
+@celery.task(name="maintain_partitions")
+def maintain_partitions():
+    """Create upcoming monthly partitions; archive and drop expired ones (app/partitions.py)."""
+    lock = get_redis().lock("fp:partitions:lock", timeout=3600, blocking=False)
+    if not lock.acquire():
+        return None
+    try:
+        done = partitions.maintain()
+    finally:
+        lock.release()
+    if any(done.values()):
+        logger.info("Partition maintenance: %s", {k: v for k, v in done.items() if v})
+    return done
+
+@celery.task(name="flush_metafields", bind=True, max_retries=5)
+def flush_metafields(self, shop_domain: str):
+    """Send a shop's queued metafields in one /api/metafields-set call.
+
+    The batch is read without removing it and trimmed only once the call
+    has succeeded or been given up on, so a worker that dies mid-call
+    leaves it queued for the shop's next flush.
+    """
+    r = get_redis()
+    pending = MF_PENDING_PREFIX + shop_domain
+    retrying = False
+    try:
+        items = r.lrange(pending, 0, MF_BATCH - 1)
+        if items:
+            try:
+                with ORDER_STAGE_SECONDS.time(stage="metafields_set"):
+                    get_remix_client().metafields_set(shop_domain, [json.loads(x) for x in items])
+                logger.info("Metafields written for %d orders in shop %s", len(items), shop_domain)
+            except RemixRetryableError as e:
+                if self.request.retries < self.max_retries:
+                    countdown = e.retry_after or 2 ** self.request.retries
+                    logger.warning("Retrying metafieldsSet for %s in %.1fs due to: %s", shop_domain, countdown, e)
+                    retrying = True  # the retry keeps the shop's schedule slot
+                    raise self.retry(exc=e, countdown=countdown)
+                logger.error("Dropping %d metafield writes for %s after retries: %s", len(items), shop_domain, e)
+            except RemixError:
+                logger.exception("Metafield write for %d orders in %s rejected", len(items), shop_domain)
+            r.ltrim(pending, len(items), -1)
+    finally:
+        if not retrying:
+            r.delete(MF_SCHEDULED_PREFIX + shop_domain)
+    if r.llen(pending):
+        schedule_metafields_flush(shop_domain, 0)
+    return len(items)
+
+def _process_order(shop_id: str, order: dict, event_id: str | None) -> dict:
+    shop_domain = normalize_shop_domain(shop_id)
+    order_gid = order.get("admin_graphql_api_id") or str(order.get("id"))
+    data = build_order_input(shop_domain, order)
+
     logger.info("Processing order %s for shop %s", data["order_id"], shop_domain)
 
     SessionLocal = get_sessionmaker()
     with SessionLocal() as db:
         try:
-            if data["email"]:
-                k = lookup_key(data["email"])
-                row = db.execute(
-                    select(RiskIdentity).where(RiskIdentity.kind=="email", RiskIdentity.hash==k)
-                ).scalar_one_or_none()
-                if row: data["repeat_email"] = row.seen_count
-
-            if data["ip"]:
-                k = lookup_key(data["ip"])
-                row = db.execute(
-                    select(RiskIdentity).where(RiskIdentity.kind=="ip", RiskIdentity.hash==k)
-                ).scalar_one_or_none()
-                if row: data["repeat_ip"] = row.seen_count
-
-            if data["device_id"]:
-                k = lookup_key(data["device_id"])
-                row = db.execute(
-                    select(RiskIdentity).where(RiskIdentity.kind=="device", RiskIdentity.hash==k)
-                ).scalar_one_or_none()
-                if row: data["repeat_device"] = row.seen_count
-
-            result = defender3d(data)
-            logger.info("Order %s scored %s (%s)", data["order_id"], result["final_score"], result["verdict"])
-
-            rec = OrderRisk(
-                shop_id=shop_domain,
-                order_id=data["order_id"],
-                total_price=data["total_price"],
-                currency=data["currency"],
-                email=data["email"],
-                ip=data["ip"],
-                country=data["country"],
-                score=result["final_score"],
-                rules_score=result["rules_score"],
-                verdict=result["verdict"],
-                reasons=result["reasons"],
-            )
-            db.add(rec)
-            db.add(EvidenceLog(order_id=data["order_id"], key="input", value=data))
-            db.add(EvidenceLog(order_id=data["order_id"], key="scores", value=result))
-
-            wh = db.query(WebhookEvent).filter_by(
-                shop_id=shop_domain,
-                event_id=(order.get("admin_graphql_api_id") or "none"),
-            ).first()
-            if wh: wh.processed = True
-
-            db.commit()
+            result = score_orders(db, [data])[0]
+            with ORDER_STAGE_SECONDS.time(stage="commit"):
+                save_results(db, [(data, result, event_id)])
+                db.commit()
         except Exception:
             db.rollback()
             raise
 
-    try:
-        metafields_set_via_remix(shop_domain, order_gid, result)
-        logger.info("Metafields written successfully for order %s", order_id_str)
-    except Exception:
-        logger.exception("Metafield write failed")
-        pass
+    with ORDER_STAGE_SECONDS.time(stage="metafields"):
+        write_metafields(shop_domain, order_gid, result)
 
     return {"ok": True, "order_id": data["order_id"], "score": result["final_score"], "verdict": result["verdict"]}
+
+@celery.task(name="process_order_async", autoretry_for=(Exception,), retry_backoff=True, max_retries=5)
+def process_order_async(shop_id: str, order: dict, event_id: str | None = None):
+    return _process_order(shop_id, order, event_id)
+
+@celery.task(name="score_next", bind=True, max_retries=None)
+def score_next(self):
+    """Score the next order picked by the per-shop fair queue (FAIR_SCHEDULING).
+
+    One of these is sent per queued order. If every shop with queued orders
+    is at its concurrency cap, it retries after FAIR_RETRY_SECONDS.
+    """
+    got = fair_queue.claim()
+    if got is None:
+        if fair_queue.pending():
+            raise self.retry(countdown=settings.FAIR_RETRY_SECONDS)
+        return None  # another token already took this one's order
+    shop, item, token = got
+    QUEUE_WAIT_SECONDS.observe(max(0.0, time.time() - item["enqueued_at"]), task="fair_queue")
+    try:
+        return _process_order(item["shop_id"], item["order"], item["event_id"])
+    except Exception:
+        # hand the order to the per-order task's backoff retries instead of holding the shop's slot
+        logger.exception("Fair-queue order for shop %s failed; retrying via process_order_async", shop)
+        process_order_async.apply_async((item["shop_id"], item["order"], item["event_id"]), countdown=1)
+        return None
+    finally:
+        fair_queue.release(shop, token)
@@ -1,3 +1,5 @@
+from typing import Literal
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
@@ -17,6 +19,116 @@ class Settings(BaseSettings):
     APP_BASE_URL: str = "http://localhost:8000"
     ENV: str = "dev"
 
+    # Connection pools, per process. The DB pool settings apply to postgres only; sqlite keeps its
+    # defaults. DB_POOL_WARM connections are opened at API startup and in each Celery child.
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30.0
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_WARM: int = 2
+    # API routes on asyncpg AsyncSessions. Off: the same routes get sync psycopg sessions whose calls
+    # run in the threadpool (app/database.ThreadedSession), which measured faster (bench/async_db.py)
+    DB_ASYNC_DRIVER: bool = False
+    REDIS_MAX_CONNECTIONS: int | None = None
+    REDIS_CONNECT_TIMEOUT: float = 0.5
+    REDIS_SOCKET_TIMEOUT: float = 2.0
+    CELERY_BROKER_POOL_LIMIT: int = 10
+
+    # Per-process cache of vault seen_count values (see app/vault/cache.py). Writes from other
+    # processes reach it within VAULT_CACHE_SYNC_SECONDS through a Redis stream, read by a
+    # background thread (0 = TTL only)
+    VAULT_CACHE_SIZE: int = 50_000
+    VAULT_CACHE_TTL: float = 30.0
+    VAULT_CACHE_SYNC_SECONDS: float = 0.25
+
+    # Vault lookup keys (app/vault/keys.py): VAULT_PEPPER keys VAULT_KEY_VERSION;
+    # older versions stay readable while their peppers are listed here
+    VAULT_KEY_VERSION: int = 1
+    VAULT_PREVIOUS_PEPPERS: dict[int, str] = {}
+    VAULT_READ_LEGACY_KEYS: bool = True
+    VAULT_KEY_MEMO_SIZE: int = 100_000
+
+    # Host-shared Bloom filter of vault keys (app/vault/bloom.py); off when unset
+    VAULT_BLOOM_PATH: str | None = None
+    VAULT_BLOOM_CAPACITY: int = 10_000_000
+    VAULT_BLOOM_FP_RATE: float = 0.01
+    VAULT_BLOOM_REBUILD_SECONDS: float = 86400.0
+
+    # Identity graph (app/vault/graph.py): kinds linked per order; empty disables it
+    IDENTITY_GRAPH_KINDS: list[str] = ["email", "device"]
+
+    # Webhook admission: Redis dedup window (Shopify retries for up to 48h)
+    WEBHOOK_DEDUP_TTL: int = 3 * 86400
+
+    # Batched scoring (app/batch_consumer.py) instead of one Celery task per order
+    ORDER_BATCH_MODE: bool = False
+    ORDER_BATCH_SIZE: int = 200
+    ORDER_BATCH_WAIT_MS: int = 50
+
+    # Celery messages: serializer ("json", or "msgpack" when msgpack is installed) and
+    # optional compression ("zlib", "gzip", ...). Workers always accept json and msgpack.
+    CELERY_TASK_SERIALIZER: str = "json"
+    CELERY_TASK_COMPRESSION: str | None = None
+
+    # Per-shop fair scheduling on the "scoring" queue (app/utils/fair_queue.py): weights
+    # (default 1) and in-flight caps per shop domain; 0 means no cap
+    FAIR_SCHEDULING: bool = False
+    FAIR_SHOP_WEIGHTS: dict[str, float] = {}
+    FAIR_SHOP_CONCURRENCY: int = 4
+    FAIR_SHOP_CONCURRENCY_OVERRIDES: dict[str, int] = {}
+    FAIR_LEASE_SECONDS: float = 300.0
+    FAIR_RETRY_SECONDS: float = 0.5
+
+    # Metafield writer: "metafields" Celery queue, coalesced per shop
+    REMIX_POOL_SIZE: int = 10
+    METAFIELD_COALESCE_SECONDS: float = 1.0
+
+    # Adapter fan-out in defender3d (app/adapters/executor.py)
+    ADAPTER_TIMEOUT_MS: int = 300
+    ADAPTER_DEADLINE_MS: int = 800
+    ADAPTER_CACHE_SIZE: int = 100_000
+    ADAPTER_CACHE_TTL: float = 900.0
+    ADAPTER_BREAKER_FAILURES: int = 5
+    ADAPTER_BREAKER_RESET_SECONDS: float = 30.0
+    ADAPTER_MAX_WORKERS: int = 16
+
+    # Checkout-time POST /v1/score (app/scoring.py): lookups and adapters that miss the budget are
+    # skipped; SCORE_RESERVE_MS of it is kept for the rules and the response. Past SCORE_MAX_PENDING
+    # lookups still running after their request, new checkouts skip the lookups
+    SCORE_BUDGET_MS: float = 20.0
+    SCORE_RESERVE_MS: float = 2.0
+    SCORE_MAX_PENDING: int = 64
+
+    # Rule definitions: <RULES_DIR>/default.json and optional <shop>.json overrides
+    RULES_DIR: str | None = None
+    RULES_RELOAD_SECONDS: float = 5.0
+
+    # "compact" (order_evidence + evidence_blob) or "json" (legacy evidence_log rows)
+    EVIDENCE_FORMAT: str = "compact"
+
+    # Buffered /v1/capture: Redis list drained by flush_captures (app/utils/capture_buffer.py)
+    CAPTURE_BUFFER_MODE: bool = False
+    CAPTURE_BUFFER_MAX: int = 200_000
+    CAPTURE_FLUSH_BATCH: int = 2000
+    CAPTURE_FLUSH_SECONDS: float = 1.0
+
+    # Monthly partitions (app/partitions.py, alembic 0006; Postgres only), kept by the
+    # maintain_partitions beat task. A partition expires once its whole month is past the table's
+    # retention (0 keeps everything). "archive" writes PARTITION_ARCHIVE_DIR/<table>/<partition>.csv.gz
+    # before dropping; without that directory such partitions are kept.
+    PARTITION_PREMAKE_MONTHS: int = 3
+    PARTITION_ARCHIVE_DIR: str | None = None
+    WEBHOOK_EVENTS_RETENTION_DAYS: int = 14
+    WEBHOOK_EVENTS_EXPIRE: Literal["drop", "archive"] = "drop"
+    DEVICE_CAPTURES_RETENTION_DAYS: int = 90
+    DEVICE_CAPTURES_EXPIRE: Literal["drop", "archive"] = "archive"
+
+    # Prometheus metrics (app/utils/metrics.py): /metrics on the API, WORKER_METRICS_PORT on
+    # Celery workers. METRICS_DIR (local, per host) sums every process of a role.
+    METRICS_DIR: str | None = None
+    METRICS_FLUSH_SECONDS: float = 5.0
+    WORKER_METRICS_PORT: int | None = 9808
+
     model_config = SettingsConfigDict(env_file=".env", extra="ignore")
 
 settings = Settings()
@@ -1,7 +1,14 @@
-from typing import Generator, Optional
+import asyncio
+import weakref
+from typing import Any, AsyncGenerator, AsyncIterator, Callable, Generator, Optional
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, DeclarativeBase
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker, DeclarativeBase
+from starlette.concurrency import run_in_threadpool
 from .config import settings
+from .utils import metrics
 
 def _normalize_db_url(url: str) -> str:
     # Use psycopg v3 driver with SQLAlchemy
@@ -11,10 +18,52 @@ def _normalize_db_url(url: str) -> str:
         return "postgresql+psycopg://" + url[len("postgres://"):]
     return url
 
+def _normalize_async_db_url(url: str) -> str:
+    # Same database, asyncpg driver (used by the FastAPI routes)
+    for prefix in ("postgresql+psycopg://", "postgresql://", "postgres://"):
+        if url.startswith(prefix):
+            url = "postgresql+asyncpg://" + url[len(prefix):]
+            break
+    # asyncpg spells libpq's sslmode as ssl
+    return url.replace("sslmode=", "ssl=")
+
 _DB_URL = _normalize_db_url(settings.DATABASE_URL)
+_ASYNC_DB_URL = _normalize_async_db_url(settings.DATABASE_URL)
+
+POOL_CHECKOUT_SECONDS = metrics.histogram(
+    "fp_db_pool_checkout_seconds", "Wait for a pooled DB connection", labels=("pool",),
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0))
+
+class _TimedCheckout:
+    """Times QueuePool checkouts: near zero with idle connections, the pool wait otherwise."""
+    metrics_label = ""
+
+    def _do_get(self):
+        with POOL_CHECKOUT_SECONDS.time(pool=self.metrics_label):
+            return super()._do_get()
+
+class TimedQueuePool(_TimedCheckout, QueuePool):
+    metrics_label = "sync"
+
+class TimedAsyncQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+    metrics_label = "async"
+
+def _pool_args(url: str, poolclass) -> dict:
+    # sqlite (tests) keeps its default single-connection pools
+    if not url.startswith("postgresql"):
+        return {}
+    return {
+        "poolclass": poolclass,
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+    }
 
 _engine = None  # lazy-init to avoid C-extension import at module import time
 _SessionLocal: Optional[sessionmaker] = None
+_async_engine: Optional[AsyncEngine] = None
+_AsyncSessionLocal: Optional[async_sessionmaker] = None
 
 def get_engine():
     global _engine
@@ -22,6 +71,7 @@ def get_engine():
         _engine = create_engine(
             _DB_URL,
             pool_pre_ping=True,
+            **_pool_args(_DB_URL, TimedQueuePool),
             future=True,  # explicit 2.0-style
         )
     return _engine
@@ -37,6 +87,160 @@ def get_sessionmaker() -> sessionmaker:
         )
     return _SessionLocal
 
+def get_async_engine() -> AsyncEngine:
+    global _async_engine
+    if _async_engine is None:
+        _async_engine = create_async_engine(
+            _ASYNC_DB_URL,
+            pool_pre_ping=True,
+            **_pool_args(_ASYNC_DB_URL, TimedAsyncQueuePool),
+        )
+    return _async_engine
+
+def get_asyncpg_sessionmaker() -> async_sessionmaker:
+    global _AsyncSessionLocal
+    if _AsyncSessionLocal is None:
+        _AsyncSessionLocal = async_sessionmaker(
+            bind=get_async_engine(),
+            autoflush=False,
+            expire_on_commit=False,
+        )
+    return _AsyncSessionLocal
+
+class _ThreadedResult:
+    """AsyncResult.partitions() over a sync, server-side-cursor Result."""
+
+    def __init__(self, result):
+        self._result = result
+
+    async def partitions(self, size: Optional[int] = None) -> AsyncIterator[list]:
+        parts = self._result.partitions(size)
+        while (rows := await run_in_threadpool(next, parts, None)) is not None:
+            yield rows
+
+# per event loop: sessions allowed open at once, so none waits for a pooled connection in a thread
+_session_slots: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = \
+    weakref.WeakKeyDictionary()
+
+def _session_slot() -> Optional[asyncio.Semaphore]:
+    if settings.DB_MAX_OVERFLOW < 0:  # unbounded pool
+        return None
+    loop = asyncio.get_running_loop()
+    slots = _session_slots.get(loop)
+    if slots is None:
+        slots = _session_slots[loop] = asyncio.Semaphore(settings.DB_POOL_SIZE + settings.DB_MAX_OVERFLOW)
+    return slots
+
+class ThreadedSession:
+    """The AsyncSession calls the routes make, on a sync Session run in the threadpool.
+
+    Each call blocks a worker thread instead of the event loop, and skips
+    asyncpg's and the greenlet bridge's per-query overhead. Results of
+    execute() are buffered in the thread, so reading them never does I/O.
+
+    Use it with `async with`: entering waits (on the loop) for one of the
+    pool's connections. Otherwise sessions queued on a full pool would
+    hold every threadpool thread while the sessions that own the
+    connections wait for a thread to commit on.
+    """
+
+    def __init__(self, session: Session):
+        self.sync_session = session
+        self._slot: Optional[asyncio.Semaphore] = None
+
+    @property
+    def info(self) -> dict:
+        return self.sync_session.info
+
+    def add(self, instance: Any) -> None:
+        self.sync_session.add(instance)
+
+    def add_all(self, instances) -> None:
+        self.sync_session.add_all(instances)
+
+    async def execute(self, statement, *args, **kwargs):
+        return await run_in_threadpool(lambda: self.sync_session.execute(statement, *args, **kwargs).freeze()())
+
+    async def scalar(self, statement, *args, **kwargs):
+        return await run_in_threadpool(self.sync_session.scalar, statement, *args, **kwargs)
+
+    async def stream(self, statement, *args, **kwargs) -> _ThreadedResult:
+        return _ThreadedResult(await run_in_threadpool(self.sync_session.execute, statement, *args, **kwargs))
+
+    async def run_sync(self, fn: Callable, *args, **kwargs):
+        return await run_in_threadpool(fn, self.sync_session, *args, **kwargs)
+
+    async def commit(self) -> None:
+        await run_in_threadpool(self.sync_session.commit)
+
+    async def rollback(self) -> None:
+        await run_in_threadpool(self.sync_session.rollback)
+
+    async def close(self) -> None:
+        await run_in_threadpool(self.sync_session.close)
+
+    async def __aenter__(self) -> "ThreadedSession":
+        self._slot = _session_slot()
+        if self._slot is not None:
+            await self._slot.acquire()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        try:
+            await self.close()
+        finally:
+            if self._slot is not None:
+                self._slot.release()
+
+def get_async_sessionmaker() -> Callable[[], Any]:
+    """Session factory for async code: asyncpg with DB_ASYNC_DRIVER, else ThreadedSession."""
+    if settings.DB_ASYNC_DRIVER:
+        return get_asyncpg_sessionmaker()
+    return lambda: ThreadedSession(get_sessionmaker()())
+
+def _warm_count() -> int:
+    return max(1, min(settings.DB_POOL_WARM, settings.DB_POOL_SIZE)) if _DB_URL.startswith("postgresql") else 1
+
+def warm_engine() -> None:
+    """Open DB_POOL_WARM pooled connections now instead of on the first requests/tasks."""
+    engine = get_engine()
+    conns = [engine.connect() for _ in range(_warm_count())]
+    for conn in conns:
+        conn.exec_driver_sql("SELECT 1")
+        conn.close()
+
+async def warm_async_engine() -> None:
+    if not settings.DB_ASYNC_DRIVER:
+        await run_in_threadpool(warm_engine)
+        return
+    engine = get_async_engine()
+    conns = [await engine.connect() for _ in range(_warm_count())]
+    for conn in conns:
+        await conn.exec_driver_sql("SELECT 1")
+        await conn.close()
+
+async def dispose_async_engine() -> None:
+    if _async_engine is not None:
+        await _async_engine.dispose()
+
+def reset_engines() -> None:
+    """Drop pooled connections inherited over fork(); call first thing in the child.
+
+    The sync pool is disposed with close=False, so the parent's sockets
+    are left alone for the parent to keep using. The async engine is
+    rebuilt on first use in the child's own event loop.
+    """
+    global _engine, _SessionLocal, _async_engine, _AsyncSessionLocal
+    if _engine is not None:
+        _engine.dispose(close=False)
+    if _async_engine is not None:
+        _async_engine.sync_engine.dispose(close=False)
+    _engine = _SessionLocal = _async_engine = _AsyncSessionLocal = None
+
+def dialect_insert(db):
+    """insert() with ON CONFLICT support for the session's dialect (sqlite only in tests)."""
+    return sqlite.insert if db.get_bind().dialect.name == "sqlite" else postgresql.insert
+
 class Base(DeclarativeBase):
     pass
 
@@ -46,3 +250,8 @@ def get_db() -> Generator:
         yield db
     finally:
         db.close()
+
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    """AsyncSession-style session for async routes (see get_async_sessionmaker)."""
+    async with get_async_sessionmaker()() as db:
+        yield db
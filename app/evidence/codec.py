@@ -0,0 +1,109 @@
+# app/evidence/codec.py
+"""Compact binary encoding for per-order evidence.
+
+The scoring input is stored as a positional list in INPUT_FIELDS order, with
+any unknown keys kept in a trailing dict, so field names are not repeated
+on every row. The scores payload keeps reasons as ids into reason_dict.
+Payloads are compact JSON compressed with zlib and a preset dictionary of
+recurring values. They are addressed by the sha256 of the uncompressed
+bytes, so identical payloads are stored once.
+
+Inputs are written with CODEC_ZJSON_V2, which leaves out shop_id and
+order_id (ROW_FIELDS): those live on the order_evidence row, and keeping
+them in the blob made every input unique. V1 blobs, which include them,
+still decode.
+
+A codec id is stored with every blob. Changing INPUT_FIELDS or _ZDICT means
+adding a new codec; existing ids must keep decoding exactly as they do now.
+"""
+import hashlib
+import json
+import zlib
+from typing import Any, Dict, List, Tuple
+
+CODEC_ZJSON_V1 = 1
+CODEC_ZJSON_V2 = 2  # V1 minus ROW_FIELDS in the input layout
+
+INPUT_FIELDS_V1: Tuple[str, ...] = (
+    "shop_id", "order_id", "total_price", "currency", "email", "ip", "country",
+    "billing_country", "shipping_country", "device_id",
+    "repeat_email", "repeat_ip", "repeat_device",
+    "repeat_email_10m", "repeat_email_1h", "repeat_email_24h", "repeat_email_30d",
+    "repeat_ip_10m", "repeat_ip_1h", "repeat_ip_24h", "repeat_ip_30d",
+    "repeat_device_10m", "repeat_device_1h", "repeat_device_24h", "repeat_device_30d",
+)
+INPUT_INDEX_V1 = {f: i for i, f in enumerate(INPUT_FIELDS_V1)}
+
+ROW_FIELDS: Tuple[str, ...] = ("shop_id", "order_id")
+INPUT_FIELDS_V2: Tuple[str, ...] = tuple(f for f in INPUT_FIELDS_V1 if f not in ROW_FIELDS)
+
+# input layout per codec; scores blobs are V1
+INPUT_FIELDS: Dict[int, Tuple[str, ...]] = {CODEC_ZJSON_V1: INPUT_FIELDS_V1, CODEC_ZJSON_V2: INPUT_FIELDS_V2}
+INPUT_CODEC = CODEC_ZJSON_V2
+
+SCORE_FIELDS_V1: Tuple[str, ...] = ("rules_score", "final_score", "verdict", "reasons")
+
+_ZDICT = json.dumps([
+    ".myshopify.com", "@gmail.com", "@yahoo.com", "@hotmail.com", "@outlook.com",
+    "USD", "EUR", "GBP", "CAD", "AUD", "US", "CA", "GB", "DE", "FR", "AU",
+    "green", "amber", "red", "null", "0,0,0,0", "0.0,", "[0,0,", ".0,",
+], separators=(",", ":")).encode()
+
+def _dumps(obj) -> bytes:
+    return json.dumps(obj, separators=(",", ":"), default=str).encode()
+
+def _compress(raw: bytes) -> bytes:
+    c = zlib.compressobj(level=6, zdict=_ZDICT)
+    return c.compress(raw) + c.flush()
+
+def _decompress(blob: bytes) -> bytes:
+    d = zlib.decompressobj(zdict=_ZDICT)
+    return d.decompress(blob) + d.flush()
+
+def content_hash(raw: bytes, c: int = CODEC_ZJSON_V1) -> bytes:
+    # V1 hashes stay as they were; later codecs are salted with their id so layouts never share an address
+    return hashlib.sha256(raw if c == CODEC_ZJSON_V1 else bytes([c]) + raw).digest()
+
+def encode_input(data: Dict[str, Any]) -> bytes:
+    """The input in the INPUT_CODEC layout, without ROW_FIELDS."""
+    row: List[Any] = [data.get(f) for f in INPUT_FIELDS_V2]
+    extra = {k: v for k, v in data.items() if k not in INPUT_INDEX_V1}
+    if extra:
+        row.append(extra)
+    return _dumps(row)
+
+def decode_input(raw: bytes, c: int = INPUT_CODEC) -> Dict[str, Any]:
+    fields = INPUT_FIELDS[c]
+    row = json.loads(raw)
+    out = dict(zip(fields, row))
+    if len(row) > len(fields):
+        out.update(row[len(fields)])
+    return out
+
+def encode_scores(result: Dict[str, Any], reason_ids: Dict[str, int]) -> bytes:
+    row: List[Any] = [result.get("rules_score"), result.get("final_score"), result.get("verdict"),
+                      [reason_ids[r] for r in result.get("reasons") or []]]
+    extra = {k: v for k, v in result.items() if k not in SCORE_FIELDS_V1}
+    if extra:
+        row.append(extra)
+    return _dumps(row)
+
+def decode_scores(raw: bytes, reason_texts: Dict[int, str]) -> Dict[str, Any]:
+    row = json.loads(raw)
+    out = {"rules_score": row[0], "final_score": row[1], "verdict": row[2],
+           "reasons": [reason_texts[i] for i in row[3]]}
+    if len(row) > 4:
+        out.update(row[4])
+    return out
+
+def reason_ids_in(raw: bytes) -> List[int]:
+    return json.loads(raw)[3]
+
+def pack(raw: bytes, c: int = CODEC_ZJSON_V1) -> Tuple[bytes, int, bytes]:
+    """(content hash, codec, compressed bytes) for an encoded payload."""
+    return content_hash(raw, c), c, _compress(raw)
+
+def unpack(c: int, blob: bytes) -> bytes:
+    if c not in INPUT_FIELDS:
+        raise ValueError(f"Unknown evidence codec {c}")
+    return _decompress(blob)
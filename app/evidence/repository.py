@@ -0,0 +1,80 @@
+# app/evidence/repository.py
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from ..database import dialect_insert
+from ..models import EvidenceBlob, OrderEvidence, ReasonText
+from . import codec
+
+# Per-process reason intern table (reason strings are a small, slow-growing set)
+_reason_ids: Dict[str, int] = {}
+_reason_texts: Dict[int, str] = {}
+_lock = threading.Lock()
+
+def _remember(rows: Iterable[Tuple[int, str]]) -> None:
+    with _lock:
+        for rid, text in rows:
+            _reason_ids[text] = rid
+            _reason_texts[rid] = text
+
+def intern_reasons(db: Session, texts: Iterable[str]) -> Dict[str, int]:
+    texts = set(texts)
+    ids = {t: _reason_ids[t] for t in texts if t in _reason_ids}
+    missing = sorted(texts - ids.keys())
+    if missing:
+        db.execute(dialect_insert(db)(ReasonText).values([{"text": t} for t in missing])
+                   .on_conflict_do_nothing(index_elements=["text"]))
+        fresh = db.execute(select(ReasonText.id, ReasonText.text).where(ReasonText.text.in_(missing))).all()
+        ids.update((text, rid) for rid, text in fresh)
+        # only share ids once they are committed (a rollback would orphan them)
+        event.listen(db, "after_commit", lambda session: _remember(fresh), once=True)
+    return ids
+
+def write_evidence(db: Session, scored: List[Tuple[dict, dict]]) -> int:
+    """Store (input, result) evidence for many orders; no commit.
+
+    Returns the number of new blob rows (deduplicated payloads are free).
+    """
+    if not scored:
+        return 0
+    reason_ids = intern_reasons(db, (r for _, res in scored for r in res.get("reasons") or []))
+    blobs: Dict[bytes, dict] = {}
+    rows = []
+    for data, result in scored:
+        in_hash, in_codec, in_blob = codec.pack(codec.encode_input(data), codec.INPUT_CODEC)
+        sc_hash, sc_codec, sc_blob = codec.pack(codec.encode_scores(result, reason_ids))
+        blobs.setdefault(in_hash, {"hash": in_hash, "codec": in_codec, "data": in_blob})
+        blobs.setdefault(sc_hash, {"hash": sc_hash, "codec": sc_codec, "data": sc_blob})
+        rows.append({"order_id": data["order_id"], "shop_id": data.get("shop_id"),
+                     "input_hash": in_hash, "scores_hash": sc_hash})
+    ins = dialect_insert(db)
+    new = db.execute(ins(EvidenceBlob).values(list(blobs.values()))
+                     .on_conflict_do_nothing(index_elements=["hash"])).rowcount
+    db.execute(ins(OrderEvidence).values(rows).on_conflict_do_nothing(index_elements=["order_id"]))
+    return new
+
+async def _reason_texts_for(db: AsyncSession, ids: Iterable[int]) -> Dict[int, str]:
+    missing = sorted({i for i in ids if i not in _reason_texts})
+    if missing:
+        _remember((await db.execute(select(ReasonText.id, ReasonText.text)
+                                    .where(ReasonText.id.in_(missing)))).all())
+    return _reason_texts
+
+async def read_evidence(db: AsyncSession, order_id: str) -> Optional[List[dict]]:
+    """Evidence in the legacy evidence_log shape, or None if the order has none."""
+    row = (await db.execute(select(OrderEvidence).where(OrderEvidence.order_id == order_id))).scalar_one_or_none()
+    if row is None:
+        return None
+    blobs = {b.hash: b for b in (await db.execute(
+        select(EvidenceBlob).where(EvidenceBlob.hash.in_([row.input_hash, row.scores_hash])))).scalars()}
+    in_blob = blobs[row.input_hash]
+    data = {"shop_id": row.shop_id, "order_id": row.order_id,
+            **codec.decode_input(codec.unpack(in_blob.codec, in_blob.data), in_blob.codec)}
+    raw_scores = codec.unpack(blobs[row.scores_hash].codec, blobs[row.scores_hash].data)
+    texts = await _reason_texts_for(db, codec.reason_ids_in(raw_scores))
+    return [{"key": "input", "value": data, "created_at": row.created_at},
+            {"key": "scores", "value": codec.decode_scores(raw_scores, texts), "created_at": row.created_at}]
@@ -1,17 +1,60 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
+from fastapi.responses import Response
+from .database import dispose_async_engine, warm_async_engine
 from .routes.capture import router as capture_router
+from .routes.score import router as score_router
 from .routes.webhooks import router as webhooks_router
+from .routes.vault import router as vault_router
+from .utils import metrics
+from .rules.ruleset import get_ruleset
+from .utils.logging import logger
+from .utils.redis_client import close_async_redis, get_async_redis
+from .utils.shopify import webhook_mac
+
+async def warm_up() -> None:
+    """Pay connection setup before the first request instead of during it.
+
+    Runs in each server worker process (after any fork), so the pools it
+    fills belong to that process. Failures are logged, not fatal: the
+    pools connect lazily anyway once the dependency is back.
+    """
+    webhook_mac()
+    get_ruleset()  # compiled on first use otherwise (POST /v1/score)
+    try:
+        await warm_async_engine()
+    except Exception:
+        logger.warning("DB pool warm-up failed", exc_info=True)
+    try:
+        await get_async_redis().ping()
+    except Exception:
+        logger.warning("Redis warm-up failed", exc_info=True)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await warm_up()
+    yield
+    await close_async_redis()
+    await dispose_async_engine()
 
 app = FastAPI(title="FraudPop Backend + Defender3D Risk Vault",
               description="Internal endpoints for the app",
     version="0.1.0",
     docs_url="/docs",          # Swagger UI
     redoc_url="/redoc",        # ReDoc
-    openapi_url="/openapi.json")
+    openapi_url="/openapi.json",
+    lifespan=lifespan)
 
 app.include_router(capture_router)
 app.include_router(webhooks_router)
+app.include_router(vault_router)
+app.include_router(score_router)
 
 @app.get("/health")
 def health():
     return {"ok": True}
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
@@ -2,18 +2,23 @@ from __future__ import annotations
 from typing import Optional, List, Any
 from sqlalchemy.orm import Mapped, mapped_column
 from sqlalchemy import (
-    String, BigInteger, Integer, DateTime, JSON, UniqueConstraint, func, Float, Boolean, Index
+    String, BigInteger, Integer, DateTime, JSON, UniqueConstraint, func, Float, Boolean, Index,
+    LargeBinary, SmallInteger
 )
 from .database import Base
 
+# BIGSERIAL on Postgres; sqlite (tests) only autoincrements INTEGER primary keys
+BigIntPK = BigInteger().with_variant(Integer, "sqlite")
+
 # ----------------------------
 # Webhook events (used by Celery)
 # ----------------------------
 class WebhookEvent(Base):
     __tablename__ = "webhook_events"
 
-    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    id: Mapped[int] = mapped_column(BigIntPK, primary_key=True, autoincrement=True)
     shop_id: Mapped[Optional[str]] = mapped_column(String(128), index=True)  # <- added
+    # unique per monthly partition on Postgres (alembic 0006, app/partitions.py)
     event_id: Mapped[str] = mapped_column(String(128), unique=True, nullable=False)
     topic: Mapped[Optional[str]] = mapped_column(String(128))
     processed: Mapped[bool] = mapped_column(Boolean, nullable=False, server_default="false")  # <- added
@@ -25,7 +30,7 @@ class WebhookEvent(Base):
 class DeviceCapture(Base):
     __tablename__ = "device_captures"
 
-    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    id: Mapped[int] = mapped_column(BigIntPK, primary_key=True, autoincrement=True)
     shop_id: Mapped[str] = mapped_column(String(64), nullable=False)
     session_id: Mapped[str] = mapped_column(String(128), nullable=False)
     device_id: Mapped[Optional[str]] = mapped_column(String(128))
@@ -40,7 +45,7 @@ class OrderRisk(Base):
     __tablename__ = "order_risk"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    shop_id: Mapped[Optional[str]] = mapped_column(String, index=True)
+    shop_id: Mapped[Optional[str]] = mapped_column(String)
     order_id: Mapped[str] = mapped_column(String, unique=True, index=True)
     total_price: Mapped[Optional[float]] = mapped_column(Float)
     currency: Mapped[Optional[str]] = mapped_column(String(8))
@@ -53,6 +58,13 @@ class OrderRisk(Base):
     reasons: Mapped[Optional[List[str]]] = mapped_column(JSON)   # list of strings
     created_at: Mapped[DateTime] = mapped_column(DateTime, server_default=func.now())
 
+    __table_args__ = (
+        # keyset listing per shop (alembic 0002)
+        Index("ix_order_risk_shop_verdict_id", "shop_id", "verdict", "id"),
+        Index("ix_order_risk_shop_id_id", "shop_id", "id"),
+        Index("ix_order_risk_shop_email", "shop_id", "email"),
+    )
+
 # ----------------------------
 # Evidence log (debug/audit)
 # ----------------------------
@@ -65,6 +77,36 @@ class EvidenceLog(Base):
     value: Mapped[Any] = mapped_column(JSON)
     created_at: Mapped[DateTime] = mapped_column(DateTime, server_default=func.now())
 
+# ----------------------------
+# Compact evidence (app/evidence): one row per order pointing at
+# content-addressed, compressed payloads; reasons interned in reason_dict
+# ----------------------------
+class OrderEvidence(Base):
+    __tablename__ = "order_evidence"
+
+    order_id: Mapped[str] = mapped_column(String, primary_key=True)
+    shop_id: Mapped[Optional[str]] = mapped_column(String)
+    input_hash: Mapped[bytes] = mapped_column(LargeBinary(32), nullable=False)
+    scores_hash: Mapped[bytes] = mapped_column(LargeBinary(32), nullable=False)
+    created_at: Mapped[DateTime] = mapped_column(DateTime, server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_order_evidence_shop_created", "shop_id", "created_at"),
+    )
+
+class EvidenceBlob(Base):
+    __tablename__ = "evidence_blob"
+
+    hash: Mapped[bytes] = mapped_column(LargeBinary(32), primary_key=True)  # sha256 of the raw payload
+    codec: Mapped[int] = mapped_column(SmallInteger, nullable=False)
+    data: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+
+class ReasonText(Base):
+    __tablename__ = "reason_dict"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    text: Mapped[str] = mapped_column(String, nullable=False, unique=True)
+
 # ----------------------------
 # Velocity identity counters
 # ----------------------------
@@ -76,9 +118,47 @@ class RiskIdentity(Base):
     hash: Mapped[str] = mapped_column(String, nullable=False, index=True)  # sha256 of pepper+value
     seen_count: Mapped[int] = mapped_column(Integer, nullable=False, server_default="0")
     last_seen: Mapped[DateTime] = mapped_column(DateTime, server_default=func.now())
+    # outcome counters reported via /v1/vault/observe
+    chargeback_count: Mapped[int] = mapped_column(Integer, nullable=False, server_default="0")
+    refund_count: Mapped[int] = mapped_column(Integer, nullable=False, server_default="0")
+    approved_count: Mapped[int] = mapped_column(Integer, nullable=False, server_default="0")
 
     __table_args__ = (
         UniqueConstraint("kind", "hash", name="uq_kind_hash"),
     )
 
 Index("ix_risk_identity_kind_hash", RiskIdentity.kind, RiskIdentity.hash, unique=True)
+
+# ----------------------------
+# Identity graph (app/vault/graph.py): co-occurrence edges between vault
+# keys and a persisted union-find over them
+# ----------------------------
+class IdentityNode(Base):
+    __tablename__ = "identity_node"
+
+    id: Mapped[int] = mapped_column(BigIntPK, primary_key=True, autoincrement=True)
+    kind: Mapped[str] = mapped_column(String, nullable=False)
+    hash: Mapped[str] = mapped_column(String, nullable=False)
+    root: Mapped[Optional[int]] = mapped_column(BigInteger, index=True)  # component root id (self for roots)
+    size: Mapped[int] = mapped_column(Integer, nullable=False, server_default="1")  # identities in component (roots)
+
+    __table_args__ = (
+        UniqueConstraint("kind", "hash", name="uq_identity_node_kind_hash"),
+    )
+
+class IdentityEdge(Base):
+    __tablename__ = "identity_edge"
+
+    id: Mapped[int] = mapped_column(BigIntPK, primary_key=True, autoincrement=True)
+    a_kind: Mapped[str] = mapped_column(String, nullable=False)
+    a_hash: Mapped[str] = mapped_column(String, nullable=False)
+    b_kind: Mapped[str] = mapped_column(String, nullable=False)
+    b_hash: Mapped[str] = mapped_column(String, nullable=False)
+    seen_count: Mapped[int] = mapped_column(Integer, nullable=False, server_default="1")
+    last_seen: Mapped[DateTime] = mapped_column(DateTime, server_default=func.now())
+    applied: Mapped[bool] = mapped_column(Boolean, nullable=False, server_default="false")
+
+    __table_args__ = (
+        UniqueConstraint("a_kind", "a_hash", "b_kind", "b_hash", name="uq_identity_edge"),
+        Index("ix_identity_edge_pending", "id", postgresql_where=applied.is_(False)),
+    )
@@ -0,0 +1,182 @@
+"""Monthly partitions and retention for webhook_events and device_captures.
+
+Alembic 0006 turns both tables into parents partitioned by range on
+their timestamp column (Postgres only). There is one partition per UTC
+month, named <table>_pYYYYMM. The maintain_partitions beat task
+(celery_worker.py) then does two things for each table:
+
+- It creates the partitions for this month and the next
+  PARTITION_PREMAKE_MONTHS. An insert with no partition to land in fails,
+  so these months are the runway if beat stops.
+- It expires partitions whose whole month is older than the table's
+  retention (<TABLE>_RETENTION_DAYS; 0 keeps everything). With "drop" the
+  partition is just dropped. With "archive" it is first written to
+  PARTITION_ARCHIVE_DIR/<table>/<partition>.csv.gz (COPY ... CSV, gzip),
+  and only dropped once that file is complete. Without an archive
+  directory, such partitions are kept.
+
+Postgres cannot enforce a unique key across partitions. So
+webhook_events.event_id is unique per partition (per month), and its
+inserts use ON CONFLICT DO NOTHING without a conflict target. Webhooks are
+still deduplicated across month boundaries by the Redis admission key.
+order_risk is not partitioned: its table-wide unique order_id is the only
+thing that turns a redelivered order into a no-op.
+
+    python -m app.partitions      # run the maintenance once, now
+"""
+import gzip
+import json
+import os
+import re
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from .config import settings
+from .database import get_engine
+from .utils.logging import logger
+
+@dataclass(frozen=True)
+class PartitionedTable:
+    name: str
+    column: str                 # range partition key
+    unique: Tuple[str, ...]     # unique per partition (see module docstring)
+    settings_prefix: str
+
+    @property
+    def retention_days(self) -> int:
+        return getattr(settings, self.settings_prefix + "_RETENTION_DAYS")
+
+    @property
+    def expire(self) -> str:
+        return getattr(settings, self.settings_prefix + "_EXPIRE")
+
+TABLES = (
+    PartitionedTable("webhook_events", "processed_at", ("event_id",), "WEBHOOK_EVENTS"),
+    PartitionedTable("device_captures", "created_at", (), "DEVICE_CAPTURES"),
+)
+
+_SUFFIX_RE = re.compile(r"_p(\d{4})(\d{2})$")
+
+# ---------- months ----------
+def month_start(t: datetime) -> datetime:
+    t = t.astimezone(timezone.utc)
+    return datetime(t.year, t.month, 1, tzinfo=timezone.utc)
+
+def add_months(month: datetime, n: int) -> datetime:
+    y, m = divmod(month.month - 1 + n, 12)
+    return month.replace(year=month.year + y, month=m + 1)
+
+def partition_name(table: str, month: datetime) -> str:
+    return f"{table}_p{month:%Y%m}"
+
+def plan(existing: Dict[datetime, str], now: datetime, premake: int,
+         retention_days: int) -> Tuple[List[datetime], List[datetime]]:
+    """(months to create, existing months to expire) for one table."""
+    current = month_start(now)
+    wanted = [add_months(current, i) for i in range(premake + 1)]
+    create = [m for m in wanted if m not in existing]
+    if retention_days <= 0:
+        return create, []
+    cutoff = now - timedelta(days=retention_days)
+    # a month expires once all of it is older than the cutoff; never the current one
+    expire = sorted(m for m in existing if add_months(m, 1) <= cutoff and m < current)
+    return create, expire
+
+# ---------- catalog ----------
+def is_partitioned(conn: Connection, table: str) -> bool:
+    return conn.execute(text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = :t AND pg_table_is_visible(c.oid)"), {"t": table}).first() is not None
+
+def partitions(conn: Connection, table: str) -> Dict[datetime, str]:
+    """{month: partition name} for the <table>_pYYYYMM partitions of a table."""
+    names = conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = :t AND pg_table_is_visible(p.oid)"),
+        {"t": table}).scalars()
+    out = {}
+    for name in names:
+        m = _SUFFIX_RE.search(name)
+        if m and name == table + m.group(0):
+            out[datetime(int(m.group(1)), int(m.group(2)), 1, tzinfo=timezone.utc)] = name
+    return out
+
+# ---------- DDL ----------
+def create_partition(conn: Connection, spec: PartitionedTable, month: datetime) -> str:
+    name = partition_name(spec.name, month)
+    conn.exec_driver_sql(
+        f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {spec.name} "
+        f"FOR VALUES FROM ('{month:%Y-%m-%d} 00:00:00+00') TO ('{add_months(month, 1):%Y-%m-%d} 00:00:00+00')")
+    for column in spec.unique:
+        conn.exec_driver_sql(f"CREATE UNIQUE INDEX IF NOT EXISTS {name}_{column}_key ON {name} ({column})")
+    return name
+
+def archive_partition(conn: Connection, spec: PartitionedTable, name: str, directory: str) -> Tuple[str, int]:
+    """COPY a partition to <directory>/<table>/<name>.csv.gz; returns (path, rows).
+
+    Written to a temporary name, fsynced and renamed, so a file with the
+    final name is always complete.
+    """
+    folder = os.path.join(directory, spec.name)
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, name + ".csv.gz")
+    tmp = path + ".tmp"
+    cur = conn.connection.driver_connection.cursor()  # psycopg 3: COPY streams without a round trip per row
+    with open(tmp, "wb") as fh:
+        with gzip.GzipFile(filename=name + ".csv", mode="wb", fileobj=fh) as out:
+            with cur.copy(f"COPY {name} TO STDOUT (FORMAT csv, HEADER)") as copy:
+                for chunk in copy:
+                    out.write(chunk)
+        fh.flush()
+        os.fsync(fh.fileno())
+    rows = cur.rowcount
+    cur.close()
+    os.replace(tmp, path)
+    return path, rows
+
+# ---------- maintenance ----------
+def maintain(engine: Optional[Engine] = None, now: Optional[datetime] = None) -> Dict[str, list]:
+    """Create upcoming partitions and expire old ones for every table in TABLES.
+
+    Each partition is created or expired in its own transaction. Tables
+    that are not partitioned (not migrated yet, or not Postgres) are
+    skipped.
+    """
+    engine = engine or get_engine()
+    now = now or datetime.now(timezone.utc)
+    done: Dict[str, list] = {"created": [], "archived": [], "dropped": [], "kept": []}
+    if engine.dialect.name != "postgresql":
+        return done
+    for spec in TABLES:
+        with engine.connect() as conn:
+            if not is_partitioned(conn, spec.name):
+                logger.warning("%s is not partitioned; run the alembic migrations", spec.name)
+                continue
+            existing = partitions(conn, spec.name)
+        create, expire = plan(existing, now, settings.PARTITION_PREMAKE_MONTHS, spec.retention_days)
+        for month in create:
+            with engine.begin() as conn:
+                done["created"].append(create_partition(conn, spec, month))
+        for month in expire:
+            name = existing[month]
+            if spec.expire == "archive":
+                if not settings.PARTITION_ARCHIVE_DIR:
+                    logger.warning("%s is past retention but PARTITION_ARCHIVE_DIR is not set; keeping it", name)
+                    done["kept"].append(name)
+                    continue
+                with engine.connect() as conn:
+                    path, rows = archive_partition(conn, spec, name, settings.PARTITION_ARCHIVE_DIR)
+                logger.info("Archived %s (%d rows) to %s", name, rows, path)
+                done["archived"].append(name)
+            with engine.begin() as conn:
+                conn.exec_driver_sql(f"DROP TABLE {name}")
+            logger.info("Dropped partition %s", name)
+            done["dropped"].append(name)
+    return done
+
+if __name__ == "__main__":
+    print(json.dumps(maintain(), indent=2))
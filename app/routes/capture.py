@@ -1,35 +1,117 @@
-from fastapi import APIRouter, Depends, Query
-from sqlalchemy.orm import Session
+import csv
+import io
+import json
+from datetime import datetime, timezone
+
+from fastapi import APIRouter, Depends, Query, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from redis.exceptions import RedisError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, desc
 from ..models import OrderRisk, EvidenceLog
-from ..database import get_db, Base
+from ..database import get_async_db, get_async_sessionmaker
 from ..schemas import CaptureInput
+from ..evidence.repository import read_evidence
 from ..models import DeviceCapture
+from ..config import settings
+from ..utils.capture_buffer import push_captures
+from ..utils.logging import logger
 
 
 router = APIRouter(prefix="/v1", tags=["capture"])
 
-@router.get("/orders")
-def list_orders(db: Session = Depends(get_db),
-                verdict: str | None = Query(None),
-                q: str | None = Query(None),
-                limit: int = 50):
-    stmt = select(OrderRisk).order_by(desc(OrderRisk.id)).limit(limit)
+# Column projection for listings/exports (no ORM hydration)
+ORDER_COLUMNS = (OrderRisk.id, OrderRisk.order_id, OrderRisk.score, OrderRisk.rules_score,
+                 OrderRisk.verdict, OrderRisk.reasons, OrderRisk.currency, OrderRisk.total_price,
+                 OrderRisk.created_at)
+EXPORT_FIELDS = [c.key for c in ORDER_COLUMNS[1:]]
+EXPORT_CHUNK = 1000
+
+def _orders_query(shop_id: str, verdict: str | None, q: str | None, before: int | None = None):
+    stmt = select(*ORDER_COLUMNS).where(OrderRisk.shop_id==shop_id)
     if verdict: stmt = stmt.where(OrderRisk.verdict==verdict)
-    rows = db.execute(stmt).scalars().all()
+    if q:
+        q = q.strip()
+        # email search is exact (indexed on shop_id, email); anything else is an order id
+        stmt = stmt.where(OrderRisk.email==q.lower()) if "@" in q else stmt.where(OrderRisk.order_id==q)
+    if before is not None: stmt = stmt.where(OrderRisk.id < before)
+    return stmt.order_by(desc(OrderRisk.id))
+
+@router.get("/orders")
+async def list_orders(response: Response,
+                      db: AsyncSession = Depends(get_async_db),
+                      shop_id: str = Query(...),
+                      verdict: str | None = Query(None),
+                      q: str | None = Query(None),
+                      cursor: int | None = Query(None, description="X-Next-Cursor from the previous page"),
+                      limit: int = Query(50, ge=1, le=500)):
+    # Keyset pagination on id: each page is an index range scan on (shop_id[, verdict], id)
+    rows = (await db.execute(_orders_query(shop_id, verdict, q, cursor).limit(limit))).all()
+    if len(rows) == limit:
+        response.headers["X-Next-Cursor"] = str(rows[-1].id)
     return [{"order_id": r.order_id, "score": r.score, "rules_score": r.rules_score,
              "verdict": r.verdict, "reasons": r.reasons, "currency": r.currency,
              "total_price": r.total_price, "created_at": r.created_at} for r in rows]
 
+async def _export_rows(stmt):
+    # Own session: the request's dependency is closed before the body streams
+    async with get_async_sessionmaker()() as db:
+        result = await db.stream(stmt.execution_options(yield_per=EXPORT_CHUNK))
+        async for rows in result.partitions(EXPORT_CHUNK):
+            yield rows
+
+async def _ndjson(stmt):
+    async for rows in _export_rows(stmt):
+        yield "".join(json.dumps({k: getattr(r, k) for k in EXPORT_FIELDS}, default=str) + "\n" for r in rows)
+
+async def _csv(stmt):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(EXPORT_FIELDS)
+    async for rows in _export_rows(stmt):
+        for r in rows:
+            writer.writerow([json.dumps(r.reasons) if k == "reasons" else getattr(r, k) for k in EXPORT_FIELDS])
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+@router.get("/orders/export")
+async def export_orders(shop_id: str = Query(...),
+                        verdict: str | None = Query(None),
+                        format: str = Query("ndjson", pattern="^(ndjson|csv)$")):
+    """Stream a shop's whole order history (server-side cursor, constant memory)."""
+    stmt = _orders_query(shop_id, verdict, None)
+    if format == "csv":
+        return StreamingResponse(_csv(stmt), media_type="text/csv", headers={
+            "Content-Disposition": f'attachment; filename="{shop_id}-orders.csv"'})
+    return StreamingResponse(_ndjson(stmt), media_type="application/x-ndjson")
+
 @router.get("/orders/{order_id}/evidence")
-def order_evidence(order_id: str, db: Session = Depends(get_db)):
-    rows = db.execute(select(EvidenceLog).where(EvidenceLog.order_id==order_id)
-                      .order_by(EvidenceLog.id)).scalars().all()
+async def order_evidence(order_id: str, db: AsyncSession = Depends(get_async_db)):
+    compact = await read_evidence(db, order_id)
+    if compact is not None:
+        return compact
+    # orders scored before compact evidence (or with EVIDENCE_FORMAT=json)
+    rows = (await db.execute(select(EvidenceLog).where(EvidenceLog.order_id==order_id)
+                             .order_by(EvidenceLog.id))).scalars().all()
     return [{"key": r.key, "value": r.value, "created_at": r.created_at} for r in rows]
 
 
 @router.post("/capture")
-def capture(payload: CaptureInput, db: Session = Depends(get_db)):
+async def capture(payload: CaptureInput, db: AsyncSession = Depends(get_async_db)):
+    if settings.CAPTURE_BUFFER_MODE:
+        # buffered: flush_captures bulk-loads device_captures off the request path
+        record = payload.model_dump()
+        record["created_at"] = datetime.now(timezone.utc).isoformat()
+        try:
+            if await push_captures([record]):
+                return {"ok": True}
+            return JSONResponse({"ok": False, "error": "capture buffer full"}, status_code=429,
+                                headers={"Retry-After": "1"})
+        except RedisError:
+            logger.warning("Capture buffer unavailable, writing capture directly")
     rec = DeviceCapture(
         shop_id=payload.shop_id,
         session_id=payload.session_id,
@@ -38,6 +120,6 @@ def capture(payload: CaptureInput, db: Session = Depends(get_db)):
         email=payload.email
     )
     db.add(rec)
-    db.commit()
+    await db.commit()
     return {"ok": True}
 
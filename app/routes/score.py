@@ -0,0 +1,18 @@
+from fastapi import APIRouter
+
+from ..schemas import ScoreInput, ScoreResponse
+from ..scoring import checkout_input, score_checkout
+
+
+router = APIRouter(prefix="/v1", tags=["score"])
+
+@router.post("/score", response_model=ScoreResponse)
+async def score(payload: ScoreInput):
+    """Verdict for a checkout before the order exists; nothing is recorded (see app/scoring.py)."""
+    data = checkout_input(payload.shop_id.strip().lower(), payload.order_id,
+                          payload.model_dump(exclude={"shop_id", "order_id", "budget_ms"}))
+    result = await score_checkout(data, payload.budget_ms)
+    return ScoreResponse(order_id=payload.order_id, score=result["final_score"],
+                         rules_score=result["rules_score"], verdict=result["verdict"],
+                         reasons=result["reasons"], degraded=result["degraded"],
+                         elapsed_ms=result["elapsed_ms"])
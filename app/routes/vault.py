@@ -0,0 +1,39 @@
+from typing import List, Union
+
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..database import get_async_db
+from ..schemas import ObserveInput, QueryInput, QueryResponse, VaultSignal
+from ..utils.internal_auth import require_internal_auth
+from ..vault import cache, signals
+
+
+router = APIRouter(prefix="/v1/vault", tags=["vault"])
+
+def _response(found: dict) -> QueryResponse:
+    verdict, reasons = signals.vault_verdict(found)
+    return QueryResponse(signals={k: VaultSignal(**s) for k, s in found.items()},
+                         vault_verdict=verdict, reasons=reasons)
+
+@router.post("/observe", dependencies=[Depends(require_internal_auth)])
+async def observe(payload: Union[ObserveInput, List[ObserveInput]], db: AsyncSession = Depends(get_async_db)):
+    """Record one observation or a bulk list (e.g. the nightly chargeback push); internal callers only."""
+    items = payload if isinstance(payload, list) else [payload]
+    try:
+        touched = await db.run_sync(lambda s: signals.observe_many(s, [(i.ids, i.outcome) for i in items]))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    await cache.commit(db)  # publishes cache invalidations with the async client
+    return {"ok": True, "observations": len(items), "identities": touched}
+
+@router.post("/query", response_model=Union[QueryResponse, List[QueryResponse]])
+async def query(payload: Union[QueryInput, List[QueryInput]], db: AsyncSession = Depends(get_async_db)):
+    """Signals and a vault verdict for one set of identifiers, or a list of them."""
+    items = payload if isinstance(payload, list) else [payload]
+    try:
+        found = await db.run_sync(lambda s: signals.query_many(s, [i.ids for i in items]))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    responses = [_response(f) for f in found]
+    return responses if isinstance(payload, list) else responses[0]
@@ -1,44 +1,97 @@
 # app/webhooks.py
 
-from fastapi import APIRouter, Request, Depends
-from sqlalchemy.orm import Session
-from ..database import get_db
+import time
+
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
+from redis.exceptions import RedisError
+from starlette.concurrency import run_in_threadpool
 from ..utils.shopify import verify_shopify_hmac
-from ..models import WebhookEvent
-from sqlalchemy import select
+from ..utils.idempotency import admit_webhook, release_webhook
+from ..utils.order_queue import enqueue_order
+from ..utils.order_payload import project_order
+from ..utils import fair_queue, fastjson, metrics
 from ..config import settings
-from app.celery_worker import process_order_async
+from app.celery_app import celery  # tasks are sent by name; the worker module stays out of the API
 from app.utils.logging import logger
 
 
 router = APIRouter(prefix="/webhooks", tags=["webhooks"])
 
-## Use shared get_db from database.py
+ORDERS_CREATE = "orders/create"
+
+ADMISSION_SECONDS = metrics.histogram(
+    "fp_webhook_admission_seconds", "orders/create handling time until the response",
+    labels=("outcome",))
+
+async def _send_task(name: str, args: tuple = ()) -> None:
+    # kombu publishes block (and reconnect to a slow broker); keep them off the event loop
+    await run_in_threadpool(celery.send_task, name, args)
+
+async def _enqueue_fair(shop_id: str, order: dict, event_id: str) -> None:
+    item = await fair_queue.enqueue(shop_id, order, event_id)
+    try:
+        await _send_task("score_next")
+    except Exception:
+        # no token will ever claim it; take it back so the webhook can be retried cleanly
+        await fair_queue.discard(shop_id, item)
+        raise
 
 @router.post("/orders-create")
-async def orders_create(request: Request, db: Session = Depends(get_db)):
+async def orders_create(request: Request):
+    started = time.perf_counter()
+    outcome, response = await _orders_create(request)
+    ADMISSION_SECONDS.observe(time.perf_counter() - started, outcome=outcome)
+    return response
+
+async def _orders_create(request: Request):
+    """(outcome label, response) for one orders/create delivery."""
     raw = await request.body()
     hmac_hdr = request.headers.get("X-Shopify-Hmac-Sha256", "")
-    # Verify HMAC
+    # Verify HMAC over the raw bytes
     if not verify_shopify_hmac(raw, hmac_hdr):
-        return {"ok": False, "error": "Invalid HMAC"}
+        return "invalid_hmac", {"ok": False, "error": "Invalid HMAC"}
 
     shop_id = request.headers.get("X-Shopify-Shop-Domain", "unknown")
     event_id = request.headers.get("X-Shopify-Webhook-Id", None)
     if not event_id:
-        return {"ok": True, "error": "Missing event_id"}
-
-    # Idempotency
-    existing = db.execute(select(WebhookEvent).where(WebhookEvent.event_id==event_id)).scalar_one_or_none()
-    if existing:
-        return {"ok": True, "dedup": True}
-
-    db.add(WebhookEvent(topic="orders/create", event_id=event_id))
-    db.commit()
-
-    payload = await request.json()
-    # fire-and-forget Celery job
-    logger.info(f"Enqueuing payload {payload} for shop {shop_id}")
-    process_order_async.delay(shop_id, payload)
-    logger.info("process_order_async enqueued")
-    return {"ok": True}
+        return "missing_event_id", {"ok": True, "error": "Missing event_id"}
+
+    # Parse before claiming the id, so a bad body never holds a claim
+    try:
+        payload = fastjson.loads(raw)
+    except ValueError:
+        payload = None
+    if not isinstance(payload, dict):
+        return "invalid_payload", JSONResponse({"ok": False, "error": "Invalid payload"}, status_code=400)
+
+    # Idempotency: Redis SET NX; webhook_events is written off the request path.
+    # Without Redis nothing could be enqueued either (broker and queues live there),
+    # so answer 503 and let Shopify retry rather than claim the id somewhere else.
+    try:
+        admitted = await admit_webhook(event_id, shop_id, ORDERS_CREATE)
+    except RedisError:
+        logger.warning("Redis unavailable, refusing webhook %s for retry", event_id)
+        return "redis_unavailable", JSONResponse({"ok": False, "error": "unavailable"}, status_code=503)
+    if not admitted:
+        return "dedup", {"ok": True, "dedup": True}
+
+    # the task gets only the fields scoring reads (app/utils/order_payload.py)
+    order = project_order(payload)
+    # fire-and-forget: Celery job, the shop's fair queue plus a score_next token, or the batch consumer's queue
+    try:
+        if settings.ORDER_BATCH_MODE:
+            await enqueue_order(shop_id, order, event_id)
+        elif settings.FAIR_SCHEDULING:
+            await _enqueue_fair(shop_id, order, event_id)
+        else:
+            await _send_task("process_order_async", (shop_id, order, event_id))
+    except Exception:
+        logger.exception("Enqueue failed for webhook %s", event_id)
+        try:
+            await release_webhook(event_id)
+        except RedisError:
+            pass
+        return "enqueue_failed", JSONResponse({"ok": False, "error": "enqueue failed"}, status_code=503)
+    logger.info("Enqueued order %s for shop %s (webhook %s)", order["id"], shop_id, event_id)
+    return "enqueued", {"ok": True}
@@ -1,24 +1,24 @@
-from app.rules.ruleset import rules_basic
-from app.adapters.emailrep import score_email
-from app.adapters.ipintel import score_ip
-from app.adapters.botcheck import score_device
+from app.rules.ruleset import get_ruleset
+from app.adapters.executor import AdapterRunner, get_adapter_runner
 
-def defender3d(order: dict) -> dict:
-    # Rules-based score
-    rules_score, reasons = rules_basic(order)
+# adapter name -> scoring input field
+ADAPTER_FIELDS = {"email": "email", "ip": "ip", "device": "device_id"}
 
-    # Adapter scores
-    email_score = score_email(order.get("email"))
-    ip_score = score_ip(order.get("ip"))
-    device_score = score_device(order.get("device_id"))
+def defender3d(order: dict, runner: AdapterRunner | None = None, budget: float | None = None) -> dict:
+    # Rules-based score (per-shop compiled ruleset)
+    ruleset = get_ruleset(order.get("shop_id"))
+    rules_score, reasons = ruleset.evaluate(order)
+
+    # Adapter scores (concurrent, bounded by the scoring deadline)
+    run = (runner or get_adapter_runner()).run({name: order.get(f) for name, f in ADAPTER_FIELDS.items()},
+                                               budget=budget)
+    email_score = run.scores.get("email", 0.0)
+    ip_score = run.scores.get("ip", 0.0)
+    device_score = run.scores.get("device", 0.0)
 
     # Aggregate
     final_score = min(100.0, rules_score + email_score + ip_score + device_score)
-    verdict = "green"
-    if final_score >= 70:
-        verdict = "red"
-    elif final_score >= 30:
-        verdict = "amber"
+    verdict = ruleset.verdict(final_score)
 
     # Adapter reasons (stub: add if score > 0)
     if email_score > 0:
@@ -28,9 +28,13 @@ def defender3d(order: dict) -> dict:
     if device_score > 0:
         reasons.append("device_adapter")
 
-    return {
+    result = {
         "rules_score": rules_score,
         "final_score": final_score,
         "verdict": verdict,
         "reasons": reasons
     }
+    if run.degraded:
+        # Scored without these adapters (timeout, error or open circuit)
+        result["degraded"] = run.degraded
+    return result
@@ -0,0 +1,261 @@
+# app/rules/engine.py
+"""Declarative rulesets compiled to a single Python function.
+
+A ruleset definition (see definitions/default.json) is a list of rules, each
+`{"id", "when", "score", "reason"}`, plus verdict cut-offs. `when` is a
+condition tree:
+
+    {"all": [...]} | {"any": [...]} | {"not": {...}}
+    {"field": "total_price", "op": "gt", "value": 500}
+
+ops: gt gte lt lte (missing -> 0), eq ne, in not_in, endswith startswith
+(case-insensitive, value may be a list), present absent, eq_field ne_field
+(compare with another field; both must be set). Values are scalars.
+
+compile_ruleset() turns the whole definition into generated source with
+every field read once into a local, so evaluating it costs about the same as
+a hand-written function. Only validated field names and repr()-ed scalar
+literals reach the source. One evaluation in `sample_every` runs an
+instrumented copy that counts which rules fire and times each one; the
+stats are estimates from those samples so the fast path stays free of
+bookkeeping.
+"""
+import itertools
+import json
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from ..utils.logging import logger
+
+_FIELD_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+_ORDERING = {"gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
+_EQUALITY = {"eq": "==", "ne": "!="}
+
+
+class RuleError(ValueError):
+    """A ruleset definition that cannot be compiled."""
+
+
+def _literal(value) -> str:
+    # repr() of these types is always a plain Python literal, so it is safe to
+    # inline into generated source (and folds to a constant, unlike C[i]).
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return repr(value)
+    raise RuleError(f"Unsupported value: {value!r}")
+
+def _number(op, value) -> str:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise RuleError(f"{op} needs a number, got {value!r}")
+    return repr(value)
+
+
+class _Codegen:
+    def __init__(self):
+        self.fields: Dict[str, str] = {}
+
+    def var(self, field) -> str:
+        if not isinstance(field, str) or not _FIELD_RE.match(field):
+            raise RuleError(f"Invalid field name: {field!r}")
+        return self.fields.setdefault(field, f"v{len(self.fields)}")
+
+    def cond(self, c) -> str:
+        if not isinstance(c, dict):
+            raise RuleError(f"Condition must be an object: {c!r}")
+        if "all" in c:
+            return "(" + (" and ".join(self.cond(x) for x in c["all"]) or "True") + ")"
+        if "any" in c:
+            return "(" + (" or ".join(self.cond(x) for x in c["any"]) or "False") + ")"
+        if "not" in c:
+            return f"(not {self.cond(c['not'])})"
+
+        v, op, value = self.var(c.get("field")), c.get("op"), c.get("value")
+        if op in _ORDERING:
+            return f"(({v} or 0) {_ORDERING[op]} {_number(op, value)})"
+        if op in _EQUALITY:
+            return f"({v} {_EQUALITY[op]} {_literal(value)})"
+        if op in ("in", "not_in"):
+            if not isinstance(value, list) or not value:
+                raise RuleError(f"{op} needs a non-empty list, got {value!r}")
+            neg = "not " if op == "not_in" else ""
+            return f"({v} {neg}in {{{', '.join(_literal(x) for x in value)}}})"
+        if op in ("endswith", "startswith"):
+            values = value if isinstance(value, list) else [value]
+            if not values or not all(isinstance(x, str) for x in values):
+                raise RuleError(f"{op} needs a string or list of strings, got {value!r}")
+            return f"(({v} or '').lower().{op}(({''.join(repr(x.lower()) + ', ' for x in values)})))"
+        if op == "present":
+            return f"(not not {v})"
+        if op == "absent":
+            return f"(not {v})"
+        if op in ("eq_field", "ne_field"):
+            other = self.var(value)
+            cmp = "==" if op == "eq_field" else "!="
+            return f"({v} and {other} and {v} {cmp} {other})"
+        raise RuleError(f"Unknown op: {op!r}")
+
+
+def _generate(definition: dict) -> Tuple[str, List[dict]]:
+    rules = definition.get("rules")
+    if not isinstance(rules, list):
+        raise RuleError("Ruleset needs a 'rules' list")
+    gen = _Codegen()
+    body: List[str] = []
+    timed: List[str] = []
+    meta: List[dict] = []
+    for i, rule in enumerate(rules):
+        rid = rule.get("id") or f"rule_{i}"
+        try:
+            score = _number("score", rule["score"])
+            cond = gen.cond(rule["when"])
+        except (KeyError, TypeError, ValueError) as e:
+            raise RuleError(f"Rule {rid!r}: {e}") from e
+        reason = str(rule.get("reason") or rid)
+        hit = [f"        score += {score}", f"        reasons.append({reason!r})"]
+        body += [f"    if {cond}:"] + hit
+        timed += [f"    if {cond}:"] + hit + [f"        fired[{i}] += 1",
+                                               f"    t1 = perf(); spent[{i}] += t1 - t0; t0 = t1"]
+        meta.append({"id": rid, "score": rule["score"], "reason": reason})
+
+    max_score = float(definition.get("max_score", 100.0))
+    loads = [f"        {v} = get({f!r})" for f, v in gen.fields.items()]
+    tail = [f"        return (score if score < {max_score!r} else {max_score!r}), reasons"]
+    head = ["        get = o.get"] + loads + ["        score = 0.0", "        reasons = []"]
+    indent = lambda lines: ["    " + line for line in lines]
+    # A factory so counters are closure cells and evaluate() is the generated
+    # function itself (no wrapper frame). The fast path does no bookkeeping
+    # beyond one next() on the sampler; every sample_every-th call takes the
+    # instrumented path, which counts fires and times each rule.
+    src = "\n".join(
+        ["def _factory(fired, spent, samples, sampler, perf):",
+         "    def _evaluate_timed(o):",
+         "        samples[0] += 1"] + head + ["        t0 = perf()"] + indent(timed) + tail
+        + ["    def _evaluate(o):",
+           "        if next(sampler):",
+           "            return _evaluate_timed(o)"] + head + indent(body) + tail
+        + ["    return _evaluate"]
+    ) + "\n"
+    return src, meta
+
+
+class CompiledRuleset:
+    def __init__(self, definition: dict, name: str = "default", sample_every: int = 100):
+        src, meta = _generate(definition)
+        ns: dict = {}
+        exec(compile(src, f"<ruleset {name}>", "exec"), ns)
+        self.name = name
+        self.version = definition.get("version")
+        self.rules = meta
+        self.source = src
+        self.sample_every = max(1, sample_every)
+        self.fired = [0] * len(meta)
+        self.spent = [0.0] * len(meta)
+        self._samples = [0]
+        sampler = itertools.cycle([False] * (self.sample_every - 1) + [True])
+        # evaluate(order) -> (rules_score 0..max_score, reasons)
+        self.evaluate = ns["_factory"](self.fired, self.spent, self._samples, sampler, time.perf_counter)
+        cutoffs = definition.get("verdicts", {"red": 70, "amber": 30})
+        self.verdicts = sorted(((float(t), v) for v, t in cutoffs.items()), reverse=True)
+
+    @property
+    def sampled(self) -> int:
+        return self._samples[0]
+
+    @property
+    def evaluations(self) -> int:
+        # exact to within sample_every
+        return self._samples[0] * self.sample_every
+
+    def verdict(self, score: float) -> str:
+        for threshold, name in self.verdicts:
+            if score >= threshold:
+                return name
+        return "green"
+
+    def stats(self) -> List[dict]:
+        """Per-rule fire rate and mean cost, estimated from the sampled evaluations."""
+        n = self.sampled
+        return [{
+            "id": r["id"],
+            "fire_rate": (self.fired[i] / n) if n else None,
+            "fired_est": self.fired[i] * self.sample_every,
+            "mean_us": (self.spent[i] / n * 1e6) if n else None,
+        } for i, r in enumerate(self.rules)]
+
+
+def compile_ruleset(definition: dict, name: str = "default", sample_every: int = 100) -> CompiledRuleset:
+    return CompiledRuleset(definition, name=name, sample_every=sample_every)
+
+
+_SHOP_FILE_RE = re.compile(r"^[a-z0-9][a-z0-9.-]*$")
+
+class _Entry:
+    __slots__ = ("path", "mtime", "ruleset", "next_check")
+
+    def __init__(self, path, mtime, ruleset, next_check):
+        self.path, self.mtime, self.ruleset, self.next_check = path, mtime, ruleset, next_check
+
+
+class RulesetRegistry:
+    """Per-shop compiled rulesets loaded from `<directory>/<shop>.json`.
+
+    Shops without their own file use `default.json`. Files are re-stat'ed at
+    most every `reload_interval` seconds and recompiled when they change; a
+    definition that fails to compile is logged and the previous one is kept.
+    """
+
+    def __init__(self, directory: str, reload_interval: float = 5.0, sample_every: int = 100):
+        self.directory = directory
+        self.reload_interval = reload_interval
+        self.sample_every = sample_every
+        self._entries: Dict[str, _Entry] = {}
+        self._compiled: Dict[Tuple[str, int], CompiledRuleset] = {}
+        self._lock = threading.Lock()
+
+    def path_for(self, shop_id: Optional[str]) -> str:
+        if shop_id and _SHOP_FILE_RE.match(shop_id):
+            path = os.path.join(self.directory, f"{shop_id}.json")
+            if os.path.exists(path):
+                return path
+        return os.path.join(self.directory, "default.json")
+
+    def _load(self, path: str, mtime: int) -> CompiledRuleset:
+        cached = self._compiled.get((path, mtime))
+        if cached is None:
+            with open(path, "rb") as fh:
+                definition = json.load(fh)
+            name = os.path.splitext(os.path.basename(path))[0]
+            cached = compile_ruleset(definition, name=name, sample_every=self.sample_every)
+            # keep one compiled copy per file so shops sharing default.json share counters
+            self._compiled = {k: v for k, v in self._compiled.items() if k[0] != path}
+            self._compiled[(path, mtime)] = cached
+            logger.info("Compiled ruleset %s (version %s, %d rules)", name, cached.version, len(cached.rules))
+        return cached
+
+    def get(self, shop_id: Optional[str] = None) -> CompiledRuleset:
+        key = shop_id or ""
+        entry = self._entries.get(key)
+        now = time.monotonic()
+        if entry is not None and now < entry.next_check:
+            return entry.ruleset
+        with self._lock:
+            path = self.path_for(shop_id)
+            mtime = os.stat(path).st_mtime_ns
+            if entry is not None and entry.path == path and entry.mtime == mtime:
+                entry.next_check = now + self.reload_interval
+                return entry.ruleset
+            try:
+                ruleset = self._load(path, mtime)
+            except (OSError, ValueError) as e:
+                if entry is None:
+                    raise
+                logger.error("Ruleset reload failed for %s, keeping previous: %s", path, e)
+                entry.next_check = now + self.reload_interval
+                return entry.ruleset
+            self._entries[key] = _Entry(path, mtime, ruleset, now + self.reload_interval)
+            return ruleset
+
+    def stats(self) -> Dict[str, List[dict]]:
+        return {rs.name: rs.stats() for rs in self._compiled.values()}
@@ -1,29 +1,20 @@
 # app/rules/ruleset.py
-from typing import Dict, List, Tuple
+import os
+from typing import Dict, List, Optional, Tuple
 
-def rules_basic(order: Dict) -> Tuple[float, List[str]]:
-    """Return (rules_score 0..100, reasons)"""
-    score = 0.0
-    reasons = []
-
-    # examples (tune thresholds as needed)
-    if order.get("billing_country") and order.get("shipping_country"):
-        if order["billing_country"] != order["shipping_country"]:
-            score += 25; reasons.append("Country mismatch (billing vs shipping)")
+from app.config import settings
+from app.rules.engine import CompiledRuleset, RulesetRegistry
 
-    if (order.get("total_price") or 0) > 500:
-        score += 15; reasons.append("High-value order")
+DEFINITIONS_DIR = os.path.join(os.path.dirname(__file__), "definitions")
 
-    email = (order.get("email") or "").lower()
-    if email.endswith(".ru") or email.endswith(".cn"):
-        score += 10; reasons.append("Suspicious email TLD")
+registry = RulesetRegistry(settings.RULES_DIR or DEFINITIONS_DIR,
+                           reload_interval=settings.RULES_RELOAD_SECONDS)
 
-    ip = order.get("ip")
-    if ip in {"0.0.0.0", "127.0.0.1"}:
-        score += 20; reasons.append("Bogus IP")
+def get_ruleset(shop_id: Optional[str] = None) -> CompiledRuleset:
+    """Compiled ruleset for a shop (hot-reloaded from RULES_DIR)."""
+    return registry.get(shop_id)
 
-    # velocity: provided by vault/adapters—assume order["repeat_email"] added upstream
-    if order.get("repeat_email", 0) > 3:
-        score += 20; reasons.append("Email seen high velocity")
-
-    return min(score, 100.0), reasons
+def rules_basic(order: Dict) -> Tuple[float, List[str]]:
+    """Return (rules_score 0..100, reasons)"""
+    # thresholds live in definitions/default.json (or RULES_DIR/<shop>.json)
+    return get_ruleset(order.get("shop_id")).evaluate(order)
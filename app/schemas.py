@@ -1,9 +1,9 @@
 from pydantic import BaseModel, Field
-from typing import Optional, Dict
+from typing import Optional, Dict, List
 from datetime import datetime
 
 class ObserveInput(BaseModel):
-    shop_id: str
+    # no shop_id: vault counts are shared across shops (a "shop_id" sent by older callers is ignored)
     ids: Dict[str, Optional[str]]
     outcome: Dict[str, int] = Field(default_factory=dict)
 
@@ -27,3 +27,24 @@ class CaptureInput(BaseModel):
     device_id: Optional[str] = None
     cart_token: Optional[str] = None
     email: Optional[str] = None
+
+class ScoreInput(BaseModel):
+    shop_id: str
+    order_id: Optional[str] = None  # e.g. the checkout token, echoed back
+    email: Optional[str] = None
+    ip: Optional[str] = None
+    device_id: Optional[str] = None
+    billing_country: Optional[str] = None
+    shipping_country: Optional[str] = None
+    total_price: float = 0.0
+    currency: Optional[str] = None
+    budget_ms: Optional[float] = Field(None, gt=0, le=1000)  # default SCORE_BUDGET_MS
+
+class ScoreResponse(BaseModel):
+    order_id: Optional[str] = None
+    score: float
+    rules_score: float
+    verdict: str
+    reasons: List[str]
+    degraded: List[str] = Field(default_factory=list)
+    elapsed_ms: float
@@ -0,0 +1,147 @@
+"""Checkout-time scoring for POST /v1/score: one order, read-only, within a budget.
+
+The Celery pipeline (celery_worker.score_orders) counts each order in the
+vault and the velocity windows before it scores it. At checkout there is
+no order yet, and orders/create will count it later, so here nothing is
+written. The counts are read as they stand, which is exactly the "prior"
+view the worker would see.
+
+Everything runs against SCORE_BUDGET_MS:
+- vault repeat counts and cluster_size (count cache, Bloom filter, then
+  Postgres), and the Redis velocity windows, concurrently;
+- then defender3d, whose adapters get what is left of the budget.
+Whatever does not make it in time is skipped and named in "degraded". The
+rules still run on the fields that did arrive, so the worst case is a
+rules-only verdict. Skipped lookups are not cancelled: their results
+still fill the count and adapter caches for the next checkout. At most
+SCORE_MAX_PENDING of them are left running; past that, new checkouts do
+not start their lookups and get them in "degraded" straight away, so a
+slow Postgres sheds load instead of piling up sessions.
+
+The budget was only measured with SQLite and fakeredis (bench.suite
+--only score); a networked Postgres and Redis add their round trips.
+"""
+import asyncio
+import time
+from typing import Dict, List, Optional, Set
+
+from redis.exceptions import RedisError
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from .config import settings
+from .database import get_async_sessionmaker
+from .rules.defender3d import defender3d
+from .utils import metrics
+from .utils.logging import logger
+from .vault import graph, velocity
+from .vault.keys import get_key_deriver, lookup_key
+from .vault.repository import cached_lookup_counts
+
+IDENTITY_FIELDS = (
+    ("email", "email", "repeat_email"),
+    ("ip", "ip", "repeat_ip"),
+    ("device", "device_id", "repeat_device"),
+)
+
+SCORE_SECONDS = metrics.histogram(
+    "fp_score_seconds", "POST /v1/score scoring time, by whether anything was skipped",
+    labels=("outcome",), buckets=(0.001, 0.0025, 0.005, 0.01, 0.015, 0.02, 0.025, 0.05, 0.1, 0.25))
+SCORE_SKIPPED = metrics.counter("fp_score_skipped_total", "Checkout scoring inputs skipped for the budget",
+                                labels=("part",))
+
+_pending: Set[asyncio.Task] = set()  # lookups still finishing after their request gave up on them
+
+def identity_keys(data: dict) -> dict:
+    """Map repeat_* field -> (kind, lookup_key) for the identifiers present on an order."""
+    return {repeat: (kind, lookup_key(data[field], kind))
+            for kind, field, repeat in IDENTITY_FIELDS if data.get(field)}
+
+def checkout_input(shop_id: str, order_id: Optional[str], fields: dict) -> dict:
+    """A scoring input shaped like celery_worker.build_order_input's."""
+    data = {
+        "shop_id": shop_id,
+        "order_id": order_id,
+        "total_price": float(fields.get("total_price") or 0),
+        "currency": fields.get("currency"),
+        "email": (fields.get("email") or "").lower(),
+        "ip": fields.get("ip"),
+        "country": fields.get("shipping_country"),
+        "billing_country": fields.get("billing_country"),
+        "shipping_country": fields.get("shipping_country"),
+        "device_id": fields.get("device_id"),
+    }
+    data.update({repeat: 0 for _, _, repeat in IDENTITY_FIELDS})
+    data.update(velocity.empty_fields(repeat for _, _, repeat in IDENTITY_FIELDS))
+    return data
+
+def _vault_fields(db: Session, data: dict) -> dict:
+    """repeat_* summed over every readable key version, and cluster_size; reads only."""
+    deriver = get_key_deriver()
+    wanted = {repeat: [(kind, k) for k in deriver.read_keys(data[field], kind)]
+              for kind, field, repeat in IDENTITY_FIELDS if data.get(field)}
+    counts = cached_lookup_counts(db, {k for keys in wanted.values() for k in keys})
+    out = {repeat: sum(counts.get(k, 0) for k in keys) for repeat, keys in wanted.items()}
+    if settings.IDENTITY_GRAPH_KINDS:
+        out["cluster_size"] = graph.cluster_sizes(db, [identity_keys(data).values()],
+                                                  settings.IDENTITY_GRAPH_KINDS)[0]
+    return out
+
+async def _vault_lookup(data: dict) -> dict:
+    # its own session: it may outlive the request that started it
+    async with get_async_sessionmaker()() as db:
+        return await db.run_sync(_vault_fields, data)
+
+async def _velocity_lookup(data: dict) -> dict:
+    keys = identity_keys(data)
+    windows = await velocity.peek(list(keys.values()))
+    return {f"{repeat}_{name}": n for repeat, key in keys.items() for name, n in windows[key].items()}
+
+def _finished(task: asyncio.Task, part: str) -> Optional[dict]:
+    if not task.done():
+        _pending.add(task)
+        task.add_done_callback(_pending.discard)
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())  # retrieve late errors quietly
+        return None
+    if task.exception() is not None:
+        if not isinstance(task.exception(), RedisError):
+            logger.warning("Checkout %s lookup failed", part, exc_info=task.exception())
+        return None
+    return task.result()
+
+async def score_checkout(data: dict, budget_ms: Optional[float] = None) -> dict:
+    """defender3d result for `data`, plus "degraded" (parts skipped) and "elapsed_ms"."""
+    started = time.perf_counter()
+    budget = (settings.SCORE_BUDGET_MS if budget_ms is None else budget_ms) / 1000.0
+    reserve = settings.SCORE_RESERVE_MS / 1000.0
+    degraded: List[str] = []
+
+    parts = {"vault": _vault_lookup}
+    if identity_keys(data):
+        parts["velocity"] = _velocity_lookup
+    lookups: Dict[str, asyncio.Task] = {}
+    if len(_pending) >= settings.SCORE_MAX_PENDING:
+        degraded += parts  # earlier lookups are still running late; don't add more
+    else:
+        lookups = {part: asyncio.create_task(lookup(data)) for part, lookup in parts.items()}
+    if lookups:
+        left = budget - reserve - (time.perf_counter() - started)
+        await asyncio.wait(lookups.values(), timeout=max(0.0, left))
+    for part, task in lookups.items():
+        found = _finished(task, part)
+        if found is None:
+            degraded.append(part)
+        else:
+            data.update(found)
+
+    left = budget - reserve - (time.perf_counter() - started)
+    # adapters only answer from their cache once the budget is spent
+    result = await run_in_threadpool(defender3d, data, None, max(0.0, left))
+    degraded += result.pop("degraded", [])
+    for part in degraded:
+        SCORE_SKIPPED.inc(part=part)
+    elapsed = time.perf_counter() - started
+    SCORE_SECONDS.observe(elapsed, outcome="degraded" if degraded else "full")
+    result["degraded"] = degraded
+    result["elapsed_ms"] = round(elapsed * 1000, 3)
+    return result
@@ -0,0 +1,17 @@
+# tests/conftest.py
+import os
+
+# app.config builds Settings() at import time; give it harmless defaults.
+for _k, _v in {
+    "DATABASE_URL": "sqlite://",
+    "REDIS_URL": "redis://localhost:6379/0",
+    "REMIX_URL": "http://localhost:3000",
+    "INTERNAL_SHARED_SECRET": "test-internal",
+    "JWT_SECRET": "test-jwt",
+    "ENCRYPTION_KEY": "test-encryption",
+    "VAULT_PEPPER": "test-pepper",
+    "SHOPIFY_WEBHOOK_SECRET": "test-webhook-secret",
+    # no vault cache sync thread; tests that need it turn it on
+    "VAULT_CACHE_SYNC_SECONDS": "0",
+}.items():
+    os.environ.setdefault(_k, _v)
@@ -0,0 +1,53 @@
+# tests/remix_stub.py
+"""Local stand-in for the Remix app's /api/metafields-set endpoint."""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class RemixStub:
+    """Replies with queued (status, body, headers) tuples, then 200 ok.
+
+    Every request body is recorded in `calls`; `connections` counts TCP
+    connections so tests can check keep-alive reuse.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.responses = []
+        self.connections = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                stub.connections += 1
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                stub.calls.append({"path": self.path, "auth": self.headers.get("x-internal-auth"), "body": body})
+                status, payload, headers = stub.responses.pop(0) if stub.responses else (200, {"ok": True}, {})
+                raw = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(raw)))
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(raw)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,60 @@
+# tests/test_adapters.py
+import time
+
+from app.adapters.executor import AdapterRunner
+from app.vault.keys import lookup_key
+from app.rules.defender3d import defender3d
+
+class FakeAdapter:
+    def __init__(self, score=0.0, delay=0.0, fail=False):
+        self.score, self.delay, self.fail, self.calls = score, delay, fail, 0
+
+    def __call__(self, value):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("vendor down")
+        return self.score
+
+def test_fan_out_is_concurrent_with_partial_results_on_deadline():
+    runner = AdapterRunner({"email": FakeAdapter(10, delay=0.1), "ip": FakeAdapter(5, delay=0.1),
+                            "device": FakeAdapter(50, delay=1.0)},
+                           timeout=0.5, deadline=0.3)
+    t = time.monotonic()
+    run = runner.run({"email": "a@b.c", "ip": "1.2.3.4", "device": "dev-1"})
+    assert time.monotonic() - t < 0.45  # in parallel, cut off at the deadline
+    assert run.scores == {"email": 10.0, "ip": 5.0}
+    assert run.timed_out == ["device"]
+
+def test_circuit_breaker_opens_and_cache_skips_vendor():
+    down, ok = FakeAdapter(fail=True), FakeAdapter(20)
+    runner = AdapterRunner({"email": ok, "ip": down}, failure_threshold=2, reset_timeout=60)
+    for _ in range(3):
+        run = runner.run({"email": "a@b.c", "ip": "1.2.3.4"})
+    assert down.calls == 2 and run.circuit_open == ["ip"]
+    assert ok.calls == 1 and run.cached == ["email"]
+
+def test_defender3d_scores_with_degraded_adapters():
+    runner = AdapterRunner({"email": FakeAdapter(fail=True), "ip": FakeAdapter(75), "device": FakeAdapter()})
+    result = defender3d({"email": "a@b.c", "ip": "1.2.3.4", "device_id": None}, runner=runner)
+    assert result["verdict"] == "red" and result["degraded"] == ["email"]
+
+def test_caller_budget_cut_does_not_count_against_the_breaker():
+    slow = FakeAdapter(30, delay=0.1)
+    runner = AdapterRunner({"email": slow}, timeout=0.5, failure_threshold=1)
+    run = runner.run({"email": "a@b.c"}, budget=0.0)
+    assert run.timed_out == ["email"] and runner.breakers["email"].state == "closed"
+    time.sleep(0.2)  # the late answer lands in the cache
+    run = runner.run({"email": "a@b.c"}, budget=0.0)
+    assert run.scores == {"email": 30.0} and run.cached == ["email"] and slow.calls == 1
+
+def test_cache_is_keyed_by_the_vault_key_of_each_kind():
+    email, ip = FakeAdapter(10), FakeAdapter(5)
+    runner = AdapterRunner({"email": email, "ip": ip})
+    # the same text as an email and as an IP: two lookups, two entries
+    assert runner.run({"email": "1.2.3.4", "ip": "1.2.3.4"}).scores == {"email": 10.0, "ip": 5.0}
+    assert email.calls == 1 and ip.calls == 1 and len(runner.cache) == 2
+    # normalised like the vault: a differently spelled email is the same identity
+    runner.run({"email": " A@B.c "})
+    assert runner.run({"email": "a@b.c"}).cached == ["email"] and email.calls == 2
+    assert runner.cache.get(("email", lookup_key("a@b.c", "email"))) == 10.0
@@ -0,0 +1,51 @@
+# tests/test_backtest.py
+import json
+import random
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from app.backtest import VectorRuleset, backtest
+from app.database import Base
+from app.evidence.repository import write_evidence
+from app.models import EvidenceLog
+from app.rules.engine import compile_ruleset
+from app.rules.ruleset import DEFINITIONS_DIR
+
+def _orders(n):
+    rnd = random.Random(3)
+    return [{
+        "order_id": str(i), "shop_id": "a.myshopify.com",
+        "billing_country": rnd.choice(["US", "CA", None]), "shipping_country": rnd.choice(["US", "CA"]),
+        "total_price": rnd.choice([10.0, 499.0, 501.0, 2000.0]),
+        "email": rnd.choice(["a@b.com", "x@y.RU", "", None]), "ip": rnd.choice(["127.0.0.1", "1.2.3.4", None]),
+        "repeat_email": rnd.choice([0, 4]), "repeat_ip_1h": rnd.choice([0, 5]),
+    } for i in range(n)]
+
+def test_vectorized_backtest_matches_compiled_rules():
+    with open(f"{DEFINITIONS_DIR}/default.json") as fh:
+        default = json.load(fh)
+    stricter = json.loads(json.dumps(default))
+    stricter["verdicts"] = {"red": 40, "amber": 15}
+
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    orders = _orders(300)
+    with Session(engine) as db:
+        # older orders in evidence_log, newer ones in the compact format
+        db.add_all([EvidenceLog(order_id=o["order_id"], key="input", value=o) for o in orders[:150]])
+        write_evidence(db, [(o, {"final_score": 0, "reasons": []}) for o in orders[150:]])
+        db.add(EvidenceLog(order_id="0", key="scores", value={"final_score": 0}))
+        db.commit()
+        report = backtest(db, VectorRuleset(default, "default"), VectorRuleset(stricter, "stricter"),
+                          chunk=64, show=5)
+
+    scalar, strict = compile_ruleset(default), compile_ruleset(stricter)
+    expected_before = [scalar.verdict(scalar.evaluate(o)[0]) for o in orders]
+    expected_after = [strict.verdict(strict.evaluate(o)[0]) for o in orders]
+    assert report["orders"] == 300
+    for v, row in report["verdicts"].items():
+        assert row["baseline"] == expected_before.count(v)
+        assert row["candidate"] == expected_after.count(v)
+    assert report["flipped"] == sum(a != b for a, b in zip(expected_before, expected_after))
+    assert len(report["flipped_orders"]) == 5
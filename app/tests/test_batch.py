@@ -0,0 +1,86 @@
+# tests/test_batch.py
+import pytest
+from sqlalchemy import create_engine, select, func
+from sqlalchemy.orm import Session
+
+from app.celery_worker import build_order_input, save_results, score_orders
+from app.database import Base
+from app.models import OrderRisk, OrderEvidence, RiskIdentity, WebhookEvent
+from app.utils import order_queue
+
+def _scored(order_id, event_id):
+    data = build_order_input("a.myshopify.com", {"id": order_id, "total_price": "12.50", "email": "X@Y.COM"})
+    result = {"final_score": 10.0, "rules_score": 10.0, "verdict": "green", "reasons": []}
+    return data, result, event_id
+
+def test_save_results_bulk_and_skips_redelivered_orders():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as db:
+        assert save_results(db, [_scored(1, "w1"), _scored(2, "w2")]) == {"1", "2"}
+        db.commit()
+        assert save_results(db, [_scored(2, "w3"), _scored(3, None)]) == {"3"}
+        db.commit()
+        assert db.scalar(select(func.count()).select_from(OrderRisk)) == 3
+        assert db.scalar(select(func.count()).select_from(OrderEvidence)) == 3
+        assert db.scalars(select(WebhookEvent.processed)).all() == [True, True, True]
+
+def test_score_orders_counts_identities_once_per_order(monkeypatch):
+    monkeypatch.setattr("app.celery_worker.enrich_velocity", lambda orders: None)
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as db:
+        first = [_scored(1, None)[0], _scored(2, None)[0]]
+        score_orders(db, first)
+        assert [d["repeat_email"] for d in first] == [0, 1]
+        save_results(db, [(d, {"final_score": 0, "rules_score": 0, "verdict": "green", "reasons": []}, None)
+                          for d in first])
+        db.commit()
+        # order 2 redelivered: scored again, but its sighting is taken back on save
+        again = [_scored(2, None)[0]]
+        score_orders(db, again)
+        assert again[0]["repeat_email"] == 2
+        save_results(db, [(again[0], {"final_score": 0, "rules_score": 0, "verdict": "green", "reasons": []}, None)])
+        db.commit()
+        assert db.scalar(select(RiskIdentity.seen_count)) == 2
+
+def test_order_queue_claim_ack_and_requeue():
+    fakeredis = pytest.importorskip("fakeredis")
+    r = fakeredis.FakeRedis()
+    for i in range(3):
+        r.rpush(order_queue.PENDING_KEY, b'{"shop_id":"s","order":{"id":%d},"event_id":null}' % i)
+    assert [x["order"]["id"] for x in order_queue.claim("c1", 2, client=r)] == [0, 1]
+    # consumer died before ack: its claimed orders go back to the front
+    assert order_queue.requeue_unacked("c1", client=r) == 2
+    assert [x["order"]["id"] for x in order_queue.claim("c1", 5, client=r)] == [0, 1, 2]
+    order_queue.ack("c1", client=r)
+    assert order_queue.requeue_unacked("c1", client=r) == 0
+
+def test_projected_order_scores_like_the_full_payload():
+    from app.utils.order_payload import project_order
+    order = {
+        "id": 42, "admin_graphql_api_id": "gid://shopify/Order/42", "total_price": "99.00", "currency": "EUR",
+        "email": "A@B.example", "client_details": {"browser_ip": "1.2.3.4", "user_agent": "x"},
+        "shipping_address": {"country_code": "DE", "city": "Berlin"}, "billing_address": {"country_code": "FR"},
+        "note_attributes": [{"name": "gift", "value": "yes"}, {"name": "fraudpop_device_id", "value": "dev-1"}],
+        "line_items": [{"id": i, "title": "x" * 40} for i in range(50)], "customer": {"id": 1},
+    }
+    slim = project_order(order)
+    assert build_order_input("a.myshopify.com", slim) == build_order_input("a.myshopify.com", order)
+    assert slim["admin_graphql_api_id"] == order["admin_graphql_api_id"] and "line_items" not in slim
+    assert build_order_input("a.myshopify.com", project_order({"id": 1})) == build_order_input("a.myshopify.com", {"id": 1})
+
+def test_process_batch_scores_a_repeated_order_once(monkeypatch):
+    from sqlalchemy.orm import sessionmaker
+    from app import batch_consumer
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    monkeypatch.setattr(batch_consumer, "get_sessionmaker", lambda: sessionmaker(engine))
+    monkeypatch.setattr(batch_consumer, "write_metafields", lambda *a: None)
+    monkeypatch.setattr("app.celery_worker.enrich_velocity", lambda orders: None)
+    order = {"id": 7, "total_price": "12.50", "email": "X@Y.COM"}
+    items = [{"shop_id": "a.myshopify.com", "order": order, "event_id": e} for e in ("w1", "w2")]
+    assert batch_consumer.process_batch(items) == 1
+    with Session(engine) as db:
+        assert db.scalar(select(RiskIdentity.seen_count)) == 1
+        assert db.scalar(select(func.count()).select_from(OrderEvidence)) == 1
@@ -0,0 +1,38 @@
+# tests/test_capture.py
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+from sqlalchemy import create_engine, select, func
+from sqlalchemy.orm import sessionmaker
+
+from app import celery_worker
+from app.config import settings
+from app.database import Base
+from app.models import DeviceCapture
+from app.utils import capture_buffer, redis_client
+
+def _record(i):
+    return {"shop_id": "a.myshopify.com", "session_id": f"s{i}", "device_id": None,
+            "cart_token": None, "email": None, "created_at": datetime.now(timezone.utc).isoformat()}
+
+def test_capture_buffer_backpressure_and_bulk_flush(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(settings, "CAPTURE_BUFFER_MAX", 5)
+    monkeypatch.setattr(settings, "CAPTURE_FLUSH_BATCH", 2)
+
+    async def push():
+        r = fakeredis.FakeAsyncRedis(server=server)
+        return [await capture_buffer.push_captures([_record(i)], client=r) for i in range(6)]
+
+    assert asyncio.run(push()) == [True] * 5 + [False]
+
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    monkeypatch.setattr(redis_client, "_client", fakeredis.FakeRedis(server=server))
+    monkeypatch.setattr(celery_worker, "get_sessionmaker", lambda: sessionmaker(engine))
+    assert celery_worker.flush_captures() == 5
+    assert capture_buffer.pending_captures() == 0
+    with sessionmaker(engine)() as db:
+        assert db.scalar(select(func.count()).select_from(DeviceCapture)) == 5
@@ -0,0 +1,55 @@
+# tests/test_evidence.py
+from sqlalchemy import create_engine, select, func
+from sqlalchemy.orm import Session
+
+from app.database import Base
+from app.evidence import codec
+from app.evidence.repository import write_evidence
+from app.models import EvidenceBlob, OrderEvidence, ReasonText
+
+DATA = {"shop_id": "a.myshopify.com", "order_id": "1", "total_price": 12.5, "email": "a@b.com",
+        "repeat_email": 2, "cluster_size": 4}
+RESULT = {"rules_score": 25.0, "final_score": 25.0, "verdict": "green",
+          "reasons": ["Country mismatch (billing vs shipping)"], "degraded": ["ip"]}
+
+def test_codec_round_trips_unknown_fields():
+    raw = codec.unpack(*codec.pack(codec.encode_input(DATA), codec.INPUT_CODEC)[1:])
+    ids = {"shop_id": DATA["shop_id"], "order_id": DATA["order_id"]}
+    assert {**ids, **{k: v for k, v in codec.decode_input(raw).items() if v is not None}} == DATA
+    # V1 blobs carried the ids in the payload and still decode
+    legacy = codec._dumps([DATA.get(f) for f in codec.INPUT_FIELDS_V1] + [{"cluster_size": 4}])
+    assert {k: v for k, v in codec.decode_input(legacy, codec.CODEC_ZJSON_V1).items() if v is not None} == DATA
+    raw = codec.encode_scores(RESULT, {RESULT["reasons"][0]: 7})
+    assert codec.decode_scores(raw, {7: RESULT["reasons"][0]}) == RESULT
+
+def test_identical_payloads_are_stored_once():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as db:
+        # the same input for another order shares its blob: ids live on order_evidence
+        assert write_evidence(db, [(DATA, RESULT), (dict(DATA, order_id="2"), RESULT)]) == 2
+        assert write_evidence(db, [(dict(DATA, order_id="3", total_price=99.0), RESULT)]) == 1
+        db.commit()
+        assert db.scalar(select(func.count()).select_from(OrderEvidence)) == 3
+        assert db.scalar(select(func.count()).select_from(EvidenceBlob)) == 3
+        assert db.scalar(select(func.count()).select_from(ReasonText)) == 1
+
+def test_read_evidence_restores_the_order_ids(tmp_path):
+    import asyncio
+    import pytest
+    pytest.importorskip("aiosqlite")
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+    from app.evidence.repository import read_evidence
+
+    engine = create_engine(f"sqlite:///{tmp_path}/e.db")
+    Base.metadata.create_all(engine)
+    with Session(engine) as db:
+        write_evidence(db, [(DATA, RESULT), (dict(DATA, order_id="2"), RESULT)])
+        db.commit()
+
+    async def read():
+        async with AsyncSession(create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/e.db")) as db:
+            return await read_evidence(db, "2")
+    entries = {e["key"]: e["value"] for e in asyncio.run(read())}
+    assert {k: v for k, v in entries["input"].items() if v is not None} == dict(DATA, order_id="2")
+    assert entries["scores"] == RESULT
@@ -0,0 +1,54 @@
+# tests/test_fair_queue.py
+import asyncio
+
+import pytest
+
+from app.config import settings
+from app.utils import fair_queue
+
+def _clients():
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    return fakeredis.FakeRedis(server=server), fakeredis.FakeAsyncRedis(server=server)
+
+def _enqueue(aclient, orders):
+    async def run():
+        for shop, oid in orders:
+            await fair_queue.enqueue(shop, {"id": oid}, None, client=aclient)
+    asyncio.run(run())
+
+def _drain(r):
+    served = []
+    while (got := fair_queue.claim(client=r)) is not None:
+        shop, item, token = got
+        served.append((shop, item["order"]["id"]))
+        fair_queue.release(shop, token, client=r)
+    return served
+
+def test_small_shop_is_not_stuck_behind_a_spike(monkeypatch):
+    monkeypatch.setattr(settings, "FAIR_SHOP_WEIGHTS", {"heavy": 2.0})
+    r, ar = _clients()
+    _enqueue(ar, [("big", i) for i in range(100)] + [("small", 0), ("heavy", 0), ("heavy", 1), ("heavy", 2)])
+    served = _drain(r)
+    assert served.index(("small", 0)) <= 2
+    assert [oid for shop, oid in served if shop == "big"] == list(range(100))  # FIFO within a shop
+    # weight 2: heavy's three orders go out within big's first two
+    assert served.index(("heavy", 2)) < served.index(("big", 2))
+    assert fair_queue.pending(client=r) == 0 and fair_queue.shop_backlog(client=r) == {}
+
+def test_concurrency_cap_and_lease_expiry(monkeypatch):
+    monkeypatch.setattr(settings, "FAIR_SHOP_CONCURRENCY", 2)
+    monkeypatch.setattr(settings, "FAIR_SHOP_CONCURRENCY_OVERRIDES", {"solo": 1})
+    r, ar = _clients()
+    _enqueue(ar, [("big", i) for i in range(5)] + [("solo", 0), ("solo", 1)])
+    held = [fair_queue.claim(client=r) for _ in range(3)]
+    assert sorted(s for s, _, _ in held) == ["big", "big", "solo"]
+    assert fair_queue.claim(client=r) is None and fair_queue.pending(client=r) == 2  # both at their cap
+    depth, age = fair_queue.shop_backlog(client=r)["big"]
+    assert depth == 3 and age >= 0
+    fair_queue.release("big", held[0][2], client=r)
+    assert fair_queue.claim(client=r)[0] == "big"
+    # workers that died holding their slots: the leases run out
+    monkeypatch.setattr(fair_queue.time, "time", lambda: 10 ** 10)
+    assert sorted((s, item["order"]["id"]) for s, item, _ in
+                  (fair_queue.claim(client=r) for _ in range(3))) == [("big", 3), ("big", 4), ("solo", 1)]
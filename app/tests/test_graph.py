@@ -0,0 +1,31 @@
+# tests/test_graph.py
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+from app.database import Base
+from app.models import IdentityNode
+from app.vault import graph
+
+KINDS = ("email", "device")
+
+def test_ring_across_one_device_forms_one_cluster():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    # four emails cycled through one device, plus an unrelated customer
+    ring = [[("email", f"e{i}"), ("device", "d1"), ("ip", "shared-nat")] for i in range(4)]
+    other = [[("email", "x"), ("device", "d2"), ("ip", "shared-nat")]]
+    with Session(engine) as db:
+        assert graph.cluster_sizes(db, ring[:1], KINDS) == [2]
+        graph.record_edges(db, ring + other, KINDS)
+        # a second batch re-sees an edge and links a fifth email
+        graph.record_edges(db, [ring[0], [("email", "e4"), ("device", "d1")]], KINDS)
+        db.commit()
+        assert graph.apply_links(db, limit=2) == 2   # resumable in batches
+        assert graph.apply_links(db) == 4
+        assert graph.apply_links(db) == 0
+        db.commit()
+
+        sizes = graph.cluster_sizes(db, [ring[0], other[0], [("email", "new"), ("device", "d1")]], KINDS)
+        assert sizes == [6, 2, 7]   # IPs are not linked; unknown identities count once
+        roots = db.scalars(select(IdentityNode.root).where(IdentityNode.hash.like("e%"))).all()
+        assert len(set(roots)) == 1
@@ -0,0 +1,82 @@
+# tests/test_idempotency.py
+import asyncio
+import pytest
+
+from app.utils import idempotency
+
+def test_admit_webhook_dedups_and_queues_record():
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    r = fakeredis.FakeAsyncRedis(server=server)
+
+    async def run():
+        first = await idempotency.admit_webhook("wh-1", "a.myshopify.com", "orders/create", client=r)
+        again = await idempotency.admit_webhook("wh-1", "a.myshopify.com", "orders/create", client=r)
+        await idempotency.release_webhook("wh-1", client=r)
+        retried = await idempotency.admit_webhook("wh-1", "a.myshopify.com", "orders/create", client=r)
+        return first, again, retried
+
+    assert asyncio.run(run()) == (True, False, True)
+
+    sync = fakeredis.FakeRedis(server=server)
+    pending = idempotency.peek_pending_events(10, client=sync)
+    assert [p["event_id"] for p in pending] == ["wh-1", "wh-1"]
+    idempotency.trim_pending_events(len(pending), client=sync)
+    assert idempotency.peek_pending_events(10, client=sync) == []
+
+def _delivery(client, body: bytes, event_id: str):
+    import base64, hashlib, hmac
+    from app.config import settings
+    sig = base64.b64encode(hmac.new(settings.SHOPIFY_WEBHOOK_SECRET.encode(), body, hashlib.sha256).digest()).decode()
+    return client.post("/webhooks/orders-create", content=body, headers={
+        "X-Shopify-Hmac-Sha256": sig, "X-Shopify-Webhook-Id": event_id,
+        "X-Shopify-Shop-Domain": "a.myshopify.com"})
+
+def test_webhook_claims_nothing_it_cannot_enqueue(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from redis.exceptions import ConnectionError
+    from app.routes import webhooks
+    from app.utils import redis_client
+
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(redis_client, "_async_client", fakeredis.FakeAsyncRedis(server=server))
+    app = FastAPI()
+    app.include_router(webhooks.router)
+    client = TestClient(app)
+    sync = fakeredis.FakeRedis(server=server)
+
+    for body in (b"{not json", b"[1, 2]"):
+        assert _delivery(client, body, "wh-bad").status_code == 400
+    assert not sync.exists(idempotency.DEDUP_PREFIX + "wh-bad")
+
+    async def redis_down(*args, **kwargs):
+        raise ConnectionError("down")
+    monkeypatch.setattr(webhooks, "admit_webhook", redis_down)
+    assert _delivery(client, b'{"id": 1}', "wh-2").status_code == 503
+
+def test_webhook_publishes_to_celery_off_the_event_loop(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from app.config import settings
+    from app.routes import webhooks
+    from app.utils import redis_client
+
+    monkeypatch.setattr(redis_client, "_async_client", fakeredis.FakeAsyncRedis())
+    monkeypatch.setattr(settings, "ORDER_BATCH_MODE", False)
+    monkeypatch.setattr(settings, "FAIR_SCHEDULING", False)
+    sent = []
+
+    def send_task(name, args=()):
+        try:
+            asyncio.get_running_loop()
+            sent.append((name, "event loop"))
+        except RuntimeError:
+            sent.append((name, "thread"))
+    monkeypatch.setattr(webhooks.celery, "send_task", send_task)
+    app = FastAPI()
+    app.include_router(webhooks.router)
+    assert _delivery(TestClient(app), b'{"id": 1}', "wh-3").json() == {"ok": True}
+    assert sent == [("process_order_async", "thread")]
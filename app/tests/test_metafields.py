@@ -0,0 +1,59 @@
+# tests/test_metafields.py
+import pytest
+
+from app import celery_worker
+from app.utils import redis_client, remix
+from app.tests.remix_stub import RemixStub
+
+RESULT = {"final_score": 80.0, "rules_score": 80.0, "verdict": "red", "reasons": ["High-value order"]}
+
+def test_client_classifies_retryable_and_reuses_connection():
+    with RemixStub() as stub:
+        stub.responses = [(429, {"ok": False}, {"Retry-After": "7"}), (503, {"ok": False}, {}),
+                          (400, {"ok": False}, {})]
+        client = remix.RemixClient(stub.url, "s3cret")
+        with pytest.raises(remix.RemixRetryableError) as e:
+            client.metafields_set("a.myshopify.com", [])
+        assert e.value.retry_after == 7.0
+        with pytest.raises(remix.RemixRetryableError):
+            client.metafields_set("a.myshopify.com", [])
+        with pytest.raises(remix.RemixError) as e:
+            client.metafields_set("a.myshopify.com", [])
+        assert not isinstance(e.value, remix.RemixRetryableError)
+        assert client.metafields_set("a.myshopify.com", [])["ok"]
+        assert stub.connections == 1
+        assert stub.calls[0]["auth"] == "s3cret"
+
+def test_metafields_coalesced_per_shop(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    monkeypatch.setattr(redis_client, "_client", fakeredis.FakeRedis())
+    scheduled = []
+    monkeypatch.setattr(celery_worker.flush_metafields, "apply_async",
+                        lambda args, countdown: scheduled.append(args))
+    with RemixStub() as stub:
+        monkeypatch.setattr(remix, "_client", remix.RemixClient(stub.url, "s3cret"))
+        for order_id in (1, 2, 3):
+            celery_worker.write_metafields("a.myshopify.com", order_id, RESULT)
+        assert scheduled == [("a.myshopify.com",)]
+
+        assert celery_worker.flush_metafields("a.myshopify.com") == 3
+        assert len(stub.calls) == 1
+        owners = [m["ownerId"] for m in stub.calls[0]["body"]["metafields"]]
+        assert owners == [f"gid://shopify/Order/{i}" for i in (1, 2, 3)]
+
+def test_failed_flush_keeps_the_batch_and_frees_the_shop(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    r = fakeredis.FakeRedis()
+    monkeypatch.setattr(redis_client, "_client", r)
+    monkeypatch.setattr(celery_worker.flush_metafields, "apply_async", lambda args, countdown: None)
+
+    class Broken:
+        def metafields_set(self, shop, metafields):
+            raise RuntimeError("worker bug")
+    monkeypatch.setattr(remix, "_client", Broken())
+    for order_id in (1, 2):
+        celery_worker.write_metafields("a.myshopify.com", order_id, RESULT)
+    with pytest.raises(RuntimeError):
+        celery_worker.flush_metafields("a.myshopify.com")
+    assert r.llen(celery_worker.MF_PENDING_PREFIX + "a.myshopify.com") == 2
+    assert not r.exists(celery_worker.MF_SCHEDULED_PREFIX + "a.myshopify.com")
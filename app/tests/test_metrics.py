@@ -0,0 +1,92 @@
+# tests/test_metrics.py
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.adapters.executor import ADAPTER_CALLS, AdapterRunner
+from app.config import settings
+from app.utils import metrics
+
+def _value(text: str, series: str) -> float:
+    for line in text.splitlines():
+        if line.startswith(series + " "):
+            return float(line.rsplit(" ", 1)[1])
+    raise AssertionError(f"{series} not in output")
+
+def test_histogram_context_manager_decorator_and_exposition():
+    h = metrics.histogram("fp_test_stage_seconds", "test stage", labels=("stage",), buckets=(0.5, 1.0))
+
+    with h.time(stage="a"):
+        pass
+
+    @h.time(stage="b")
+    def work():
+        return 42
+    assert work() == 42 and work() == 42
+    h.observe(0.75, stage="a")
+
+    text = metrics.render()
+    assert "# TYPE fp_test_stage_seconds histogram" in text
+    assert _value(text, 'fp_test_stage_seconds_bucket{stage="a",le="0.5"}') == 1
+    assert _value(text, 'fp_test_stage_seconds_bucket{stage="a",le="1"}') == 2
+    assert _value(text, 'fp_test_stage_seconds_bucket{stage="a",le="+Inf"}') == 2
+    assert _value(text, 'fp_test_stage_seconds_count{stage="b"}') == 2
+    with pytest.raises(ValueError):
+        h.observe(1.0, shop="x")
+
+def test_decorated_timer_overlapping_calls_keep_their_own_start():
+    h = metrics.histogram("fp_test_overlap_seconds", "test overlap", buckets=(1.0,))
+
+    @h.time()
+    def work(seconds):
+        time.sleep(seconds)
+
+    slow = threading.Thread(target=work, args=(0.2,))
+    slow.start()
+    time.sleep(0.05)
+    work(0.01)  # starts and ends while the slow call is still running
+    slow.join()
+    assert _value(metrics.render(), "fp_test_overlap_seconds_sum") >= 0.21
+
+def test_snapshots_from_several_processes_are_summed():
+    c = metrics.counter("fp_test_events_total", "events", labels=("kind",))
+    c.inc(kind="x")
+    snap = {"fp_test_events_total": metrics.family("counter", "events", ("kind",), [(("x",), 2), (("y",), 5)])}
+    text = metrics.render_snapshots([metrics._registry.snapshot(), snap])
+    assert _value(text, 'fp_test_events_total{kind="x"}') == 3
+    assert _value(text, 'fp_test_events_total{kind="y"}') == 5
+
+def test_metrics_dir_merges_live_processes_and_drops_dead_ones(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "METRICS_DIR", str(tmp_path))
+    g = metrics.gauge("fp_test_live", "live processes")
+    g.set(1)
+    (tmp_path / "api").mkdir()
+    other = {"fp_test_live": metrics.family("gauge", "live processes", (), [((), 1)])}
+    (tmp_path / "api" / f"{os.getppid()}.json").write_text(json.dumps(other))
+    dead = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"],
+                          capture_output=True, text=True).stdout.strip()
+    (tmp_path / "api" / f"{dead}.json").write_text(json.dumps(other))
+
+    assert _value(metrics.render(), "fp_test_live") == 2
+    assert not (tmp_path / "api" / f"{dead}.json").exists()
+
+def test_adapter_outcomes_and_metrics_endpoint():
+    before = ADAPTER_CALLS.snapshot()["series"]
+    runner = AdapterRunner({"email": lambda v: 7, "ip": lambda v: 1 / 0})
+    runner.run({"email": "a@b.c", "ip": "1.2.3.4"})
+    runner.run({"email": "a@b.c", "ip": None})
+
+    from app.main import app
+    r = TestClient(app).get("/metrics")
+    assert r.status_code == 200 and r.headers["content-type"].startswith("text/plain; version=0.0.4")
+    counts = {tuple(k): v for k, v in ADAPTER_CALLS.snapshot()["series"]}
+    prior = {tuple(k): v for k, v in before}
+    for key, n in {("email", "ok"): 1, ("email", "cached"): 1, ("ip", "error"): 1}.items():
+        assert counts[key] - prior.get(key, 0) == n
+    assert 'fp_adapter_seconds_count{adapter="email"}' in r.text
@@ -0,0 +1,21 @@
+# tests/test_partitions.py
+from datetime import datetime, timezone
+
+from app.partitions import add_months, partition_name, plan
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+def test_months_roll_over_years():
+    assert add_months(utc(2025, 11, 1), 3) == utc(2026, 2, 1)
+    assert add_months(utc(2026, 1, 1), -1) == utc(2025, 12, 1)
+    assert partition_name("webhook_events", utc(2026, 2, 1)) == "webhook_events_p202602"
+
+def test_plan_premakes_and_expires_only_whole_months_past_retention():
+    existing = {m: partition_name("t", m) for m in (utc(2025, 8, 1), utc(2025, 9, 1), utc(2025, 10, 1))}
+    create, expire = plan(existing, utc(2025, 10, 20, 12), premake=2, retention_days=14)
+    assert create == [utc(2025, 11, 1), utc(2025, 12, 1)]
+    assert expire == [utc(2025, 8, 1), utc(2025, 9, 1)]
+    # September still holds rows younger than 30 days
+    assert plan(existing, utc(2025, 10, 20, 12), premake=2, retention_days=30)[1] == [utc(2025, 8, 1)]
+    assert plan(existing, utc(2025, 10, 20, 12), premake=0, retention_days=0) == ([], [])
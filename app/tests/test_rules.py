@@ -1,5 +1,8 @@
 # tests/test_rules.py
+import json, os
+import pytest
 from app.rules.ruleset import rules_basic
+from app.rules.engine import RuleError, RulesetRegistry, compile_ruleset
 
 def test_rules_basic_country_mismatch():
     o = {"billing_country":"US","shipping_country":"CA","total_price":100}
@@ -7,3 +10,40 @@ def test_rules_basic_country_mismatch():
     assert score >= 25
     assert any("Country mismatch" in r for r in reasons)
 
+
+def test_compiled_ruleset_ops_and_verdicts():
+    rs = compile_ruleset({
+        "verdicts": {"red": 50, "amber": 20},
+        "rules": [
+            {"id": "big", "when": {"all": [{"field": "total_price", "op": "gte", "value": 100},
+                                           {"not": {"field": "country", "op": "in", "value": ["US"]}}]},
+             "score": 30, "reason": "Big foreign order"},
+            {"id": "tld", "when": {"field": "email", "op": "endswith", "value": ".RU"},
+             "score": 25, "reason": "Suspicious email TLD"},
+        ],
+    }, sample_every=1)
+    assert rs.evaluate({"total_price": 150, "country": "FR", "email": "x@y.ru"}) == (55, ["Big foreign order", "Suspicious email TLD"])
+    assert rs.evaluate({"total_price": 150, "country": "US"}) == (0, [])
+    assert rs.verdict(55) == "red" and rs.verdict(25) == "amber" and rs.verdict(5) == "green"
+    assert [s["fire_rate"] for s in rs.stats()] == [0.5, 0.5]
+
+def test_compile_rejects_unsafe_field_names():
+    with pytest.raises(RuleError):
+        compile_ruleset({"rules": [{"when": {"field": "x') or __import__('os", "op": "present"}, "score": 1}]})
+
+def test_registry_hot_reloads_per_shop_file(tmp_path):
+    rule = lambda score: {"rules": [{"id": "r", "when": {"field": "total_price", "op": "gt", "value": 10},
+                                     "score": score, "reason": "r"}]}
+    (tmp_path / "default.json").write_text(json.dumps(rule(5)))
+    reg = RulesetRegistry(str(tmp_path), reload_interval=0)
+    shop = "a.myshopify.com"
+    assert reg.get(shop).evaluate({"total_price": 20})[0] == 5
+
+    shop_file = tmp_path / f"{shop}.json"
+    shop_file.write_text(json.dumps(rule(40)))
+    assert reg.get(shop).evaluate({"total_price": 20})[0] == 40
+    assert reg.get("b.myshopify.com").evaluate({"total_price": 20})[0] == 5
+
+    shop_file.write_text("{not json")
+    os.utime(shop_file, ns=(1, 1))
+    assert reg.get(shop).evaluate({"total_price": 20})[0] == 40  # bad edit keeps the old ruleset
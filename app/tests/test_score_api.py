@@ -0,0 +1,83 @@
+# tests/test_score_api.py
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+pytest.importorskip("aiosqlite")
+fakeredis = pytest.importorskip("fakeredis")
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app import scoring
+from app.database import Base
+from app.models import RiskIdentity
+from app.routes import score
+from app.utils import redis_client
+from app.vault import velocity
+from app.vault.cache import count_cache
+from app.vault.repository import observe_identities
+
+ORDER = {"shop_id": "a.myshopify.com", "order_id": "chk-1", "email": "A@B.example", "ip": "1.2.3.4",
+         "billing_country": "DE", "shipping_country": "FR", "total_price": 600}
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    url = f"{tmp_path}/t.db"
+    sync = create_engine(f"sqlite:///{url}")
+    Base.metadata.create_all(sync)
+    with Session(sync) as db:
+        for _ in range(4):
+            observe_identities(db, [[("email", scoring.lookup_key("a@b.example", "email"))]])
+        db.commit()
+    maker = async_sessionmaker(create_async_engine(f"sqlite+aiosqlite:///{url}"), expire_on_commit=False)
+    monkeypatch.setattr(scoring, "get_async_sessionmaker", lambda: maker)
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(redis_client, "_client", fakeredis.FakeRedis(server=server))
+    monkeypatch.setattr(redis_client, "_async_client", fakeredis.FakeAsyncRedis(server=server))
+    count_cache.clear()
+    app = FastAPI()
+    app.include_router(score.router)
+    yield TestClient(app), sync
+    sync.dispose()
+
+def test_score_reads_vault_and_velocity_without_recording(client):
+    client, sync = client
+    keys = [("ip", scoring.lookup_key("1.2.3.4", "ip"))]
+    for i in range(5):
+        velocity.observe(f"a.myshopify.com:{i}", keys)
+    r = client.post("/v1/score", json=ORDER).json()
+    assert r["order_id"] == "chk-1" and r["degraded"] == [] and r["verdict"] == "red"
+    assert {"Email seen high velocity", "IP velocity (1h)", "High-value order",
+            "Country mismatch (billing vs shipping)"} <= set(r["reasons"])
+    with Session(sync) as db:
+        assert db.scalar(select(func.sum(RiskIdentity.seen_count))) == 4  # nothing counted
+    assert velocity.observe("a.myshopify.com:9", keys)[keys[0]]["1h"] == 5
+
+def test_score_degrades_to_rules_when_lookups_miss_the_budget(client, monkeypatch):
+    client, _ = client
+
+    async def slow(data):
+        await asyncio.sleep(0.3)
+        return {"repeat_email": 99}
+    monkeypatch.setattr(scoring, "_vault_lookup", slow)
+    r = client.post("/v1/score", json={**ORDER, "budget_ms": 15}).json()
+    assert r["degraded"] == ["vault"] and r["elapsed_ms"] < 100
+    assert "Email seen high velocity" not in r["reasons"] and "High-value order" in r["reasons"]
+
+def test_score_skips_lookups_while_too_many_are_still_running(client, monkeypatch):
+    client, _ = client
+    started = []
+
+    async def lookup(data):
+        started.append(data)
+        return {}
+    monkeypatch.setattr(scoring, "_vault_lookup", lookup)
+    monkeypatch.setattr(scoring, "_velocity_lookup", lookup)
+    monkeypatch.setattr(scoring.settings, "SCORE_MAX_PENDING", 2)
+    monkeypatch.setattr(scoring, "_pending", {object(), object()})
+    r = client.post("/v1/score", json=ORDER).json()
+    assert r["degraded"] == ["vault", "velocity"] and started == []
+    assert "High-value order" in r["reasons"]
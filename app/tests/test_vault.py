@@ -0,0 +1,162 @@
+# tests/test_vault.py
+import os
+import time
+
+import pytest
+import redis
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from app.database import Base
+from app.models import RiskIdentity
+from app.vault.cache import CountCache
+from app.vault.keys import KeyDeriver
+from app.vault.bloom import VaultBloom
+from app.vault import cache as vault_cache
+from app.vault import repository
+from app.vault import velocity
+from app.vault.repository import lookup_counts, cached_lookup_counts, add_counts, observe_identities
+from app.utils import redis_client
+
+def _db():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    return Session(engine)
+
+def test_count_cache_lru_and_ttl():
+    c = CountCache(maxsize=2, ttl=60)
+    c.put_many({"a": 1, "b": 2})
+    assert c.get("a") == 1          # "a" is now most recent
+    c.put("c", 3)                   # evicts "b"
+    assert c.get("b") is None
+    assert c.stats()["hits"] == 1 and c.stats()["misses"] == 1
+
+    c = CountCache(maxsize=2, ttl=-1)
+    c.put("a", 1)
+    assert c.get("a") is None
+
+def test_lookup_counts_single_query_and_cache():
+    db = _db()
+    db.add_all([RiskIdentity(kind="email", hash="e1", seen_count=4),
+                RiskIdentity(kind="ip", hash="i1", seen_count=9)])
+    db.commit()
+
+    keys = [("email", "e1"), ("ip", "i1"), ("device", "d1")]
+    assert lookup_counts(db, keys) == {("email", "e1"): 4, ("ip", "i1"): 9, ("device", "d1"): 0}
+
+    cache = CountCache()
+    assert cached_lookup_counts(db, keys, cache)[("ip", "i1")] == 9
+    assert cached_lookup_counts(db, keys, cache)[("email", "e1")] == 4
+    assert cache.stats()["misses"] == 3 and cache.stats()["hits"] == 3
+
+def test_writes_elsewhere_invalidate_the_shared_cache(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    r = fakeredis.FakeRedis()
+    monkeypatch.setattr(redis_client, "_client", r)
+    monkeypatch.setattr(vault_cache.settings, "VAULT_CACHE_SYNC_SECONDS", 0.25)
+    monkeypatch.setattr(vault_cache, "_syncer_pid", os.getpid())  # the test plays the sync thread
+    monkeypatch.setattr(vault_cache, "_cursor", None)
+    vault_cache.count_cache.clear()
+    db = _db()
+    db.add(RiskIdentity(kind="email", hash="e1", seen_count=4))
+    db.commit()
+    key = ("email", "e1")
+    assert cached_lookup_counts(db, [key])[key] == 4 and len(vault_cache.count_cache) == 0  # not synced yet
+    vault_cache._sync_once()
+    assert cached_lookup_counts(db, [key])[key] == 4 and len(vault_cache.count_cache) == 1
+
+    # another process (a Celery worker) bumps the count and publishes after commit
+    db.execute(RiskIdentity.__table__.update().values(seen_count=7))
+    db.commit()
+    r.xadd(vault_cache.INVALIDATIONS_KEY, {"keys": '[["email", "e1"]]'})
+    assert cached_lookup_counts(db, [key])[key] == 4        # until the next sync
+    vault_cache._sync_once()
+    assert cached_lookup_counts(db, [key])[key] == 7
+
+    # this process's own writes are published once they commit, not on rollback
+    add_counts(db, {key: 1})
+    db.rollback()
+    add_counts(db, {key: 1})
+    assert r.xlen(vault_cache.INVALIDATIONS_KEY) == 1
+    db.commit()
+    assert r.xlen(vault_cache.INVALIDATIONS_KEY) == 2
+
+    # no sync for a while (thread stuck), then Redis down: the shared cache is bypassed and emptied
+    assert cached_lookup_counts(db, [key])[key] == 8 and len(vault_cache.count_cache) == 1
+    hits = vault_cache.count_cache.stats()["hits"]
+    monkeypatch.setattr(vault_cache, "_synced_at", time.monotonic() - 10)
+    assert cached_lookup_counts(db, [key]) == {key: 8} and vault_cache.count_cache.stats()["hits"] == hits
+    monkeypatch.setattr(redis_client, "_client", redis.Redis(port=1))
+    vault_cache._sync_once()
+    assert len(vault_cache.count_cache) == 0 and not vault_cache.sync_caches()
+
+def test_add_counts_upserts():
+    db = _db()
+    db.add(RiskIdentity(kind="email", hash="e1", seen_count=4))
+    db.commit()
+    add_counts(db, {("email", "e1"): 2, ("ip", "i1"): 1})
+    db.commit()
+    assert lookup_counts(db, [("email", "e1"), ("ip", "i1")]) == {("email", "e1"): 6, ("ip", "i1"): 1}
+
+def test_observe_identities_one_upsert_returns_prior_counts():
+    db = _db()
+    db.add(RiskIdentity(kind="email", hash="e1", seen_count=4))
+    db.commit()
+    seen = observe_identities(db, [[("email", "e1"), ("ip", "i1")], [("email", "e1")], []])
+    assert seen == [{("email", "e1"): 4, ("ip", "i1"): 0}, {("email", "e1"): 5}, {}]
+    db.commit()
+    assert lookup_counts(db, [("email", "e1"), ("ip", "i1")]) == {("email", "e1"): 6, ("ip", "i1"): 1}
+
+def test_velocity_windows_and_replay():
+    fakeredis = pytest.importorskip("fakeredis")
+    r = fakeredis.FakeRedis()
+    key = ("email", "e1")
+    t0 = 1_700_000_000
+    assert velocity.observe("o1", [key], now=t0, client=r)[key]["10m"] == 0
+    assert velocity.observe("o2", [key], now=t0 + 60, client=r)[key]["10m"] == 1
+    # a retried order gets its original answer and is not counted twice
+    assert velocity.observe("o2", [key], now=t0 + 61, client=r)[key]["10m"] == 1
+    later = velocity.observe("o3", [key], now=t0 + 3600, client=r)[key]
+    assert later["10m"] == 0 and later["24h"] == 2
+    # runs by SHA; a flushed script cache is reloaded and the order still counted once
+    r.script_flush()
+    assert velocity.observe("o4", [key], now=t0 + 3601, client=r)[key]["10m"] == 1
+    assert velocity.observe("o4", [key], now=t0 + 3602, client=r)[key]["10m"] == 1
+
+
+def test_key_versions_and_rotation():
+    old = KeyDeriver({1: "pepper-1"}, current=1)
+    new = KeyDeriver({1: "pepper-1", 2: "pepper-2"}, current=2)
+    key = old.key(" A@Example.com ", "email")
+    assert key == old.key("a@example.com", "email") and key.startswith("v1:")
+    assert old.keys(["a@example.com"], "email") == [key]
+    assert new.key("a@example.com", "email").startswith("v2:")
+    # after rotation, counts written under v1 (and pre-HMAC legacy keys) stay readable
+    versions = new.read_keys("a@example.com", "email")
+    assert versions[1] == key and len(versions) == 3
+    assert new.read_keys("::FFFF:1.2.3.4", "ip") == new.read_keys("::ffff:1.2.3.4", "ip")
+    assert new.memo_stats()["hits"] > 0
+
+def test_bloom_filter_shared_file_skips_unknown_keys(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path}/v.db")
+    Base.metadata.create_all(engine)
+    with Session(engine) as db:
+        db.add_all([RiskIdentity(kind="email", hash=f"e{i}", seen_count=i + 1) for i in range(50)])
+        db.commit()
+    path = str(tmp_path / "vault.bloom")
+    bloom = VaultBloom(path, lambda: Session(engine), capacity=1000, fp_rate=0.01)
+    assert bloom.rebuild(settle=0)
+    other = VaultBloom(path, lambda: Session(engine), capacity=1000, fp_rate=0.01)  # another process
+
+    maybe, absent = other.split([("email", "e1"), ("email", "nope"), ("ip", "e1")])
+    assert ("email", "e1") in maybe and ("email", "nope") in absent
+    bloom.add_many([("email", "nope")])
+    assert ("email", "nope") in other.split([("email", "nope")])[0]  # visible without a reload
+
+    monkeypatch.setattr(repository, "get_vault_bloom", lambda: other)
+    with Session(engine) as db:
+        keys = [("device", f"d{i}") for i in range(200)] + [("email", "e3")]
+        counts = repository.cached_lookup_counts(db, keys, CountCache())
+    assert counts[("email", "e3")] == 4 and counts[("device", "d0")] == 0
+    stats = other.stats()
+    assert stats["skip_rate"] > 0.9 and stats["fp_rate"] < 0.5 and stats["items"] == 51
@@ -0,0 +1,74 @@
+# tests/test_vault_api.py
+import asyncio
+import json
+import os
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+pytest.importorskip("aiosqlite")
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app.config import settings
+from app.database import Base, get_async_db
+from app.routes import vault
+from app.utils import redis_client
+from app.vault import cache
+from app.vault.cache import signal_cache
+
+@pytest.fixture
+def client(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/t.db")
+    maker = async_sessionmaker(engine, expire_on_commit=False)
+
+    async def setup():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+    asyncio.run(setup())
+
+    async def override():
+        async with maker() as db:
+            yield db
+    app = FastAPI()
+    app.include_router(vault.router)
+    app.dependency_overrides[get_async_db] = override
+    signal_cache.clear()
+    return TestClient(app, headers={"x-internal-auth": settings.INTERNAL_SHARED_SECRET})
+
+def test_observe_bulk_outcomes_and_cached_query(client):
+    ids = {"email": "A@Example.com", "ip": "1.2.3.4"}
+    for secret in ("", "guess"):  # internal callers only
+        r = client.post("/v1/vault/observe", json={"ids": ids}, headers={"x-internal-auth": secret})
+        assert r.status_code == 401
+    assert client.post("/v1/vault/observe", json={"shop_id": "a", "ids": ids}).json()["identities"] == 2
+
+    r = client.post("/v1/vault/query", json={"shop_id": "a", "ids": {"email": "a@example.com"}}).json()
+    assert r["signals"]["email"]["seen_count"] == 1 and r["vault_verdict"] == "green"
+    misses = signal_cache.stats()["misses"]
+    client.post("/v1/vault/query", json={"shop_id": "a", "ids": {"email": "a@example.com"}})
+    assert signal_cache.stats()["misses"] == misses
+
+    # nightly bulk push: outcomes only, seen_count untouched, cache invalidated
+    bulk = [{"shop_id": "a", "ids": {"email": "a@example.com"}, "outcome": {"chargeback": 1}},
+            {"shop_id": "b", "ids": {"ip": "1.2.3.4"}, "outcome": {"refund": 2}}]
+    assert client.post("/v1/vault/observe", json=bulk).json()["observations"] == 2
+
+    r = client.post("/v1/vault/query", json=[{"shop_id": "a", "ids": ids},
+                                             {"shop_id": "a", "ids": {"ip": "1.2.3.4", "device": None}}]).json()
+    assert r[0]["signals"]["email"] == {**r[0]["signals"]["email"], "seen_count": 1,
+                                        "outcomes": {"chargeback": 1, "refund": 0, "approved": 0}}
+    assert r[0]["vault_verdict"] == "red" and r[1]["vault_verdict"] == "amber"
+    assert client.post("/v1/vault/query", json={"shop_id": "a", "ids": {"phone": "1"}}).status_code == 422
+
+def test_observe_publishes_invalidations_with_the_async_client(client, monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(redis_client, "_async_client", fakeredis.FakeAsyncRedis(server=server))
+    monkeypatch.setattr(redis_client, "_client", None)  # the sync client must not be used
+    monkeypatch.setattr(redis_client.settings, "REDIS_URL", "redis://127.0.0.1:1/0")
+    monkeypatch.setattr(cache.settings, "VAULT_CACHE_SYNC_SECONDS", 0.25)
+    monkeypatch.setattr(cache, "_syncer_pid", os.getpid())
+    client.post("/v1/vault/observe", json={"shop_id": "a", "ids": {"email": "a@example.com", "ip": "1.2.3.4"}})
+    entries = fakeredis.FakeRedis(server=server).xrange(cache.INVALIDATIONS_KEY)
+    assert len(entries) == 1 and len(json.loads(entries[0][1][b"keys"])) == 2
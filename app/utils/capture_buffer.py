@@ -0,0 +1,41 @@
+"""Redis list buffering /v1/capture events for bulk loading (CAPTURE_BUFFER_MODE).
+
+The route appends records here and answers immediately; flush_captures
+copies them into device_captures in multi-row INSERTs and trims the list
+only after the commit. A crashed API or worker process loses nothing.
+A Redis crash loses at most what Redis has not persisted (about 1s with
+appendfsync everysec). A worker dying between commit and trim re-inserts
+that one batch, so captures are at-least-once.
+"""
+from typing import List, Optional
+import redis
+
+from ..config import settings
+from . import fastjson
+from .redis_client import async_lua_script, get_async_redis, get_redis
+
+PENDING_KEY = "fp:capture:pending"
+
+# Backpressure: refuse the whole push once the buffer would exceed ARGV[1].
+# KEYS[1]: pending list, ARGV[1]: max length, ARGV[2..]: records (json)
+_PUSH = async_lua_script("""
+if redis.call('LLEN', KEYS[1]) + #ARGV - 1 > tonumber(ARGV[1]) then return -1 end
+return redis.call('RPUSH', KEYS[1], unpack(ARGV, 2))
+""")
+
+async def push_captures(records: List[dict], client=None) -> bool:
+    """Buffer capture rows; False if the buffer is full and the caller should back off."""
+    r = client or get_async_redis()
+    depth = await _PUSH(keys=[PENDING_KEY], args=[settings.CAPTURE_BUFFER_MAX,
+                                                  *(fastjson.dumps(rec) for rec in records)], client=r)
+    return int(depth) >= 0
+
+def peek_captures(limit: int, client: Optional[redis.Redis] = None) -> List[dict]:
+    r = client or get_redis()
+    return [fastjson.loads(raw) for raw in r.lrange(PENDING_KEY, 0, limit - 1)]
+
+def trim_captures(count: int, client: Optional[redis.Redis] = None) -> None:
+    (client or get_redis()).ltrim(PENDING_KEY, count, -1)
+
+def pending_captures(client: Optional[redis.Redis] = None) -> int:
+    return int((client or get_redis()).llen(PENDING_KEY))
@@ -0,0 +1,154 @@
+"""Per-shop fair scheduling for per-order scoring (FAIR_SCHEDULING).
+
+With one FIFO Celery queue, a large shop's flash sale puts thousands of
+tasks ahead of every other shop's next order. Instead, the webhook pushes
+each order onto its shop's Redis list and sends one argument-less
+`score_next` token to the scoring queue. The token decides which order to
+run only when a worker picks it up:
+
+- weighted fair queueing: every active shop has a virtual time in
+  ACTIVE_KEY, and a claim serves the lowest one. Serving advances the
+  shop by 1/weight (FAIR_SHOP_WEIGHTS, default 1). A shop that goes idle
+  rejoins at the current virtual clock, so it cannot bank credit.
+- concurrency caps: at most FAIR_SHOP_CONCURRENCY orders per shop run at
+  once (per-shop overrides in FAIR_SHOP_CONCURRENCY_OVERRIDES). In-flight
+  claims are leases that expire after FAIR_LEASE_SECONDS, so a crashed
+  worker cannot use up a shop's cap for good.
+
+There is one token per queued order. A token that finds every queued shop
+at its cap retries shortly. A small shop's order therefore waits about
+one token behind a spike, not behind the spike's whole backlog.
+
+Per-shop keys are computed inside the scripts, so this needs a single
+Redis (not Cluster), like the rest of the queue code.
+"""
+import json
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+import redis
+
+from ..config import settings
+from . import fastjson, metrics
+from .redis_client import async_lua_script, get_async_redis, get_redis, lua_script
+
+PREFIX = "fp:fair:"
+ACTIVE_KEY = PREFIX + "active"      # zset: shop -> virtual time of its next order
+VCLOCK_KEY = PREFIX + "vclock"      # virtual time of the last order served
+SCAN_SHOPS = 64                     # shops examined per claim, lowest virtual time first
+METRICS_SHOPS = 50
+
+def queue_key(shop: str) -> str:
+    return PREFIX + "q:" + shop
+
+def inflight_key(shop: str) -> str:
+    return PREFIX + "inflight:" + shop
+
+# KEYS[1] active, KEYS[2] vclock, KEYS[3] shop queue; ARGV[1] shop, ARGV[2] item
+_ENQUEUE = async_lua_script("""
+redis.call('RPUSH', KEYS[3], ARGV[2])
+if not redis.call('ZSCORE', KEYS[1], ARGV[1]) then
+  redis.call('ZADD', KEYS[1], tonumber(redis.call('GET', KEYS[2]) or '0'), ARGV[1])
+end
+return 1
+""")
+
+# KEYS[1] active, KEYS[2] vclock
+# ARGV: now, lease, token, default cap, default weight, caps json, weights json, scan, prefix
+_CLAIM = lua_script("""
+local now, lease, token = tonumber(ARGV[1]), tonumber(ARGV[2]), ARGV[3]
+local caps, weights = cjson.decode(ARGV[6]), cjson.decode(ARGV[7])
+local shops = redis.call('ZRANGE', KEYS[1], 0, tonumber(ARGV[8]) - 1, 'WITHSCORES')
+for i = 1, #shops, 2 do
+  local shop, vt = shops[i], tonumber(shops[i + 1])
+  local q, inflight = ARGV[9] .. 'q:' .. shop, ARGV[9] .. 'inflight:' .. shop
+  redis.call('ZREMRANGEBYSCORE', inflight, '-inf', now)
+  local cap = tonumber(caps[shop] or ARGV[4])
+  if cap <= 0 or redis.call('ZCARD', inflight) < cap then
+    local item = redis.call('LPOP', q)
+    if item then
+      redis.call('ZADD', inflight, now + lease, token)
+      redis.call('EXPIRE', inflight, math.ceil(lease * 2))
+      redis.call('SET', KEYS[2], vt)
+      if redis.call('LLEN', q) > 0 then
+        redis.call('ZADD', KEYS[1], vt + 1 / tonumber(weights[shop] or ARGV[5]), shop)
+      else
+        redis.call('ZREM', KEYS[1], shop)
+      end
+      return {shop, item}
+    end
+    redis.call('ZREM', KEYS[1], shop)
+  end
+end
+return false
+""")
+
+def _item(shop_id: str, order: dict, event_id: Optional[str]) -> bytes:
+    return fastjson.dumps({"shop_id": shop_id, "order": order, "event_id": event_id, "enqueued_at": time.time()})
+
+async def enqueue(shop_id: str, order: dict, event_id: Optional[str], client=None) -> bytes:
+    """Queue an order under its shop; returns the stored item (see discard)."""
+    item = _item(shop_id, order, event_id)
+    await _ENQUEUE(keys=[ACTIVE_KEY, VCLOCK_KEY, queue_key(shop_id)], args=[shop_id, item],
+                   client=client or get_async_redis())
+    return item
+
+async def discard(shop_id: str, item: bytes, client=None) -> None:
+    """Take back an enqueued item whose score_next token could not be sent."""
+    await (client or get_async_redis()).lrem(queue_key(shop_id), -1, item)
+
+def claim(client: Optional[redis.Redis] = None) -> Optional[Tuple[str, dict, str]]:
+    """(shop, item, lease token) for the fairest runnable order, or None."""
+    token = uuid.uuid4().hex
+    got = _CLAIM(keys=[ACTIVE_KEY, VCLOCK_KEY], args=[
+        time.time(), settings.FAIR_LEASE_SECONDS, token,
+        settings.FAIR_SHOP_CONCURRENCY, 1.0,
+        json.dumps(settings.FAIR_SHOP_CONCURRENCY_OVERRIDES or {}),
+        json.dumps(settings.FAIR_SHOP_WEIGHTS or {}),
+        SCAN_SHOPS, PREFIX,
+    ], client=client or get_redis())
+    if not got:
+        return None
+    shop, item = got
+    return shop.decode() if isinstance(shop, bytes) else shop, fastjson.loads(item), token
+
+def release(shop: str, token: str, client: Optional[redis.Redis] = None) -> None:
+    (client or get_redis()).zrem(inflight_key(shop), token)
+
+def pending(client: Optional[redis.Redis] = None) -> int:
+    """Shops with queued orders."""
+    return int((client or get_redis()).zcard(ACTIVE_KEY))
+
+def shop_backlog(limit: int = METRICS_SHOPS, client: Optional[redis.Redis] = None) -> Dict[str, Tuple[int, float]]:
+    """{shop: (queued orders, age in seconds of its oldest)} for up to `limit` active shops."""
+    r = client or get_redis()
+    shops = [s.decode() if isinstance(s, bytes) else s for s in r.zrange(ACTIVE_KEY, 0, limit - 1)]
+    if not shops:
+        return {}
+    pipe = r.pipeline(transaction=False)
+    for shop in shops:
+        pipe.llen(queue_key(shop))
+        pipe.lindex(queue_key(shop), 0)
+    replies: List = pipe.execute()
+    now, out = time.time(), {}
+    for shop, depth, head in zip(shops, replies[::2], replies[1::2]):
+        out[shop] = (int(depth), max(0.0, now - fastjson.loads(head)["enqueued_at"]) if head else 0.0)
+    return out
+
+@metrics.collector(shared=True)
+def _backlog_metrics() -> dict:
+    if not settings.FAIR_SCHEDULING:
+        return {}
+    try:
+        backlog = shop_backlog()
+    except redis.RedisError:
+        return {}
+    return {
+        "fp_shop_queue_depth": metrics.family(
+            "gauge", "Orders waiting in a shop's fair-scheduling queue", ("shop",),
+            [((shop,), depth) for shop, (depth, _) in backlog.items()]),
+        "fp_shop_queue_age_seconds": metrics.family(
+            "gauge", "Age of the oldest order in a shop's fair-scheduling queue", ("shop",),
+            [((shop,), round(age, 3)) for shop, (_, age) in backlog.items()]),
+    }
@@ -0,0 +1,17 @@
+"""orjson when available, stdlib json otherwise."""
+try:
+    import orjson
+
+    def loads(raw):
+        return orjson.loads(raw)
+
+    def dumps(obj) -> bytes:
+        return orjson.dumps(obj)
+except ImportError:  # pragma: no cover
+    import json
+
+    def loads(raw):
+        return json.loads(raw)
+
+    def dumps(obj) -> bytes:
+        return json.dumps(obj, separators=(",", ":")).encode()
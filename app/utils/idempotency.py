@@ -1,6 +1,11 @@
+from typing import List, Optional
+import redis
 from sqlalchemy.orm import Session
 from sqlalchemy import select
+from ..config import settings
 from ..models import WebhookEvent
+from . import fastjson
+from .redis_client import async_lua_script, get_async_redis, get_redis
 
 def is_processed(db: Session, event_id: str) -> bool:
     q = select(WebhookEvent).where(WebhookEvent.event_id == event_id)
@@ -11,3 +16,41 @@ def mark_processed(db: Session, topic: str, event_id: str) -> None:
     evt = WebhookEvent(topic=topic, event_id=event_id)
     db.add(evt)
     db.commit()
+
+# ---------- Redis admission (webhook request path) ----------
+DEDUP_PREFIX = "fp:wh:seen:"
+PENDING_EVENTS_KEY = "fp:wh:pending"
+
+# KEYS[1]: dedup key, KEYS[2]: pending webhook_events list
+# ARGV[1]: ttl, ARGV[2]: webhook_events record (json)
+_ADMIT = async_lua_script("""
+if redis.call('SET', KEYS[1], '1', 'NX', 'EX', tonumber(ARGV[1])) then
+  redis.call('RPUSH', KEYS[2], ARGV[2])
+  return 1
+end
+return 0
+""")
+
+async def admit_webhook(event_id: str, shop_id: Optional[str], topic: str,
+                        client=None) -> bool:
+    """Claim a webhook id; False if it was already admitted.
+
+    Claiming and queueing its durable webhook_events record is one atomic
+    round trip; the record itself is written later by flush_webhook_events.
+    """
+    r = client or get_async_redis()
+    record = fastjson.dumps({"event_id": event_id, "shop_id": shop_id, "topic": topic})
+    admitted = await _ADMIT(keys=[DEDUP_PREFIX + event_id, PENDING_EVENTS_KEY],
+                            args=[settings.WEBHOOK_DEDUP_TTL, record], client=r)
+    return bool(admitted)
+
+async def release_webhook(event_id: str, client=None) -> None:
+    """Undo admit_webhook() so Shopify's retry is accepted (e.g. enqueue failed)."""
+    await (client or get_async_redis()).delete(DEDUP_PREFIX + event_id)
+
+def peek_pending_events(limit: int, client: Optional[redis.Redis] = None) -> List[dict]:
+    r = client or get_redis()
+    return [fastjson.loads(raw) for raw in r.lrange(PENDING_EVENTS_KEY, 0, limit - 1)]
+
+def trim_pending_events(count: int, client: Optional[redis.Redis] = None) -> None:
+    (client or get_redis()).ltrim(PENDING_EVENTS_KEY, count, -1)
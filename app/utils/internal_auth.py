@@ -0,0 +1,12 @@
+"""Shared-secret check for internal endpoints (the same x-internal-auth header
+the API sends to the Remix app, see utils/remix.py)."""
+import hmac
+
+from fastapi import Header, HTTPException
+
+from ..config import settings
+
+def require_internal_auth(x_internal_auth: str = Header("", alias="x-internal-auth")) -> None:
+    """FastAPI dependency: 401 unless the header carries INTERNAL_SHARED_SECRET."""
+    if not hmac.compare_digest(x_internal_auth.encode(), settings.INTERNAL_SHARED_SECRET.encode()):
+        raise HTTPException(status_code=401, detail="Unauthorized")
@@ -0,0 +1,340 @@
+"""In-process counters and histograms with Prometheus text exposition.
+
+    from app.utils import metrics
+
+    STAGE = metrics.histogram("fp_order_stage_seconds", "Order pipeline stages", labels=("stage",))
+
+    with STAGE.time(stage="defender3d"):
+        ...
+
+    @STAGE.time(stage="commit")
+    def commit(): ...
+
+No client library and no push gateway. Each process keeps its own
+registry. With METRICS_DIR set, every process also writes a snapshot to
+METRICS_DIR/<role>/<pid>.json every METRICS_FLUSH_SECONDS, and render()
+sums the live snapshots of its role. So uvicorn's /metrics and the Celery
+worker exporter (WORKER_METRICS_PORT) each report the whole host rather
+than whichever process answered. Series are summed across processes; a
+process that exits drops out, which Prometheus treats as a counter reset.
+"""
+import json
+import math
+import os
+import threading
+import time
+from contextlib import ContextDecorator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from ..config import settings
+from .logging import logger
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+INF_LABEL = 'le="+Inf"'
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self._series: Dict[LabelValues, object] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._series.clear()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            series = [[list(k), v] for k, v in self._series.items()]
+        return {"kind": self.kind, "help": self.help, "labels": list(self.labelnames), "series": series}
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        _registry.touch()
+        with self._lock:
+            self._series[key] = self._series.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        _registry.touch()
+        with self._lock:
+            self._series[key] = float(value)
+
+
+class _Timer(ContextDecorator):
+    def __init__(self, histogram: "Histogram", labels: Dict[str, str]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def _recreate_cm(self):
+        # a decorated function can run in several threads at once; each call gets its own start time
+        return _Timer(self.histogram, self.labels)
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self._started, **self.labels)
+        return False
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        _registry.touch()
+        with self._lock:
+            s = self._series.get(key)
+            if s is None:
+                s = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, upper in enumerate(self.buckets):
+                if value <= upper:
+                    s[0][i] += 1
+            s[1] += value
+            s[2] += 1
+
+    def time(self, **labels) -> _Timer:
+        """Context manager / decorator observing the elapsed seconds."""
+        return _Timer(self, labels)
+
+    def snapshot(self) -> dict:
+        out = super().snapshot()
+        out["buckets"] = list(self.buckets)
+        out["series"] = [[k, [list(v[0]), v[1], v[2]]] for k, v in out["series"]]
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, _Metric] = {}
+        self.collectors: List[Callable[[], Dict[str, dict]]] = []
+        self.shared_collectors: List[Callable[[], Dict[str, dict]]] = []
+        self.role = "api"
+        self._writing = False
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self.metrics.get(metric.name)
+            if existing is not None:
+                return existing  # module reloads / repeated imports share one series
+            self.metrics[metric.name] = metric
+        return metric
+
+    def touch(self) -> None:
+        """Start this process's snapshot writer on its first observation."""
+        if self._writing or not settings.METRICS_DIR:
+            return
+        with self._lock:
+            if self._writing:
+                return
+            self._writing = True
+        threading.Thread(target=self._write_loop, name="metrics-snapshot", daemon=True).start()
+
+    def after_fork(self) -> None:
+        """A forked child (Celery prefork) starts from zero rather than the parent's copy."""
+        self._lock = threading.Lock()
+        self._writing = False
+        for m in self.metrics.values():
+            m._lock = threading.Lock()
+            m.reset()
+
+    def snapshot(self, collectors=None) -> Dict[str, dict]:
+        out = {name: m.snapshot() for name, m in self.metrics.items()} if collectors is None else {}
+        for collect in self.collectors if collectors is None else collectors:
+            try:
+                out.update(collect())
+            except Exception:
+                logger.warning("Metrics collector %r failed", collect, exc_info=True)
+        return out
+
+    # ---------- cross-process snapshots ----------
+    def _dir(self) -> str:
+        return os.path.join(settings.METRICS_DIR, self.role)
+
+    def write_snapshot(self) -> None:
+        os.makedirs(self._dir(), exist_ok=True)
+        path = os.path.join(self._dir(), f"{os.getpid()}.json")
+        with open(path + ".tmp", "w") as fh:
+            json.dump(self.snapshot(), fh)
+        os.replace(path + ".tmp", path)
+
+    def _write_loop(self) -> None:
+        while settings.METRICS_DIR:
+            try:
+                self.write_snapshot()
+            except OSError:
+                logger.warning("Could not write metrics snapshot", exc_info=True)
+            time.sleep(settings.METRICS_FLUSH_SECONDS)
+
+    def _host_snapshots(self) -> List[Dict[str, dict]]:
+        snaps = [self.snapshot()]
+        try:
+            names = os.listdir(self._dir())
+        except FileNotFoundError:
+            return snaps
+        for name in names:
+            if not name.endswith(".json") or name == f"{os.getpid()}.json":
+                continue
+            path = os.path.join(self._dir(), name)
+            try:
+                os.kill(int(name[:-5]), 0)
+            except ProcessLookupError:
+                _remove_quietly(path)
+                continue
+            except (ValueError, PermissionError):
+                pass
+            try:
+                with open(path) as fh:
+                    snaps.append(json.load(fh))
+            except (OSError, ValueError):
+                continue
+        return snaps
+
+    def render(self) -> str:
+        snaps = self._host_snapshots() if settings.METRICS_DIR else [self.snapshot()]
+        if self.shared_collectors:
+            snaps.append(self.snapshot(self.shared_collectors))
+        return render_snapshots(snaps)
+
+
+def _remove_quietly(path: str) -> None:
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+def _fmt(v: float) -> str:
+    v = float(v)
+    if math.isinf(v):
+        return "+Inf" if v > 0 else "-Inf"
+    return str(int(v)) if v.is_integer() else repr(v)
+
+def _labels(names, values, extra: str = "") -> str:
+    parts = ['%s="%s"' % (n, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+             for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def render_snapshots(snaps: List[Dict[str, dict]]) -> str:
+    """Prometheus text format for the sum of one or more registry snapshots."""
+    merged: Dict[str, dict] = {}
+    for snap in snaps:
+        for name, m in snap.items():
+            into = merged.setdefault(name, {**m, "series": {}})
+            for labels, value in m["series"]:
+                key = tuple(labels)
+                prev = into["series"].get(key)
+                if m["kind"] == "histogram":
+                    if prev is None:
+                        into["series"][key] = [list(value[0]), value[1], value[2]]
+                    else:
+                        prev[0] = [a + b for a, b in zip(prev[0], value[0])]
+                        prev[1] += value[1]
+                        prev[2] += value[2]
+                else:
+                    into["series"][key] = (prev or 0.0) + value
+    lines = []
+    for name in sorted(merged):
+        m = merged[name]
+        lines.append(f"# HELP {name} {m['help']}")
+        lines.append(f"# TYPE {name} {m['kind']}")
+        for key, value in sorted(m["series"].items()):
+            if m["kind"] == "histogram":
+                counts, total, n = value
+                for upper, c in zip(m["buckets"], counts):
+                    le = 'le="%s"' % _fmt(upper)
+                    lines.append(f"{name}_bucket{_labels(m['labels'], key, le)} {c}")
+                lines.append(f"{name}_bucket{_labels(m['labels'], key, INF_LABEL)} {n}")
+                lines.append(f"{name}_sum{_labels(m['labels'], key)} {_fmt(total)}")
+                lines.append(f"{name}_count{_labels(m['labels'], key)} {n}")
+            else:
+                lines.append(f"{name}{_labels(m['labels'], key)} {_fmt(value)}")
+    return "\n".join(lines) + "\n"
+
+
+_registry = Registry()
+os.register_at_fork(after_in_child=_registry.after_fork)
+
+def counter(name: str, help: str, labels: Iterable[str] = ()) -> Counter:
+    return _registry.register(Counter(name, help, labels))
+
+def gauge(name: str, help: str, labels: Iterable[str] = ()) -> Gauge:
+    return _registry.register(Gauge(name, help, labels))
+
+def histogram(name: str, help: str, labels: Iterable[str] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+    return _registry.register(Histogram(name, help, labels, buckets))
+
+def family(kind: str, help: str, labels: Iterable[str], series: Iterable[Tuple[Iterable[str], float]]) -> dict:
+    """A counter/gauge family in snapshot form, for collectors."""
+    return {"kind": kind, "help": help, "labels": list(labels),
+            "series": [[list(values), value] for values, value in series]}
+
+def collector(fn: Callable[[], Dict[str, dict]] = None, shared: bool = False):
+    """Register fn() -> {name: {"kind", "help", "labels", "series"}} evaluated at scrape time.
+
+    For state that already lives elsewhere: per-process cache and Bloom
+    filter stats, or with shared=True state every process sees the same
+    way (Redis queue depths), which is reported once instead of summed.
+    """
+    def register(fn):
+        (_registry.shared_collectors if shared else _registry.collectors).append(fn)
+        return fn
+    return register(fn) if fn is not None else register
+
+def set_role(role: str) -> None:
+    """Snapshot namespace for this process ("api", "worker"); one exporter per role."""
+    _registry.role = role
+
+def render() -> str:
+    return _registry.render()
+
+def serve(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Expose render() on http://host:port/metrics from a daemon thread."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-exporter", daemon=True).start()
+    logger.info("Metrics exporter listening on :%d", port)
+    return server
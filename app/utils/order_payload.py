@@ -0,0 +1,35 @@
+"""The part of an orders/create payload that scoring reads.
+
+A Shopify order carries line items, customer, addresses, discounts and
+fulfilment details, often tens of KB. The scoring task (build_order_input)
+and the metafield writer read about a dozen fields. The webhook enqueues
+project_order(payload), so the Redis queue and both ends of the
+serializer only handle those. Projected orders keep the original shape,
+so the task reads full and projected orders the same way, including
+messages still queued from before a deploy.
+"""
+DEVICE_ATTR = "fraudpop_device_id"
+
+def _country(address) -> dict:
+    return {"country_code": address.get("country_code")} if isinstance(address, dict) else {}
+
+def project_order(order: dict) -> dict:
+    """Only the fields process_order_async and write_metafields use."""
+    note = order.get("note_attributes") or []
+    if isinstance(note, dict):
+        device = note.get(DEVICE_ATTR)
+    else:
+        device = next((a.get("value") for a in note if isinstance(a, dict) and a.get("name") == DEVICE_ATTR), None)
+    out = {
+        "id": order.get("id"),
+        "admin_graphql_api_id": order.get("admin_graphql_api_id"),
+        "total_price": order.get("total_price"),
+        "currency": order.get("currency"),
+        "email": order.get("email"),
+        "client_details": {"browser_ip": (order.get("client_details") or {}).get("browser_ip")},
+        "shipping_address": _country(order.get("shipping_address")),
+        "billing_address": _country(order.get("billing_address")),
+    }
+    if device is not None:
+        out["note_attributes"] = [{"name": DEVICE_ATTR, "value": device}]
+    return out
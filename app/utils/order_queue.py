@@ -0,0 +1,45 @@
+"""Redis list feeding the batched scoring consumer (ORDER_BATCH_MODE)."""
+import time
+from typing import List, Optional
+import redis
+
+from . import fastjson
+from .redis_client import get_async_redis, get_redis, lua_script
+
+PENDING_KEY = "fp:orders:pending"
+
+def processing_key(consumer: str) -> str:
+    return f"fp:orders:processing:{consumer}"
+
+# Move up to ARGV[1] items from pending to this consumer's processing list.
+_CLAIM = lua_script("""
+local items = redis.call('LPOP', KEYS[1], tonumber(ARGV[1]))
+if not items then return {} end
+redis.call('RPUSH', KEYS[2], unpack(items))
+return items
+""")
+
+# Put a dead consumer's unacknowledged items back at the head of pending.
+_REQUEUE = lua_script("""
+local items = redis.call('LRANGE', KEYS[2], 0, -1)
+for i = #items, 1, -1 do redis.call('LPUSH', KEYS[1], items[i]) end
+redis.call('DEL', KEYS[2])
+return #items
+""")
+
+async def enqueue_order(shop_id: str, order: dict, event_id: Optional[str], client=None) -> None:
+    item = fastjson.dumps({"shop_id": shop_id, "order": order, "event_id": event_id,
+                            "enqueued_at": time.time()})
+    await (client or get_async_redis()).rpush(PENDING_KEY, item)
+
+def claim(consumer: str, count: int, client: Optional[redis.Redis] = None) -> List[dict]:
+    r = client or get_redis()
+    raw = _CLAIM(keys=[PENDING_KEY, processing_key(consumer)], args=[count], client=r)
+    return [fastjson.loads(x) for x in raw]
+
+def ack(consumer: str, client: Optional[redis.Redis] = None) -> None:
+    (client or get_redis()).delete(processing_key(consumer))
+
+def requeue_unacked(consumer: str, client: Optional[redis.Redis] = None) -> int:
+    r = client or get_redis()
+    return int(_REQUEUE(keys=[PENDING_KEY, processing_key(consumer)], client=r))
@@ -0,0 +1,79 @@
+from typing import List, Optional, Sequence, Tuple
+import redis
+import redis.asyncio as aioredis
+from redis.commands.core import AsyncScript, Script
+from redis.exceptions import NoScriptError
+
+from ..config import settings
+
+_client: Optional[redis.Redis] = None
+_async_client: Optional[aioredis.Redis] = None
+
+def _options() -> dict:
+    # bounded waits: a Redis outage costs a request one timeout, not a hung worker
+    return {"max_connections": settings.REDIS_MAX_CONNECTIONS,
+            "socket_connect_timeout": settings.REDIS_CONNECT_TIMEOUT,
+            "socket_timeout": settings.REDIS_SOCKET_TIMEOUT}
+
+def get_redis() -> redis.Redis:
+    """Process-wide Redis client (connection-pooled, lazy like get_engine)."""
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.REDIS_URL, **_options())
+    return _client
+
+def get_async_redis() -> aioredis.Redis:
+    """asyncio Redis client for the FastAPI routes."""
+    global _async_client
+    if _async_client is None:
+        _async_client = aioredis.Redis.from_url(settings.REDIS_URL, **_options())
+    return _async_client
+
+async def close_async_redis() -> None:
+    if _async_client is not None:
+        await _async_client.aclose()
+
+def reset_redis() -> None:
+    """Forget clients inherited over fork(); the child connects on first use."""
+    global _client, _async_client
+    _client = _async_client = None
+
+# ---------- Lua scripts ----------
+# Built once per module and run by SHA: EVALSHA sends 40 bytes instead of the source, and
+# redis-py loads the script and retries once if Redis answers NOSCRIPT (restart, SCRIPT FLUSH).
+# The source is passed as bytes, so no client is needed up front; pass client= on every call.
+def lua_script(source: str) -> Script:
+    return Script(None, source.encode())
+
+def async_lua_script(source: str) -> AsyncScript:
+    return AsyncScript(None, source.encode())
+
+def evalsha_pipelined(client: redis.Redis, script: Script,
+                      calls: Sequence[Tuple[Sequence, Sequence]]) -> List:
+    """script(keys, args) for each (keys, args) in one pipelined round trip.
+
+    A pipeline that has the Script object registered checks SCRIPT EXISTS
+    before every execute, which is a second round trip. So this sends bare
+    EVALSHAs, loads the script only when Redis answers NOSCRIPT, and runs
+    the calls that were refused again.
+    """
+    replies: List = [None] * len(calls)
+    todo = list(range(len(calls)))
+    for attempt in range(2):
+        pipe = client.pipeline(transaction=False)
+        for i in todo:
+            keys, args = calls[i]
+            pipe.evalsha(script.sha, len(keys), *keys, *args)
+        refused = []
+        for i, reply in zip(todo, pipe.execute(raise_on_error=False)):
+            if isinstance(reply, NoScriptError) and attempt == 0:
+                refused.append(i)
+            elif isinstance(reply, Exception):
+                raise reply
+            else:
+                replies[i] = reply
+        if not refused:
+            break
+        script.sha = client.script_load(script.script)
+        todo = refused
+    return replies
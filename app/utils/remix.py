@@ -0,0 +1,84 @@
+"""Pooled HTTP client for the Remix app's internal /api/metafields-set endpoint."""
+from typing import List, Optional
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from ..config import settings
+from .logging import logger
+
+class RemixError(RuntimeError):
+    """The Remix app rejected the write; retrying will not help."""
+
+class RemixRetryableError(RemixError):
+    """429, 5xx or a transport failure; safe to retry later."""
+
+    def __init__(self, msg: str, retry_after: Optional[float] = None):
+        super().__init__(msg)
+        self.retry_after = retry_after
+
+def _retry_after(r: requests.Response) -> Optional[float]:
+    try:
+        return float(r.headers.get("Retry-After", ""))
+    except ValueError:
+        return None
+
+class RemixClient:
+    """Keep-alive session per process; one POST can carry many metafields."""
+
+    def __init__(self, base_url: str, secret: str, pool_size: int = 10, timeout: float = 12.0):
+        base = (base_url or "").strip().rstrip("/")
+        self.url = urljoin(base + "/", "api/metafields-set")
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({
+            "Accept": "application/json",
+            "Content-Type": "application/json",
+            "x-internal-auth": secret,
+            "User-Agent": "fraudpop-backend/1.0 (+requests)",
+        })
+
+    def metafields_set(self, shop: str, metafields: List[dict]) -> dict:
+        try:
+            r = self.session.post(self.url, json={"shop": shop, "metafields": metafields},
+                                  timeout=self.timeout, allow_redirects=False)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise RemixRetryableError(f"POST {self.url} failed: {e}") from e
+
+        if 300 <= r.status_code < 400:
+            loc = r.headers.get("Location", "")
+            raise RemixError(f"Unexpected redirect {r.status_code} to {loc} (POST {self.url})")
+        if r.status_code == 429 or r.status_code >= 500:
+            raise RemixRetryableError(f"metafieldsSet HTTP {r.status_code}", _retry_after(r))
+        if r.status_code >= 400:
+            snippet = (r.text or "")[:1000]
+            logger.error("metafieldsSet HTTP %s\nURL: %s\nCT: %s\nBody:\n%s",
+                         r.status_code, r.url, r.headers.get("Content-Type"), snippet)
+            raise RemixError(f"metafieldsSet HTTP {r.status_code}")
+
+        ct = (r.headers.get("Content-Type") or "").lower()
+        if "application/json" not in ct:
+            snippet = (r.text or "")[:1000]
+            raise RemixError(f"Non-JSON response ({ct or 'no content-type'}) from {r.url}:\n{snippet}")
+        try:
+            data = r.json()
+        except ValueError:
+            snippet = (r.text or "")[:1000]
+            raise RemixError(f"Invalid JSON from {r.url}:\n{snippet}")
+        if not data.get("ok"):
+            logger.error("metafieldsSet failed JSON: %s", data)
+            raise RemixError(f"metafieldsSet failed: {data}")
+        return data
+
+_client: Optional[RemixClient] = None
+
+def get_remix_client() -> RemixClient:
+    global _client
+    if _client is None:
+        _client = RemixClient(settings.REMIX_URL, settings.INTERNAL_SHARED_SECRET,
+                              pool_size=settings.REMIX_POOL_SIZE)
+    return _client
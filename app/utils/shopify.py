@@ -1,8 +1,20 @@
-import hmac, hashlib, base64, os
+import hmac, hashlib, base64
+from typing import Optional
+
+from ..config import settings
+
+_webhook_mac: Optional["hmac.HMAC"] = None
+
+def webhook_mac() -> "hmac.HMAC":
+    """HMAC-SHA256 keyed with SHOPIFY_WEBHOOK_SECRET, built once; callers .copy() it."""
+    global _webhook_mac
+    if _webhook_mac is None:
+        _webhook_mac = hmac.new(settings.SHOPIFY_WEBHOOK_SECRET.encode(), digestmod=hashlib.sha256)
+    return _webhook_mac
 
 def verify_shopify_hmac(raw_body: bytes, header_hmac: str) -> bool:
-    secret = os.environ["SHOPIFY_WEBHOOK_SECRET"].encode()
-    digest = hmac.new(secret, raw_body, hashlib.sha256).digest()
-    expected = base64.b64encode(digest).decode()
+    mac = webhook_mac().copy()
+    mac.update(raw_body)
+    expected = base64.b64encode(mac.digest()).decode()
     # Timing-safe compare
     return hmac.compare_digest(expected, header_hmac)
@@ -0,0 +1,318 @@
+# app/vault/bloom.py
+"""Host-shared Bloom filter of every risk_identity (kind, hash) key.
+
+Most identifiers on an order have never been seen. A definite "not present"
+from this filter lets vault lookups return 0 without asking Postgres. The
+filter is a file (VAULT_BLOOM_PATH) that every Celery and uvicorn process on
+the host maps MAP_SHARED, so a bit set by one process is visible to all of
+them immediately and the memory is paid once per host.
+
+- Writes: vault writes add their keys before committing. A rollback then
+  only leaves a false positive, never a false negative. Writers take an
+  flock on `<path>.lock`, because setting a bit is a read-modify-write of
+  a shared byte.
+- Rebuilds: the first process to find the file missing, older than
+  VAULT_BLOOM_REBUILD_SECONDS or over capacity rebuilds it from the table
+  in a background thread (one builder per host, via `<path>.build`).
+  Until the file exists, lookups simply go to Postgres. The new file is
+  sized for max(capacity, 2x rows). Rows written during the scan are
+  re-read under the write lock before the atomic rename, and once more
+  after LATE_COMMIT_SECONDS. Other processes notice the new inode within
+  RELOAD_CHECK_SECONDS and remap.
+
+Skip rate and false-positive rate are per-process counters (`stats()`,
+and fp_vault_bloom_keys_total in /metrics).
+
+    python -m app.vault.bloom   # rebuild now, e.g. after restoring the database
+"""
+import argparse
+import fcntl
+import hashlib
+import json
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func, select
+
+from ..config import settings
+from ..models import RiskIdentity
+from ..utils import metrics
+from ..utils.logging import logger
+
+IdentityKey = Tuple[str, str]
+
+MAGIC = b"FPBLOOM1"
+_HEADER = struct.Struct("<8sQIIQdQ")  # magic, bits, hashes, reserved, items, built_at, capacity
+HEADER_SIZE = 64
+RELOAD_CHECK_SECONDS = 5.0
+REBUILD_MARGIN_SECONDS = 120
+LATE_COMMIT_SECONDS = 30.0
+SCAN_CHUNK = 50_000
+
+def geometry(capacity: int, fp_rate: float) -> Tuple[int, int]:
+    """(bits, hash functions) for `capacity` keys at `fp_rate`."""
+    bits = max(64, math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2))
+    bits = (bits + 7) // 8 * 8
+    return bits, max(1, round(bits / capacity * math.log(2)))
+
+def _positions(key: IdentityKey, bits: int, hashes: int) -> List[int]:
+    d = hashlib.blake2b(f"{key[0]}\0{key[1]}".encode("utf-8"), digest_size=16).digest()
+    h1 = int.from_bytes(d[:8], "little")
+    h2 = int.from_bytes(d[8:], "little") | 1
+    return [(h1 + i * h2) % bits for i in range(hashes)]
+
+
+class BloomFile:
+    """One mapped filter file: header + bit array."""
+
+    def __init__(self, path: str):
+        fd = os.open(path, os.O_RDWR)
+        try:
+            self.inode = os.fstat(fd).st_ino
+            self.mm = mmap.mmap(fd, 0)
+        finally:
+            os.close(fd)
+        magic, self.bits, self.hashes, _, _, self.built_at, self.capacity = _HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            self.mm.close()
+            raise ValueError(f"{path} is not a vault Bloom filter")
+
+    @classmethod
+    def create(cls, path: str, capacity: int, fp_rate: float) -> "BloomFile":
+        bits, hashes = geometry(capacity, fp_rate)
+        with open(path, "wb") as fh:
+            fh.write(_HEADER.pack(MAGIC, bits, hashes, 0, 0, time.time(), capacity).ljust(HEADER_SIZE, b"\0"))
+            fh.truncate(HEADER_SIZE + bits // 8)
+        return cls(path)
+
+    @property
+    def items(self) -> int:
+        return _HEADER.unpack_from(self.mm, 0)[4]
+
+    def might_contain(self, key: IdentityKey) -> bool:
+        mm = self.mm
+        for p in _positions(key, self.bits, self.hashes):
+            if not mm[HEADER_SIZE + (p >> 3)] & (1 << (p & 7)):
+                return False
+        return True
+
+    def add(self, keys: Iterable[IdentityKey]) -> None:
+        """Set the keys' bits; callers serialise writers (see VaultBloom.add_many)."""
+        mm, added = self.mm, 0
+        for key in keys:
+            new = False
+            for p in _positions(key, self.bits, self.hashes):
+                i, bit = HEADER_SIZE + (p >> 3), 1 << (p & 7)
+                byte = mm[i]
+                if not byte & bit:
+                    mm[i] = byte | bit
+                    new = True
+            added += new  # keys already present do not count towards capacity
+        if added:
+            header = list(_HEADER.unpack_from(mm, 0))
+            header[4] += added
+            _HEADER.pack_into(mm, 0, *header)
+
+    def close(self) -> None:
+        self.mm.close()
+
+
+class VaultBloom:
+    """Process-side handle: remaps on rebuild, triggers rebuilds, keeps the metrics."""
+
+    def __init__(self, path: str, session_factory: Callable, capacity: int = 10_000_000,
+                 fp_rate: float = 0.01, rebuild_seconds: float = 86400.0):
+        self.path = path
+        self.session_factory = session_factory
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.rebuild_seconds = rebuild_seconds
+        self.checked = self.skipped = self.probed = self.false_positives = 0
+        self._file: Optional[BloomFile] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._building = False
+
+    # ---------- file lifecycle ----------
+    @contextmanager
+    def _flock(self, suffix: str, blocking: bool = True):
+        fd = os.open(self.path + suffix, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+            yield True
+        finally:
+            os.close(fd)
+
+    def _current(self, force: bool = False) -> Optional[BloomFile]:
+        now = time.monotonic()
+        if not force and now - self._checked_at < RELOAD_CHECK_SECONDS:
+            return self._file
+        with self._lock:
+            self._checked_at = now
+            try:
+                inode = os.stat(self.path).st_ino
+            except FileNotFoundError:
+                inode = None
+            if inode is not None and (self._file is None or self._file.inode != inode):
+                try:
+                    fresh = BloomFile(self.path)
+                except (OSError, ValueError):
+                    logger.warning("Unreadable vault Bloom filter at %s", self.path, exc_info=True)
+                else:
+                    self._file = fresh  # the old map is left to the GC; readers may still hold it
+            f = self._file
+        if f is None or time.time() - f.built_at > self.rebuild_seconds or f.items > f.capacity:
+            self._start_rebuild()
+        return f
+
+    def _start_rebuild(self) -> None:
+        with self._lock:
+            if self._building:
+                return
+            self._building = True
+
+        def run():
+            try:
+                self.rebuild()
+            except Exception:
+                logger.exception("Vault Bloom filter rebuild failed")
+            finally:
+                self._building = False
+        threading.Thread(target=run, name="vault-bloom-rebuild", daemon=True).start()
+
+    def rebuild(self, settle: float = LATE_COMMIT_SECONDS) -> bool:
+        """Build a fresh filter from risk_identity; False if another process is building.
+
+        `settle` seconds after the swap, recent rows are read once more into
+        the live file. Transactions that were still open at the swap had set
+        their bits in the old file.
+        """
+        with self._flock(".build", blocking=False) as mine:
+            if not mine:
+                return False
+            started = time.time()
+            tmp = f"{self.path}.tmp.{os.getpid()}"
+            with self.session_factory() as db:
+                rows = db.scalar(select(func.count()).select_from(RiskIdentity))
+                new = BloomFile.create(tmp, max(self.capacity, 2 * rows), self.fp_rate)
+                try:
+                    self._scan(db, new, None)
+                    with self._flock(".lock"):
+                        # catch rows committed while we scanned, then swap atomically
+                        self._scan(db, new, started - REBUILD_MARGIN_SECONDS)
+                        new.mm.flush()
+                        os.replace(tmp, self.path)
+                finally:
+                    new.close()
+                    if os.path.exists(tmp):
+                        os.unlink(tmp)
+            logger.info("Rebuilt vault Bloom filter: %d keys, %d bits, %d hashes in %.1fs",
+                        rows, new.bits, new.hashes, time.time() - started)
+            if settle:
+                time.sleep(settle)
+                with self.session_factory() as db, self._flock(".lock"):
+                    live = BloomFile(self.path)
+                    try:
+                        self._scan(db, live, started - REBUILD_MARGIN_SECONDS)
+                    finally:
+                        live.close()
+        self._current(force=True)
+        return True
+
+    def _scan(self, db, target: BloomFile, since: Optional[float]) -> None:
+        stmt = select(RiskIdentity.kind, RiskIdentity.hash)
+        if since is not None:
+            stmt = stmt.where(RiskIdentity.last_seen >= datetime.fromtimestamp(since, tz=timezone.utc))
+        result = db.execute(stmt.execution_options(yield_per=SCAN_CHUNK))
+        for rows in result.partitions(SCAN_CHUNK):
+            target.add(rows)
+
+    # ---------- lookups and writes ----------
+    def split(self, keys: Iterable[IdentityKey]) -> Tuple[List[IdentityKey], List[IdentityKey]]:
+        """(keys that may be in the vault, keys that definitely are not)."""
+        keys = list(keys)
+        f = self._current()
+        if f is None:
+            return keys, []
+        maybe, absent = [], []
+        for k in keys:
+            (maybe if f.might_contain(k) else absent).append(k)
+        self.checked += len(keys)
+        self.skipped += len(absent)
+        return maybe, absent
+
+    def record_probe(self, probed: int, found: int) -> None:
+        """Feed back how many filter-passed keys the database actually had."""
+        self.probed += probed
+        self.false_positives += probed - found
+
+    def add_many(self, keys: Iterable[IdentityKey]) -> None:
+        keys = list(keys)
+        if not keys or self._current() is None:
+            return  # nothing to update yet; the pending rebuild reads the table
+        with self._flock(".lock"):
+            f = self._current(force=True)  # the path may have been swapped while we waited
+            if f is not None:
+                f.add(keys)
+
+    def stats(self) -> dict:
+        f = self._file
+        return {
+            "ready": f is not None,
+            "items": f.items if f else 0,
+            "bits": f.bits if f else 0,
+            "checked": self.checked,
+            "skipped": self.skipped,
+            "skip_rate": self.skipped / self.checked if self.checked else 0.0,
+            "false_positives": self.false_positives,
+            "fp_rate": self.false_positives / self.probed if self.probed else 0.0,
+        }
+
+
+_bloom: Optional[VaultBloom] = None
+_bloom_lock = threading.Lock()
+
+def get_vault_bloom() -> Optional[VaultBloom]:
+    """The host-shared filter, or None when VAULT_BLOOM_PATH is not set."""
+    global _bloom
+    if _bloom is None and settings.VAULT_BLOOM_PATH:
+        with _bloom_lock:
+            if _bloom is None:
+                from ..database import get_sessionmaker
+                _bloom = VaultBloom(settings.VAULT_BLOOM_PATH, lambda: get_sessionmaker()(),
+                                    capacity=settings.VAULT_BLOOM_CAPACITY,
+                                    fp_rate=settings.VAULT_BLOOM_FP_RATE,
+                                    rebuild_seconds=settings.VAULT_BLOOM_REBUILD_SECONDS)
+    return _bloom
+
+@metrics.collector
+def _bloom_metrics() -> dict:
+    if _bloom is None:
+        return {}
+    return {"fp_vault_bloom_keys_total": metrics.family(
+        "counter", "Vault keys checked against the Bloom filter", ("result",),
+        [(("checked",), _bloom.checked), (("skipped",), _bloom.skipped),
+         (("probed",), _bloom.probed), (("false_positive",), _bloom.false_positives)])}
+
+def main() -> None:
+    argparse.ArgumentParser(description="Rebuild the vault Bloom filter from risk_identity").parse_args()
+    bloom = get_vault_bloom()
+    if bloom is None:
+        raise SystemExit("VAULT_BLOOM_PATH is not set")
+    if not bloom.rebuild():
+        raise SystemExit("another process is rebuilding the filter")
+    print(json.dumps(bloom.stats(), indent=2))
+
+if __name__ == "__main__":
+    main()
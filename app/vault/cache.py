@@ -0,0 +1,209 @@
+# app/vault/cache.py
+"""Per-process vault caches, kept in step across processes through Redis.
+
+Every process (uvicorn worker, Celery child) has its own count_cache and
+signal_cache. A write to risk_identity in one process must reach the
+others, or /v1/vault/query keeps answering from counts that a chargeback
+push or a Celery worker has already changed. So writers append the keys
+they changed to the INVALIDATIONS_KEY stream once their transaction
+commits: sync sessions from an after_commit hook
+(invalidate_after_commit), async routes with the async client after
+`await commit(db)`. A daemon thread in each process reads the stream
+every VAULT_CACHE_SYNC_SECONDS and drops those keys, so a change made
+elsewhere is visible within about that interval. Lookups never talk to
+Redis for this; sync_caches() only reads the thread's state.
+
+If the stream cannot be read (Redis down), or this process may have
+missed entries (it fell behind the stream's cap), the caches are
+cleared. Lookups bypass them and go to Postgres until the thread has
+synced again within SYNC_GRACE intervals. VAULT_CACHE_SYNC_SECONDS=0
+turns the sharing off, and other processes are then up to
+VAULT_CACHE_TTL stale.
+"""
+import json
+import os
+import threading
+import time
+from typing import Iterable, Optional, Tuple
+
+from redis.exceptions import RedisError
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from ..config import settings
+from ..utils import metrics
+from ..utils.logging import logger
+from ..utils.redis_client import get_async_redis, get_redis
+from ..utils.ttlcache import TTLCache
+
+
+class CountCache(TTLCache):
+    """Bounded per-process LRU of recent vault counts with a TTL.
+
+    Hot identities (shared NAT IPs, a merchant's test email) are looked up on
+    almost every order; this keeps them off Postgres for `ttl` seconds.
+    """
+
+
+class SignalCache(TTLCache):
+    """Per-process read-through cache of full vault signals for /v1/vault/query.
+
+    Writes in any process invalidate its entries (see the module docstring).
+    """
+
+
+# One cache per worker process (Celery prefork children each get their own copy).
+count_cache = CountCache(maxsize=settings.VAULT_CACHE_SIZE, ttl=settings.VAULT_CACHE_TTL)
+signal_cache = SignalCache(maxsize=settings.VAULT_CACHE_SIZE, ttl=settings.VAULT_CACHE_TTL)
+
+# ---------- cross-process invalidation ----------
+INVALIDATIONS_KEY = "fp:vault:invalidated"
+INVALIDATIONS_MAXLEN = 100_000  # entries (one per committed write), trimmed approximately
+SYNC_READ_COUNT = 5_000
+SYNC_GRACE = 4                  # intervals without a successful sync before lookups bypass the caches
+
+_PENDING = "vault_invalidated"      # Session.info: keys written in the open transaction
+_DEFERRED = "vault_publish_async"   # Session.info: commit(db) publishes instead of the hook
+_COMMITTED = "vault_committed"      # Session.info: keys committed, waiting for commit(db)
+
+_syncer_lock = threading.Lock()
+_syncer_pid: Optional[int] = None  # process that owns the running sync thread
+_cursor: Optional[str] = None      # last stream id applied in this process; None = out of sync
+_synced_at = 0.0                   # monotonic time of the last successful sync
+
+def _drop(keys: Iterable[Tuple[str, str]]) -> None:
+    keys = list(keys)
+    count_cache.invalidate(keys)
+    signal_cache.invalidate(keys)
+
+def _clear() -> None:
+    count_cache.clear(stats=False)
+    signal_cache.clear(stats=False)
+
+def _reset(r) -> None:
+    """Clear both caches and start reading from the newest entry."""
+    global _cursor
+    _clear()
+    newest = r.xrevrange(INVALIDATIONS_KEY, count=1)
+    _cursor = newest[0][0].decode() if newest else "0-0"
+
+def _sync_once() -> None:
+    """Apply the stream entries this process has not seen; one round of the sync thread."""
+    global _cursor, _synced_at
+    try:
+        r = get_redis()
+        if _cursor is None:
+            _reset(r)
+        else:
+            entries = r.xread({INVALIDATIONS_KEY: _cursor}, count=SYNC_READ_COUNT)
+            entries = entries[0][1] if entries else []
+            if len(entries) == SYNC_READ_COUNT:
+                _reset(r)  # too far behind to trust what was trimmed
+            else:
+                for entry_id, fields in entries:
+                    _drop(tuple(k) for k in json.loads(fields[b"keys"]))
+                    _cursor = entry_id.decode()
+        _synced_at = time.monotonic()
+    except RedisError:
+        if _cursor is not None:
+            logger.warning("Vault cache invalidations unavailable; bypassing the caches", exc_info=True)
+        _cursor = None
+        _clear()
+
+def _sync_forever() -> None:
+    while settings.VAULT_CACHE_SYNC_SECONDS > 0:
+        try:
+            _sync_once()
+        except Exception:
+            logger.exception("Vault cache sync failed")
+        time.sleep(settings.VAULT_CACHE_SYNC_SECONDS)
+
+def _ensure_syncer() -> None:
+    """Start this process's sync thread (again after fork: threads do not survive it)."""
+    global _syncer_pid, _cursor
+    if _syncer_pid == os.getpid():
+        return
+    with _syncer_lock:
+        if _syncer_pid == os.getpid():
+            return
+        _syncer_pid = os.getpid()
+        _cursor = None  # whatever the parent had applied, this process starts over
+        threading.Thread(target=_sync_forever, name="vault-cache-sync", daemon=True).start()
+
+def sync_caches() -> bool:
+    """False if the shared caches must be bypassed: invalidations from other processes may be missing.
+
+    Never waits on Redis; the sync thread does that.
+    """
+    interval = settings.VAULT_CACHE_SYNC_SECONDS
+    if interval <= 0:
+        return True
+    _ensure_syncer()
+    return _cursor is not None and time.monotonic() - _synced_at < interval * SYNC_GRACE
+
+def _entry(keys: list) -> dict:
+    return {"keys": json.dumps(keys)}
+
+def _publish(keys: list) -> None:
+    try:
+        get_redis().xadd(INVALIDATIONS_KEY, _entry(keys), maxlen=INVALIDATIONS_MAXLEN, approximate=True)
+    except RedisError:
+        # readers in other processes fail the same way and bypass their caches
+        logger.warning("Vault cache invalidation for %d keys not published", len(keys), exc_info=True)
+
+async def _apublish(keys: list) -> None:
+    try:
+        await get_async_redis().xadd(INVALIDATIONS_KEY, _entry(keys), maxlen=INVALIDATIONS_MAXLEN,
+                                     approximate=True)
+    except RedisError:
+        logger.warning("Vault cache invalidation for %d keys not published", len(keys), exc_info=True)
+
+def _committed(session: Session) -> None:
+    keys = sorted(session.info.pop(_PENDING, ()))
+    _drop(keys)  # a reader in this process may have re-cached the old value before the commit
+    if not keys or settings.VAULT_CACHE_SYNC_SECONDS <= 0:
+        return
+    if session.info.get(_DEFERRED):
+        session.info[_COMMITTED] = keys
+    else:
+        _publish(keys)
+
+def _rolled_back(session: Session) -> None:
+    session.info.pop(_PENDING, None)
+
+def invalidate_after_commit(db: Session, keys: Iterable[Tuple[str, str]]) -> None:
+    """Drop keys from this process's caches now, and from every process's once `db` commits.
+
+    A sync Session publishes from its after_commit hook. Code holding an
+    AsyncSession commits with `await commit(db)`, which publishes without
+    blocking the event loop.
+    """
+    keys = set(keys)
+    if not keys:
+        return
+    _drop(keys)
+    db.info.setdefault(_PENDING, set()).update(keys)
+    if not event.contains(db, "after_commit", _committed):
+        event.listen(db, "after_commit", _committed)
+        event.listen(db, "after_rollback", _rolled_back)
+
+async def commit(db: AsyncSession) -> None:
+    """`await db.commit()`, then publish its vault invalidations with the async Redis client."""
+    info = db.sync_session.info
+    info[_DEFERRED] = True
+    try:
+        await db.commit()
+    finally:
+        info.pop(_DEFERRED, None)
+    keys = info.pop(_COMMITTED, None)
+    if keys:
+        await _apublish(keys)
+
+
+@metrics.collector
+def _cache_metrics() -> dict:
+    caches = {"count": count_cache, "signal": signal_cache}
+    return {"fp_vault_cache_lookups_total": metrics.family(
+        "counter", "Vault cache lookups by result", ("cache", "result"),
+        [((name, result), getattr(c, result + "s")) for name, c in caches.items() for result in ("hit", "miss")])}
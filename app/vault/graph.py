@@ -0,0 +1,125 @@
+# app/vault/graph.py
+"""Identity graph: which vault identities have appeared on the same orders.
+
+- Edges: every scored order records co-occurrence edges between its
+  identities (vault keys of the IDENTITY_GRAPH_KINDS kinds). record_edges
+  writes them in one upsert in the scoring transaction.
+- Components: kept as a persisted union-find in identity_node. Every node
+  stores its component root directly, and roots store the component size.
+  The serial apply_links task merges new edges by size: the smaller
+  component is relabelled into the larger, so a node is relabelled at
+  most O(log n) times.
+- Lookup: cluster_sizes runs one indexed join per batch. "How many
+  distinct identities share a cluster with this order" is the sum of the
+  sizes of the distinct components its identities belong to. Identities
+  not yet in the graph count 1 each. This already includes the order's
+  own links, before apply_links has merged them.
+
+IP addresses are left out of the graph by default. Carrier NAT and
+corporate proxies would fuse unrelated customers into one giant component.
+"""
+from itertools import combinations
+from typing import Dict, Iterable, List, Set
+
+from sqlalchemy import case, func, select, tuple_, update
+from sqlalchemy.orm import Session, aliased
+
+from ..database import dialect_insert
+from ..models import IdentityEdge, IdentityNode
+from .repository import IdentityKey
+
+APPLY_BATCH = 5000
+
+def order_edges(keys: Iterable[IdentityKey], kinds: Iterable[str]) -> Set[tuple]:
+    """Canonical (a, b) pairs between an order's graph identities."""
+    kinds = set(kinds)
+    nodes = sorted({k for k in keys if k[0] in kinds and k[1]})
+    return set(combinations(nodes, 2))
+
+def record_edges(db: Session, per_order: List[Iterable[IdentityKey]], kinds: Iterable[str]) -> int:
+    """Upsert the co-occurrence edges of many orders in one statement; no commit."""
+    kinds = tuple(kinds)
+    counts: Dict[tuple, int] = {}
+    for keys in per_order:
+        for edge in order_edges(keys, kinds):
+            counts[edge] = counts.get(edge, 0) + 1
+    if not counts:
+        return 0
+    ins = dialect_insert(db)(IdentityEdge).values([
+        {"a_kind": a[0], "a_hash": a[1], "b_kind": b[0], "b_hash": b[1], "seen_count": n, "applied": False}
+        for (a, b), n in sorted(counts.items())
+    ])
+    db.execute(ins.on_conflict_do_update(
+        index_elements=["a_kind", "a_hash", "b_kind", "b_hash"],
+        set_={"seen_count": IdentityEdge.seen_count + ins.excluded.seen_count,
+              "last_seen": func.now()},
+    ))
+    return len(counts)
+
+def cluster_sizes(db: Session, per_order: List[Iterable[IdentityKey]], kinds: Iterable[str]) -> List[int]:
+    """Distinct identities in the union of each order's components (one query)."""
+    kinds = set(kinds)
+    per_order = [{k for k in keys if k[0] in kinds and k[1]} for keys in per_order]
+    wanted = set().union(*per_order) if per_order else set()
+    if not wanted:
+        return [len(keys) for keys in per_order]
+    root = aliased(IdentityNode)
+    rows = db.execute(
+        select(IdentityNode.kind, IdentityNode.hash, IdentityNode.root, root.size)
+        .join(root, root.id == IdentityNode.root)
+        .where(tuple_(IdentityNode.kind, IdentityNode.hash).in_(sorted(wanted)))
+    ).all()
+    component = {(kind, hashed): (rid, size) for kind, hashed, rid, size in rows}
+    out = []
+    for keys in per_order:
+        roots = {component[k] for k in keys if k in component}
+        out.append(sum(size for _, size in roots) + sum(1 for k in keys if k not in component))
+    return out
+
+def apply_links(db: Session, limit: int = APPLY_BATCH) -> int:
+    """Merge up to `limit` unapplied edges into the union-find; no commit.
+
+    Must not run concurrently with itself (the Celery task holds a lock).
+    """
+    edges = db.execute(
+        select(IdentityEdge.id, IdentityEdge.a_kind, IdentityEdge.a_hash, IdentityEdge.b_kind, IdentityEdge.b_hash)
+        .where(IdentityEdge.applied.is_(False)).order_by(IdentityEdge.id).limit(limit)
+    ).all()
+    if not edges:
+        return 0
+    keys = sorted({(r.a_kind, r.a_hash) for r in edges} | {(r.b_kind, r.b_hash) for r in edges})
+    ins = dialect_insert(db)(IdentityNode).values([{"kind": k, "hash": h} for k, h in keys])
+    db.execute(ins.on_conflict_do_nothing(index_elements=["kind", "hash"]))
+    db.execute(update(IdentityNode).where(IdentityNode.root.is_(None)).values(root=IdentityNode.id))
+
+    node_root = {(k, h): r for k, h, r in db.execute(
+        select(IdentityNode.kind, IdentityNode.hash, IdentityNode.root)
+        .where(tuple_(IdentityNode.kind, IdentityNode.hash).in_(keys))
+    ).all()}
+    size = dict(db.execute(select(IdentityNode.id, IdentityNode.size)
+                           .where(IdentityNode.id.in_(set(node_root.values())))).all())
+
+    # in-memory union-find over the roots touched by this batch
+    parent: Dict[int, int] = {}
+    def find(r: int) -> int:
+        while r in parent:
+            r = parent[r]
+        return r
+    for e in edges:
+        ra, rb = find(node_root[(e.a_kind, e.a_hash)]), find(node_root[(e.b_kind, e.b_hash)])
+        if ra == rb:
+            continue
+        if size[ra] < size[rb]:
+            ra, rb = rb, ra
+        parent[rb] = ra  # smaller component joins the larger
+        size[ra] += size[rb]
+
+    if parent:
+        relabel = {small: find(small) for small in parent}
+        db.execute(update(IdentityNode).where(IdentityNode.root.in_(relabel))
+                   .values(root=case(relabel, value=IdentityNode.root)))
+        survivors = {r: size[r] for r in set(relabel.values())}
+        db.execute(update(IdentityNode).where(IdentityNode.id.in_(survivors))
+                   .values(size=case(survivors, value=IdentityNode.id)))
+    db.execute(update(IdentityEdge).where(IdentityEdge.id.in_([e.id for e in edges])).values(applied=True))
+    return len(edges)
@@ -0,0 +1,109 @@
+# app/vault/keys.py
+"""Deterministic, keyed vault lookup keys.
+
+    key = "v<version>:" + hex(HMAC-SHA256(pepper[version], normalized value))
+
+VAULT_PEPPER keys the current VAULT_KEY_VERSION. Older peppers stay readable
+via VAULT_PREVIOUS_PEPPERS ({version: pepper}). Version 0 is the unprefixed
+sha256(pepper + value) scheme used before this module; it is read while
+VAULT_READ_LEGACY_KEYS is on. New counts are always written under the
+current version. Readers sum a value's counts across read_keys() so rotating
+the pepper does not reset them.
+
+Hashing is memoized per process on the normalized value (an identifier
+typically repeats across orders). The HMAC inner/outer pads
+are computed once per pepper and copied per call.
+
+app/vault/hasher.py (Argon2id, salted) is for storage at rest, not lookups.
+"""
+import hashlib
+import hmac
+import ipaddress
+import threading
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from ..config import settings
+
+LEGACY_VERSION = 0
+LEGACY_PEPPER = "fraudpop_pepper_v1"
+
+# ---------- normalization ----------
+def _normalize_ip(value: str) -> str:
+    try:
+        return ipaddress.ip_address(value.strip()).compressed
+    except ValueError:
+        return value.strip()
+
+NORMALIZERS = {
+    "email": lambda v: v.strip().lower(),
+    "ip": _normalize_ip,
+    "device": lambda v: v.strip(),
+}
+
+def normalize(kind: Optional[str], value: str) -> str:
+    fn = NORMALIZERS.get(kind)
+    return fn(value) if fn else value
+
+# ---------- key derivation ----------
+class KeyDeriver:
+    """HMAC lookup keys for one pepper set: write under `current`, read all versions."""
+
+    def __init__(self, peppers: Dict[int, str], current: int, read_legacy: bool = True,
+                 memo_size: int = 100_000):
+        if current not in peppers:
+            raise ValueError(f"No pepper for current vault key version {current}")
+        if current == LEGACY_VERSION:
+            raise ValueError("Vault key version 0 is reserved for legacy sha256 keys")
+        self.current = current
+        self._macs = {v: hmac.new(p.encode("utf-8"), digestmod=hashlib.sha256)
+                      for v, p in peppers.items() if v != LEGACY_VERSION}
+        self.read_versions: Tuple[int, ...] = (current,) + tuple(
+            sorted((v for v in self._macs if v != current), reverse=True)
+        ) + ((LEGACY_VERSION,) if read_legacy else ())
+        self._digest = lru_cache(maxsize=memo_size)(self._digest_uncached)
+
+    def _digest_uncached(self, version: int, value: str) -> str:
+        if version == LEGACY_VERSION:
+            return hashlib.sha256((LEGACY_PEPPER + value).encode("utf-8")).hexdigest()
+        mac = self._macs[version].copy()
+        mac.update(value.encode("utf-8"))
+        return f"v{version}:{mac.hexdigest()}"
+
+    def key(self, value: str, kind: Optional[str] = None) -> str:
+        """The key new counts for this identifier are written under."""
+        return self._digest(self.current, normalize(kind, value))
+
+    def keys(self, values: Iterable[str], kind: Optional[str] = None) -> List[str]:
+        return [self._digest(self.current, normalize(kind, v)) for v in values]
+
+    def read_keys(self, value: str, kind: Optional[str] = None) -> Tuple[str, ...]:
+        """Every key this identifier may have counts under, current version first."""
+        value = normalize(kind, value)
+        return tuple(self._digest(v, value) for v in self.read_versions)
+
+    def memo_stats(self) -> dict:
+        info = self._digest.cache_info()
+        return {"hits": info.hits, "misses": info.misses, "size": info.currsize}
+
+_deriver: Optional[KeyDeriver] = None
+_lock = threading.Lock()
+
+def get_key_deriver() -> KeyDeriver:
+    global _deriver
+    if _deriver is None:
+        with _lock:
+            if _deriver is None:
+                peppers = {int(v): p for v, p in settings.VAULT_PREVIOUS_PEPPERS.items()}
+                peppers[settings.VAULT_KEY_VERSION] = settings.VAULT_PEPPER
+                _deriver = KeyDeriver(peppers, settings.VAULT_KEY_VERSION,
+                                      read_legacy=settings.VAULT_READ_LEGACY_KEYS,
+                                      memo_size=settings.VAULT_KEY_MEMO_SIZE)
+    return _deriver
+
+# ---------- deterministic lookup key for velocity counting ----------
+def lookup_key(value: str, kind: Optional[str] = None) -> str:
+    return get_key_deriver().key(value, kind)
+
+def lookup_keys(values: Iterable[str], kind: Optional[str] = None) -> List[str]:
+    return get_key_deriver().keys(values, kind)
@@ -1,14 +1,189 @@
 # app/vault/repository.py
-from sqlalchemy import select, update
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import case, select, update, tuple_, func
 from sqlalchemy.orm import Session
+from ..database import dialect_insert
 from ..models import RiskIdentity
+from .bloom import get_vault_bloom
+from .cache import CountCache, SignalCache, count_cache, invalidate_after_commit, signal_cache, sync_caches
 
-def bump_identity(db: Session, kind: str, hashed: str):
-    row = db.execute(select(RiskIdentity).where(RiskIdentity.kind==kind,
-                                               RiskIdentity.hash==hashed)).scalar_one_or_none()
-    if row:
+IdentityKey = Tuple[str, str]  # (kind, hash)
+
+OUTCOMES = ("chargeback", "refund", "approved")
+
+def bump_identity(db: Session, kind: str, hashed: str) -> int:
+    """Count one sighting of an identity; returns its seen_count before this one."""
+    return increment_counts(db, {(kind, hashed): 1})[(kind, hashed)]
+
+def _fetch_counts(db: Session, keys: Iterable[IdentityKey]) -> Dict[IdentityKey, int]:
+    rows = db.execute(
+        select(RiskIdentity.kind, RiskIdentity.hash, RiskIdentity.seen_count)
+        .where(tuple_(RiskIdentity.kind, RiskIdentity.hash).in_(sorted(keys)))
+    ).all()
+    return {(kind, hashed): seen for kind, hashed, seen in rows}
+
+def lookup_counts(db: Session, keys: Iterable[IdentityKey]) -> Dict[IdentityKey, int]:
+    """Resolve seen_count for many (kind, hash) pairs in a single query.
+
+    Keys that are not in the vault are returned with a count of 0.
+    """
+    wanted = {k for k in keys if k[0] and k[1]}
+    if not wanted:
+        return {}
+    counts = dict.fromkeys(wanted, 0)
+    counts.update(_fetch_counts(db, wanted))
+    return counts
+
+def _probe(db: Session, keys: List[IdentityKey], fetch) -> Dict[IdentityKey, object]:
+    """fetch() only the keys the Bloom filter cannot rule out; absent keys are left out."""
+    bloom = get_vault_bloom()
+    if bloom is None:
+        return fetch(db, keys)
+    maybe, _ = bloom.split(keys)
+    found = fetch(db, maybe) if maybe else {}
+    bloom.record_probe(len(maybe), len(found))
+    return found
+
+def _bloom_add(keys: Iterable[IdentityKey]) -> None:
+    # before the write commits: a rollback only costs a false positive
+    bloom = get_vault_bloom()
+    if bloom is not None:
+        bloom.add_many(keys)
+
+def cached_lookup_counts(db: Session, keys: Iterable[IdentityKey],
+                         cache: Optional[CountCache] = None) -> Dict[IdentityKey, int]:
+    """lookup_counts() fronted by the per-process count cache and the vault Bloom filter."""
+    wanted = {k for k in keys if k[0] and k[1]}
+    if cache is None:
+        # out of step with other processes' writes: a throwaway cache makes this a plain lookup
+        cache = count_cache if sync_caches() else CountCache(maxsize=len(wanted) + 1)
+    counts, missing = cache.get_many(wanted)
+    if missing:
+        fetched = dict.fromkeys(missing, 0)
+        fetched.update(_probe(db, missing, _fetch_counts))
+        cache.put_many(fetched)
+        counts.update(fetched)
+    return counts
+
+def add_counts(db: Session, increments: Dict[IdentityKey, int]) -> None:
+    """Fold rolled-up increments into risk_identity.seen_count in one statement."""
+    if not increments:
+        return
+    _bloom_add(increments)
+    ins = dialect_insert(db)(RiskIdentity).values(
+        [{"kind": k, "hash": h, "seen_count": n} for (k, h), n in sorted(increments.items())]
+    )
+    db.execute(ins.on_conflict_do_update(
+        index_elements=["kind", "hash"],
+        set_={"seen_count": RiskIdentity.seen_count + ins.excluded.seen_count,
+              "last_seen": func.now()},
+    ))
+    invalidate_after_commit(db, increments)
+
+def increment_counts(db: Session, increments: Dict[IdentityKey, int]) -> Dict[IdentityKey, int]:
+    """Add increments to seen_count and return the counts from before, in one statement.
+
+    INSERT ... ON CONFLICT (kind, hash) DO UPDATE ... RETURNING, so concurrent
+    workers never race on the unique constraint. Rows are written in key
+    order so overlapping batches lock them in the same order.
+    """
+    if not increments:
+        return {}
+    _bloom_add(increments)
+    ins = dialect_insert(db)(RiskIdentity).values(
+        [{"kind": k, "hash": h, "seen_count": n} for (k, h), n in sorted(increments.items())]
+    )
+    rows = db.execute(ins.on_conflict_do_update(
+        index_elements=["kind", "hash"],
+        set_={"seen_count": RiskIdentity.seen_count + ins.excluded.seen_count,
+              "last_seen": func.now()},
+    ).returning(RiskIdentity.kind, RiskIdentity.hash, RiskIdentity.seen_count)).all()
+    invalidate_after_commit(db, increments)
+    return {(k, h): seen - increments[(k, h)] for k, h, seen in rows}
+
+def observe_identities(db: Session, per_order: List[Iterable[IdentityKey]]) -> List[Dict[IdentityKey, int]]:
+    """Count each order's identities once; return what each order saw before it.
+
+    The whole batch is one increment_counts() statement. Orders are credited
+    in list order, so an identity repeated within the batch reads as it
+    would have if the orders were processed one at a time.
+    """
+    per_order = [set(keys) for keys in per_order]
+    running = increment_counts(db, Counter(k for keys in per_order for k in keys))
+    out = []
+    for keys in per_order:
+        out.append({k: running[k] for k in keys})
+        for k in keys:
+            running[k] += 1
+    return out
+
+def release_counts(db: Session, decrements: Dict[IdentityKey, int]) -> None:
+    """Undo increment_counts() for sightings that turned out to be duplicates."""
+    by_amount: Dict[int, List[IdentityKey]] = {}
+    for key, n in decrements.items():
+        by_amount.setdefault(n, []).append(key)
+    for n, keys in sorted(by_amount.items()):
         db.execute(update(RiskIdentity)
-                   .where(RiskIdentity.id==row.id)
-                   .values(seen_count=row.seen_count+1))
-    else:
-        db.add(RiskIdentity(kind=kind, hash=hashed, seen_count=1))
+                   .where(tuple_(RiskIdentity.kind, RiskIdentity.hash).in_(sorted(keys)))
+                   .values(seen_count=RiskIdentity.seen_count - n))
+    invalidate_after_commit(db, decrements)
+
+# ---------- outcome counters (/v1/vault/observe, /v1/vault/query) ----------
+def record_observations(db: Session, observations: Dict[IdentityKey, Dict[str, int]]) -> None:
+    """Add sightings ("seen") and outcome counts for many identities in one upsert.
+
+    last_seen only moves for sightings, not for outcomes reported later.
+    """
+    if not observations:
+        return
+    _bloom_add(observations)
+    columns = ["seen_count"] + [f"{o}_count" for o in OUTCOMES]
+    ins = dialect_insert(db)(RiskIdentity).values([
+        {"kind": k, "hash": h, "seen_count": c.get("seen", 0),
+         **{f"{o}_count": c.get(o, 0) for o in OUTCOMES}}
+        for (k, h), c in sorted(observations.items())
+    ])
+    set_ = {col: getattr(RiskIdentity, col) + getattr(ins.excluded, col) for col in columns}
+    set_["last_seen"] = case((ins.excluded.seen_count > 0, func.now()), else_=RiskIdentity.last_seen)
+    db.execute(ins.on_conflict_do_update(index_elements=["kind", "hash"], set_=set_))
+    invalidate_after_commit(db, observations)
+
+def _empty_signal() -> dict:
+    return {"seen_count": 0, "outcomes": dict.fromkeys(OUTCOMES, 0), "last_seen": None}
+
+def _fetch_signals(db: Session, keys: Iterable[IdentityKey]) -> Dict[IdentityKey, dict]:
+    rows = db.execute(
+        select(RiskIdentity.kind, RiskIdentity.hash, RiskIdentity.seen_count, RiskIdentity.last_seen,
+               *(getattr(RiskIdentity, f"{o}_count") for o in OUTCOMES))
+        .where(tuple_(RiskIdentity.kind, RiskIdentity.hash).in_(sorted(keys)))
+    ).all()
+    return {(kind, hashed): {"seen_count": seen, "outcomes": dict(zip(OUTCOMES, outcomes)),
+                             "last_seen": last_seen}
+            for kind, hashed, seen, last_seen, *outcomes in rows}
+
+def lookup_signals(db: Session, keys: Iterable[IdentityKey]) -> Dict[IdentityKey, dict]:
+    """seen_count, outcome counts and last_seen for many keys in one query.
+
+    Keys that are not in the vault map to zero counts.
+    """
+    wanted = {k for k in keys if k[0] and k[1]}
+    if not wanted:
+        return {}
+    out = {k: _empty_signal() for k in wanted}
+    out.update(_fetch_signals(db, wanted))
+    return out
+
+def cached_lookup_signals(db: Session, keys: Iterable[IdentityKey],
+                          cache: Optional[SignalCache] = None) -> Dict[IdentityKey, dict]:
+    """lookup_signals() fronted by the per-process signal cache (misses cached too) and the Bloom filter."""
+    wanted = {k for k in keys if k[0] and k[1]}
+    if cache is None:
+        cache = signal_cache if sync_caches() else SignalCache(maxsize=len(wanted) + 1)
+    found, missing = cache.get_many(wanted)
+    if missing:
+        fetched = {k: _empty_signal() for k in missing}
+        fetched.update(_probe(db, missing, _fetch_signals))
+        cache.put_many(fetched)
+        found.update(fetched)
+    return found
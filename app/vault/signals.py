@@ -0,0 +1,68 @@
+# app/vault/signals.py
+"""Vault observe/query for /v1/vault: identifiers in, outcome-aware signals out.
+
+Identifiers are given as {kind: raw value} (kinds: email, ip, device) and
+are keyed with app/vault/keys. An observation without an outcome counts
+as one sighting. One with an outcome (e.g. {"chargeback": 1}) only adds
+to those counters, so the nightly chargeback push does not inflate
+seen_count. Queries sum every readable key version, as scoring does.
+"""
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from .keys import NORMALIZERS, get_key_deriver
+from .repository import OUTCOMES, IdentityKey, cached_lookup_signals, record_observations
+
+KINDS = tuple(NORMALIZERS)
+REFUNDS_AMBER = 2
+
+def _identities(ids: Dict[str, Optional[str]]) -> Dict[str, str]:
+    unknown = set(ids) - set(KINDS)
+    if unknown:
+        raise ValueError(f"Unknown identifier kind(s): {', '.join(sorted(unknown))}")
+    return {kind: value for kind, value in ids.items() if value}
+
+def observe_many(db: Session, observations: List[Tuple[Dict[str, Optional[str]], Dict[str, int]]]) -> int:
+    """Record (ids, outcome) observations in one upsert; returns identities touched. No commit."""
+    deriver = get_key_deriver()
+    totals: Dict[IdentityKey, Counter] = {}
+    for ids, outcome in observations:
+        unknown = set(outcome) - set(OUTCOMES)
+        if unknown:
+            raise ValueError(f"Unknown outcome(s): {', '.join(sorted(unknown))}")
+        increment = outcome or {"seen": 1}
+        for kind, value in _identities(ids).items():
+            totals.setdefault((kind, deriver.key(value, kind)), Counter()).update(increment)
+    record_observations(db, totals)
+    return len(totals)
+
+def query_many(db: Session, queries: List[Dict[str, Optional[str]]]) -> List[Dict[str, dict]]:
+    """{kind: signal} per query, resolving every identifier in one (cached) lookup."""
+    deriver = get_key_deriver()
+    per_query = [{kind: [(kind, k) for k in deriver.read_keys(value, kind)]
+                  for kind, value in _identities(ids).items()} for ids in queries]
+    found = cached_lookup_signals(db, {k for q in per_query for ks in q.values() for k in ks})
+    out = []
+    for q in per_query:
+        signals = {}
+        for kind, keys in q.items():
+            rows = [found[k] for k in keys]
+            seen = [r["last_seen"] for r in rows if r["last_seen"] is not None]
+            signals[kind] = {
+                "seen_count": sum(r["seen_count"] for r in rows),
+                "outcomes": {o: sum(r["outcomes"][o] for r in rows) for o in OUTCOMES},
+                "last_seen": max(seen) if seen else None,
+            }
+        out.append(signals)
+    return out
+
+def vault_verdict(signals: Dict[str, dict]) -> Tuple[str, List[str]]:
+    """red on any chargeback, amber on repeated refunds, otherwise green."""
+    reasons = [f"Chargeback on file ({kind})" for kind, s in signals.items() if s["outcomes"]["chargeback"]]
+    if reasons:
+        return "red", reasons
+    reasons = [f"Repeated refunds ({kind})" for kind, s in signals.items()
+               if s["outcomes"]["refund"] >= REFUNDS_AMBER]
+    return ("amber", reasons) if reasons else ("green", [])
@@ -0,0 +1,130 @@
+# app/vault/velocity.py
+"""Sliding-window velocity counters kept in Redis.
+
+Each identity gets one INCR-ed key per time bucket; a window's count is the
+sum of the buckets it spans, so precision is one bucket (1 min for 10m, 1 day
+for 30d). Keys expire on their own once they fall out of the widest window.
+
+`risk_identity.seen_count` is incremented in Postgres by the scoring
+transaction itself (repository.observe_identities), not from here.
+
+The observe script builds the bucket keys from the prefix and identities
+it is given, instead of receiving them in KEYS. So this needs a single
+Redis, not Redis Cluster or a proxy that routes commands by key, like
+utils/fair_queue.py.
+"""
+import itertools
+import json
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import redis
+
+from .repository import IdentityKey
+from ..utils.redis_client import evalsha_pipelined, get_async_redis, get_redis, lua_script
+
+# (name, window seconds, bucket seconds)
+WINDOWS: Tuple[Tuple[str, int, int], ...] = (
+    ("10m", 600, 60),
+    ("1h", 3600, 300),
+    ("24h", 86400, 3600),
+    ("30d", 30 * 86400, 86400),
+)
+
+PREFIX = "fp:vel:"
+ORDER_MARKER_TTL = 7 * 86400
+
+# KEYS[1]: per-order marker
+# ARGV: now, marker ttl, prefix, n windows, (bucket secs, n buckets)*, identity*
+# Reads the current window counts (before this order), then increments.
+# A replayed order (Celery retry) gets the result of its first call back.
+_OBSERVE = lua_script("""
+local prev = redis.call('GET', KEYS[1])
+if prev then return prev end
+local now = tonumber(ARGV[1])
+local prefix = ARGV[3]
+local nwin = tonumber(ARGV[4])
+local wins = {}
+local i = 5
+for w = 1, nwin do
+  wins[w] = {tonumber(ARGV[i]), tonumber(ARGV[i + 1])}
+  i = i + 2
+end
+local out = {}
+while i <= #ARGV do
+  local ident = ARGV[i]
+  i = i + 1
+  local counts = {}
+  for w = 1, nwin do
+    local size, n = wins[w][1], wins[w][2]
+    local cur = math.floor(now / size)
+    local base = prefix .. ident .. ':' .. size .. ':'
+    local keys = {}
+    for b = cur - n + 1, cur do keys[#keys + 1] = base .. b end
+    local total = 0
+    for _, v in ipairs(redis.call('MGET', unpack(keys))) do
+      if v then total = total + tonumber(v) end
+    end
+    counts[w] = total
+    redis.call('INCR', base .. cur)
+    redis.call('EXPIRE', base .. cur, size * (n + 1))
+  end
+  out[#out + 1] = counts
+end
+local encoded = cjson.encode(out)
+redis.call('SET', KEYS[1], encoded, 'EX', tonumber(ARGV[2]))
+return encoded
+""")
+
+def _ident(key: IdentityKey) -> str:
+    return f"{key[0]}:{key[1]}"
+
+def empty_fields(prefixes: Iterable[str]) -> Dict[str, int]:
+    """repeat_*_{window} fields initialised to 0."""
+    return {f"{p}_{name}": 0 for p in prefixes for name, _, _ in WINDOWS}
+
+def observe(order_ref: str, keys: Iterable[IdentityKey], now: Optional[float] = None,
+            client: Optional[redis.Redis] = None) -> Dict[IdentityKey, Dict[str, int]]:
+    """Count one order against every identity and return the prior window counts.
+
+    One atomic round trip per order; safe to call again for the same order.
+    """
+    return observe_many([(order_ref, list(keys))], now=now, client=client)[0]
+
+def observe_many(orders: List[Tuple[str, List[IdentityKey]]], now: Optional[float] = None,
+                 client: Optional[redis.Redis] = None) -> List[Dict[IdentityKey, Dict[str, int]]]:
+    """observe() for a batch of (order_ref, keys): one pipelined round trip.
+
+    Each order is still its own atomic script call.
+    """
+    r = client or get_redis()
+    head = [int(now if now is not None else time.time()), ORDER_MARKER_TTL, PREFIX, len(WINDOWS)]
+    for _, span, bucket in WINDOWS:
+        head += [bucket, span // bucket]
+    calls = [([f"{PREFIX}order:{order_ref}"], [*head, *(_ident(k) for k in keys)])
+             for order_ref, keys in orders if keys]
+    replies = iter(evalsha_pipelined(r, _OBSERVE, calls) if calls else [])
+    out: List[Dict[IdentityKey, Dict[str, int]]] = []
+    for _, keys in orders:
+        if not keys:
+            out.append({})
+            continue
+        rows = json.loads(next(replies))
+        out.append({k: {name: int(c) for (name, _, _), c in zip(WINDOWS, row)}
+                    for k, row in zip(keys, rows)})
+    return out
+
+async def peek(keys: Iterable[IdentityKey], now: Optional[float] = None,
+               client=None) -> Dict[IdentityKey, Dict[str, int]]:
+    """Current window counts without counting anything (checkout scoring); one MGET."""
+    now = int(now if now is not None else time.time())
+    layout = [(k, name, [f"{PREFIX}{_ident(k)}:{bucket}:{b}"
+                         for b in range(now // bucket - span // bucket + 1, now // bucket + 1)])
+              for k in keys for name, span, bucket in WINDOWS]
+    if not layout:
+        return {}
+    values = iter(await (client or get_async_redis()).mget([b for _, _, buckets in layout for b in buckets]))
+    out: Dict[IdentityKey, Dict[str, int]] = {}
+    for k, name, buckets in layout:
+        out.setdefault(k, {})[name] = sum(int(v) for v in itertools.islice(values, len(buckets)) if v)
+    return out
@@ -0,0 +1,106 @@
+"""Legacy evidence_log rows vs compact content-addressed evidence.
+
+    python -m bench.evidence --orders 20000 --batch 200
+
+Writes the same scored orders both ways into throwaway SQLite files and
+prints payload bytes, rows and statements per order, and on-disk size. The
+SQLite file size is only a proxy for Postgres heap+TOAST, but the payload
+byte and row counts carry over directly.
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import create_engine, event, insert
+from sqlalchemy.orm import Session
+
+from app.database import Base
+from app.evidence import codec
+from app.evidence.repository import write_evidence
+from app.models import EvidenceBlob, EvidenceLog, OrderEvidence, ReasonText
+from app.rules.ruleset import DEFINITIONS_DIR
+from app.rules.engine import compile_ruleset
+from bench.rules import sample_orders
+
+def scored_orders(n: int, seed: int = 11):
+    with open(f"{DEFINITIONS_DIR}/default.json") as fh:
+        ruleset = compile_ruleset(json.load(fh))
+    rnd = random.Random(seed)
+    shops = [f"shop{i}.myshopify.com" for i in range(20)]
+    out = []
+    for i, o in enumerate(sample_orders(n, seed)):
+        data = {"shop_id": rnd.choice(shops), "order_id": str(10**12 + i), "currency": "USD",
+                "country": o["billing_country"], "device_id": None,
+                "repeat_ip": 0, "repeat_device": 0, **o}
+        for field in codec.INPUT_FIELDS_V1:
+            data.setdefault(field, 0)
+        score, reasons = ruleset.evaluate(data)
+        out.append((data, {"rules_score": score, "final_score": score,
+                           "verdict": ruleset.verdict(score), "reasons": reasons}))
+    return out
+
+def _run(path: str, scored, batch: int, write) -> dict:
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    statements = 0
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _count(*_):
+        nonlocal statements
+        statements += 1
+
+    started = time.perf_counter()
+    with Session(engine) as db:
+        for i in range(0, len(scored), batch):
+            write(db, scored[i:i + batch])
+            db.commit()
+    seconds = time.perf_counter() - started
+    with engine.connect() as conn:
+        conn.exec_driver_sql("VACUUM")
+        pages = conn.exec_driver_sql("PRAGMA page_count").scalar()
+        page_size = conn.exec_driver_sql("PRAGMA page_size").scalar()
+    engine.dispose()
+    return {"statements_per_order": round(statements / len(scored), 3),
+            "file_bytes": pages * page_size, "write_seconds": round(seconds, 3)}
+
+def _write_legacy(db, chunk):
+    # what save_results did before app/evidence: two JSON rows per order
+    db.execute(insert(EvidenceLog).values(
+        [{"order_id": d["order_id"], "key": k, "value": v}
+         for d, r in chunk for k, v in (("input", d), ("scores", r))]))
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--orders", type=int, default=20_000)
+    ap.add_argument("--batch", type=int, default=200)
+    args = ap.parse_args()
+
+    scored = scored_orders(args.orders)
+    legacy_payload = sum(len(json.dumps(d)) + len(json.dumps(r)) for d, r in scored)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy = _run(os.path.join(tmp, "legacy.db"), scored, args.batch, _write_legacy)
+        compact_path = os.path.join(tmp, "compact.db")
+        compact = _run(compact_path, scored, args.batch, write_evidence)
+        with Session(create_engine(f"sqlite:///{compact_path}")) as db:
+            blobs = db.query(EvidenceBlob).count()
+            blob_bytes = sum(len(b) for (b,) in db.query(EvidenceBlob.data))
+            reasons = db.query(ReasonText).count()
+            orders = db.query(OrderEvidence).count()
+
+    compact_payload = blob_bytes + orders * 64  # two sha256 references per order
+    legacy.update(rows=2 * len(scored), payload_bytes=legacy_payload)
+    compact.update(rows=orders + blobs + reasons, blobs=blobs, reasons=reasons, payload_bytes=compact_payload)
+    print(json.dumps({
+        "orders": len(scored),
+        "legacy": legacy,
+        "compact": compact,
+        "payload_ratio": round(compact_payload / legacy_payload, 3),
+        "file_ratio": round(compact["file_bytes"] / legacy["file_bytes"], 3),
+    }, indent=2))
+
+if __name__ == "__main__":
+    main()
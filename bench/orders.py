@@ -0,0 +1,191 @@
+"""Seeded synthetic Shopify orders/create payloads.
+
+    from bench.orders import OrderGenerator
+    gen = OrderGenerator(seed=7)
+    payload = gen.order()                     # dict shaped like the webhook body
+    raw, headers = gen.signed(payload, secret)
+
+Shape and distributions, roughly what a mid-size store sees:
+- customers: popularity is Zipf-like, so a few customers order often and
+  most order once. Each customer has one email, usually one device, and a
+  home IP. A share of checkouts comes from shared carrier/corporate NAT IPs.
+- rings: a small share of orders comes from fraud rings that reuse a few
+  devices and IPs across many throwaway emails.
+- line items: 1-6 products per order from a catalogue with lognormal prices,
+  mostly quantity 1. Totals include shipping and tax.
+- addresses: weighted countries. Billing differs from shipping on ~8% of
+  orders (gifts, forwarders), and far more often for rings.
+
+`python -m bench.orders --orders 3 --seed 7` prints sample payloads.
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import random
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate
+from typing import Dict, Iterator, List, Tuple
+
+COUNTRIES = [  # code, weight, currency, (city, province, zip) samples
+    ("US", 55, "USD", [("Austin", "TX", "78701"), ("Brooklyn", "NY", "11201"), ("Denver", "CO", "80202")]),
+    ("CA", 10, "CAD", [("Toronto", "ON", "M5V 2T6"), ("Vancouver", "BC", "V6B 1A1")]),
+    ("GB", 10, "GBP", [("London", "", "SW1A 1AA"), ("Leeds", "", "LS1 4AP")]),
+    ("DE", 8, "EUR", [("Berlin", "", "10115"), ("Munich", "", "80331")]),
+    ("AU", 7, "AUD", [("Sydney", "NSW", "2000"), ("Melbourne", "VIC", "3000")]),
+    ("FR", 5, "EUR", [("Paris", "", "75001"), ("Lyon", "", "69001")]),
+    ("NG", 3, "USD", [("Lagos", "LA", "100001")]),
+    ("RU", 2, "USD", [("Moscow", "", "101000")]),
+]
+EMAIL_DOMAINS = [("gmail.com", 45), ("yahoo.com", 12), ("outlook.com", 12), ("icloud.com", 10),
+                 ("proton.me", 3), ("mail.ru", 2), ("qq.com", 2), ("example.net", 14)]
+FIRST = ["Alex", "Sam", "Jordan", "Taylor", "Morgan", "Casey", "Riley", "Jamie", "Avery", "Quinn"]
+LAST = ["Smith", "Garcia", "Chen", "Müller", "Dubois", "Okafor", "Ivanova", "Brown", "Khan", "Silva"]
+
+
+def _weighted(rnd: random.Random, items):
+    return rnd.choices([i[0] for i in items], weights=[i[1] for i in items])[0]
+
+
+class OrderGenerator:
+    def __init__(self, seed: int = 7, customers: int = 50_000, shops: int = 25, products: int = 400,
+                 zipf: float = 0.7, ring_share: float = 0.02, nat_share: float = 0.15,
+                 start: datetime = datetime(2025, 1, 1, tzinfo=timezone.utc), orders_per_hour: float = 600.0,
+                 first_id: int = 5_000_000_000):
+        self.rnd = random.Random(seed)
+        rnd = self.rnd
+        self.shops = [f"bench-{i:03d}.myshopify.com" for i in range(shops)]
+        self.shop_weights = list(accumulate(1 / (i + 1) for i in range(shops)))  # a few large shops
+        self.products = [(1_000_000 + i, f"Product {i}", round(min(2000.0, rnd.lognormvariate(3.4, 0.8)), 2))
+                         for i in range(products)]
+        self.customer_weights = list(accumulate(1 / (i + 1) ** zipf for i in range(customers)))
+        self.customers = [self._customer(i) for i in range(customers)]
+        self.nat_ips = [f"100.64.{rnd.randrange(256)}.{rnd.randrange(1, 255)}" for _ in range(50)]
+        self.rings = [{"devices": [f"ring{r}-dev{d}" for d in range(rnd.randint(1, 3))],
+                       "ips": [f"45.{rnd.randrange(256)}.{rnd.randrange(256)}.{rnd.randrange(1, 255)}"
+                               for _ in range(rnd.randint(1, 4))]} for r in range(8)]
+        self.ring_share = ring_share
+        self.nat_share = nat_share
+        self.now = start
+        self.gap = 3600.0 / orders_per_hour
+        self.next_id = first_id
+
+    def _customer(self, i: int) -> dict:
+        rnd = self.rnd
+        first, last = rnd.choice(FIRST), rnd.choice(LAST)
+        country = _weighted(rnd, [(c, c[1]) for c in COUNTRIES])
+        return {
+            "id": 7_000_000 + i,
+            "first_name": first, "last_name": last,
+            "email": f"{first}.{last}{i}@{_weighted(rnd, EMAIL_DOMAINS)}".lower(),
+            "devices": [f"dev-{i}-{d}" for d in range(1 if rnd.random() < 0.8 else 2)],
+            "ip": f"{rnd.randrange(1, 224)}.{rnd.randrange(256)}.{rnd.randrange(256)}.{rnd.randrange(1, 255)}",
+            "country": country,
+            "address": rnd.choice(country[3]),
+            "street": f"{rnd.randint(1, 999)} {rnd.choice(['Main', 'High', 'Oak', 'Station'])} St",
+        }
+
+    def _address(self, c: dict, country=None, place=None) -> dict:
+        country = country or c["country"]
+        city, province, zip_ = place or c["address"]
+        return {"first_name": c["first_name"], "last_name": c["last_name"], "address1": c["street"],
+                "city": city, "province_code": province or None, "zip": zip_, "country_code": country[0],
+                "phone": None}
+
+    def order(self) -> dict:
+        rnd = self.rnd
+        self.now += timedelta(seconds=rnd.expovariate(1 / self.gap))
+        self.next_id += rnd.randint(1, 7)
+        shop = rnd.choices(self.shops, cum_weights=self.shop_weights)[0]
+        ring = rnd.choice(self.rings) if rnd.random() < self.ring_share else None
+        if ring:
+            c = self._customer(rnd.randrange(10**6, 10**7))  # throwaway identity
+            device, ip = rnd.choice(ring["devices"]), rnd.choice(ring["ips"])
+        else:
+            c = rnd.choices(self.customers, cum_weights=self.customer_weights)[0]
+            device = rnd.choice(c["devices"]) if rnd.random() < 0.9 else None  # no pixel on some checkouts
+            ip = rnd.choice(self.nat_ips) if rnd.random() < self.nat_share else c["ip"]
+
+        items = []
+        for n in range(min(6, 1 + int(rnd.expovariate(1.2)))):
+            pid, title, price = rnd.choice(self.products)
+            qty = 1 if rnd.random() < 0.85 else rnd.randint(2, 4)
+            items.append({"id": self.next_id * 10 + n, "product_id": pid, "variant_id": pid * 10 + rnd.randint(1, 4),
+                          "title": title, "quantity": qty, "price": f"{price:.2f}", "sku": f"SKU-{pid}",
+                          "requires_shipping": True, "taxable": True})
+        subtotal = sum(float(i["price"]) * i["quantity"] for i in items)
+        shipping = 0.0 if subtotal > 75 else rnd.choice([4.99, 7.99, 12.5])
+        tax = round(subtotal * (0.08 if c["country"][0] == "US" else 0.0), 2)
+
+        ship_to = self._address(c)
+        if ring or rnd.random() < 0.08:
+            other = rnd.choice(COUNTRIES) if ring or rnd.random() < 0.5 else c["country"]
+            ship_to = self._address(c, other, rnd.choice(other[3]))
+        gid = f"gid://shopify/Order/{self.next_id}"
+        return {
+            "id": self.next_id,
+            "admin_graphql_api_id": gid,
+            "name": f"#{self.next_id % 100000}",
+            "created_at": self.now.isoformat(),
+            "currency": c["country"][2],
+            "email": c["email"] if rnd.random() < 0.7 else c["email"].upper(),
+            "customer": {"id": c["id"], "email": c["email"], "first_name": c["first_name"],
+                         "last_name": c["last_name"]},
+            "total_price": f"{subtotal + shipping + tax:.2f}",
+            "subtotal_price": f"{subtotal:.2f}",
+            "total_tax": f"{tax:.2f}",
+            "shipping_lines": [{"title": "Standard", "price": f"{shipping:.2f}"}],
+            "line_items": items,
+            "billing_address": self._address(c),
+            "shipping_address": ship_to,
+            "client_details": {"browser_ip": ip, "user_agent": "Mozilla/5.0", "accept_language": "en-US"},
+            "note_attributes": [{"name": "fraudpop_device_id", "value": device}] if device else [],
+            "financial_status": "paid",
+            "_shop": shop,
+        }
+
+    def orders(self, n: int) -> Iterator[dict]:
+        for _ in range(n):
+            yield self.order()
+
+    @staticmethod
+    def signed(payload: dict, secret: str, event_id: str = None) -> Tuple[bytes, Dict[str, str]]:
+        """Raw body and the headers Shopify would send with it."""
+        shop = payload.get("_shop", "bench-000.myshopify.com")
+        raw = json.dumps({k: v for k, v in payload.items() if k != "_shop"}).encode()
+        digest = base64.b64encode(hmac.new(secret.encode(), raw, hashlib.sha256).digest()).decode()
+        return raw, {
+            "X-Shopify-Hmac-Sha256": digest,
+            "X-Shopify-Shop-Domain": shop,
+            "X-Shopify-Webhook-Id": event_id or f"bench-{payload['id']}",
+            "X-Shopify-Topic": "orders/create",
+            "Content-Type": "application/json",
+        }
+
+def repeat_profile(orders: List[dict]) -> dict:
+    """Share of orders whose email / device / IP appeared on an earlier order."""
+    seen = {"email": set(), "device": set(), "ip": set()}
+    repeats = dict.fromkeys(seen, 0)
+    for o in orders:
+        dev = next((a["value"] for a in o["note_attributes"] if a["name"] == "fraudpop_device_id"), None)
+        for kind, value in (("email", o["email"].lower()), ("device", dev), ("ip", o["client_details"]["browser_ip"])):
+            if value and value in seen[kind]:
+                repeats[kind] += 1
+            elif value:
+                seen[kind].add(value)
+    return {k: round(v / len(orders), 3) for k, v in repeats.items()} if orders else repeats
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--orders", type=int, default=3)
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--profile", type=int, default=0, help="also print repeat shares over N orders")
+    args = ap.parse_args()
+    gen = OrderGenerator(seed=args.seed)
+    print(json.dumps(list(gen.orders(args.orders)), indent=2))
+    if args.profile:
+        print(json.dumps(repeat_profile(list(OrderGenerator(seed=args.seed).orders(args.profile))), indent=2))
+
+if __name__ == "__main__":
+    main()
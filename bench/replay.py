@@ -0,0 +1,283 @@
+"""Replay signed orders/create webhooks against a running instance.
+
+    SHOPIFY_WEBHOOK_SECRET=... DATABASE_URL=postgresql://... \\
+        python -m bench.replay --url http://localhost:8000 --rate 50:400 --duration 300 --dup-ratio 0.05
+
+Payloads are synthetic (bench/orders.py, with fresh order ids per run) or
+recorded (--input file.jsonl). Each line of a recording is either an
+order payload or {"shop": ..., "payload": {...}}. Every request is signed
+with SHOPIFY_WEBHOOK_SECRET exactly as verify_shopify_hmac checks it.
+
+Load:
+- --rate R sends R webhooks/sec; --rate A:B ramps linearly from A to B
+  over --duration. Arrivals follow the schedule whether or not earlier
+  requests have answered (open loop). Latency is measured from the
+  scheduled send time, so a backed-up server is not hidden by a stalled
+  client. --max-in-flight bounds the connections.
+- --concurrency N instead runs N closed-loop senders back to back.
+
+A --dup-ratio share of sends repeat an earlier webhook id and body, like
+Shopify's retries. Every duplicate must come back {"dedup": true} and no
+original may. Time to verdict is the time from the admission response
+until the order's order_risk row shows up. It is measured by polling the
+database every --poll seconds, so that is its resolution. Orders that
+already had a row before the run are not tracked.
+
+The report is one JSON document (stdout, and --out).
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import httpx
+from sqlalchemy import column, create_engine, select, table
+
+from bench.orders import OrderGenerator
+
+ORDER_RISK = table("order_risk", column("order_id"))
+POLL_CHUNK = 1000
+
+def _pct(sorted_vals: List[float], p: float) -> Optional[float]:
+    if not sorted_vals:
+        return None
+    return sorted_vals[min(len(sorted_vals) - 1, int(len(sorted_vals) * p))]
+
+def _summary(samples: List[float], unit: str, scale: float) -> Dict[str, Optional[float]]:
+    s = sorted(samples)
+    return {f"p{int(p * 100)}_{unit}": (round(_pct(s, p) * scale, 3) if s else None) for p in (0.5, 0.95, 0.99)}
+
+def _sync_url(url: str) -> str:
+    for prefix in ("postgres://", "postgresql://"):
+        if url.startswith(prefix):
+            return "postgresql+psycopg://" + url[len(prefix):]
+    return url
+
+# ---------- sources ----------
+def synthetic(seed: int) -> Iterator[Tuple[str, dict]]:
+    # order ids from the clock, so reruns do not collide with earlier rows
+    gen = OrderGenerator(seed=seed, first_id=int(time.time() * 1000) * 1000)
+    while True:
+        p = gen.order()
+        yield p.pop("_shop"), p
+
+def recorded(path: str, shop: Optional[str]) -> List[Tuple[str, dict]]:
+    out = []
+    with open(path) as fh:
+        for line in fh:
+            if not line.strip():
+                continue
+            rec = json.loads(line)
+            if "payload" in rec:
+                out.append((rec.get("shop") or shop, rec["payload"]))
+            else:
+                out.append((rec.pop("_shop", None) or shop, rec))
+    return out
+
+def schedule(rate: str, duration: float) -> Iterator[float]:
+    """Send offsets (seconds from start) for a fixed "R" or ramping "A:B" rate."""
+    start, _, end = rate.partition(":")
+    a, b = float(start), float(end or start)
+    t = 0.0
+    while t < duration:
+        yield t
+        t += 1.0 / max(a + (b - a) * t / duration, 1e-6)
+
+# ---------- run ----------
+class Replay:
+    def __init__(self, url: str, secret: str, dup_ratio: float, rnd: random.Random):
+        self.url = url.rstrip("/") + "/webhooks/orders-create"
+        self.secret = secret
+        self.dup_ratio = dup_ratio
+        self.rnd = rnd
+        self.run_id = uuid.uuid4().hex[:8]
+        self.sent = 0
+        self.answered: List[Tuple[bytes, Dict[str, str]]] = []  # admitted originals, for duplicates
+        self.admission: List[float] = []
+        self.dedup_latency: List[float] = []
+        self.statuses: Dict[str, int] = {}
+        self.dups_sent = self.dups_deduped = self.false_dedups = 0
+        self.admitted: Dict[str, float] = {}  # order id -> admission response time (monotonic)
+
+    def next_request(self, source: Iterator[Tuple[str, dict]]) -> Optional[Tuple[bytes, Dict[str, str], bool, Optional[str]]]:
+        # only repeat webhooks that were already answered, as Shopify would
+        if self.answered and self.rnd.random() < self.dup_ratio:
+            raw, headers = self.rnd.choice(self.answered)
+            return raw, headers, True, None
+        try:
+            shop, payload = next(source)
+        except StopIteration:
+            return None
+        payload = dict(payload, _shop=shop or "replay.myshopify.com")
+        raw, headers = OrderGenerator.signed(payload, self.secret, event_id=f"replay-{self.run_id}-{self.sent}")
+        self.sent += 1
+        return raw, headers, False, str(payload["id"]) if payload.get("id") is not None else None
+
+    async def send(self, client: httpx.AsyncClient, req, scheduled: float) -> None:
+        raw, headers, duplicate, order_id = req
+        try:
+            r = await client.post(self.url, content=raw, headers=headers)
+            body = r.json() if r.headers.get("content-type", "").startswith("application/json") else {}
+            status = str(r.status_code)
+            if r.status_code == 200 and body.get("ok") is False:
+                status = "rejected"  # e.g. HMAC mismatch: check the secret
+        except httpx.HTTPError as e:
+            status, body = type(e).__name__, {}
+        done = time.monotonic()
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if status != "200":
+            return
+        deduped = bool(body.get("dedup"))
+        if duplicate:
+            self.dups_sent += 1
+            self.dups_deduped += deduped
+            self.dedup_latency.append(done - scheduled)
+            return
+        self.admission.append(done - scheduled)
+        if deduped:
+            self.false_dedups += 1
+            return
+        self.answered.append((raw, headers))
+        if order_id:
+            self.admitted[order_id] = done
+
+async def open_loop(replay: Replay, source, rate: str, duration: float, limit: int, max_in_flight: int) -> float:
+    async with httpx.AsyncClient(limits=httpx.Limits(max_connections=max_in_flight), timeout=30.0) as client:
+        tasks, started = [], time.monotonic()
+        for i, offset in enumerate(schedule(rate, duration)):
+            if i >= limit:
+                break
+            req = replay.next_request(source)
+            if req is None:
+                break
+            delay = started + offset - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(replay.send(client, req, started + offset)))
+        await asyncio.gather(*tasks)
+        return time.monotonic() - started
+
+async def closed_loop(replay: Replay, source, concurrency: int, duration: float, limit: int) -> float:
+    async with httpx.AsyncClient(limits=httpx.Limits(max_connections=concurrency), timeout=30.0) as client:
+        started = time.monotonic()
+        count = 0
+
+        async def sender():
+            nonlocal count
+            while time.monotonic() - started < duration and count < limit:
+                req = replay.next_request(source)
+                if req is None:
+                    return
+                count += 1
+                await replay.send(client, req, time.monotonic())
+        await asyncio.gather(*(sender() for _ in range(concurrency)))
+        return time.monotonic() - started
+
+def wait_for_verdicts(database_url: str, admitted: Dict[str, float], poll: float, timeout: float,
+                      preexisting: set) -> Tuple[List[float], int]:
+    """Seconds from admission to order_risk row for each tracked order; and how many never showed up."""
+    engine = create_engine(_sync_url(database_url))
+    pending = {oid: t for oid, t in admitted.items() if oid not in preexisting}
+    latencies: List[float] = []
+    deadline = time.monotonic() + timeout
+    with engine.connect() as conn:
+        while pending and time.monotonic() < deadline:
+            ids = list(pending)
+            now = time.monotonic()
+            for i in range(0, len(ids), POLL_CHUNK):
+                chunk = ids[i:i + POLL_CHUNK]
+                for oid in conn.execute(select(ORDER_RISK.c.order_id).where(ORDER_RISK.c.order_id.in_(chunk))).scalars():
+                    latencies.append(now - pending.pop(oid))
+            conn.rollback()  # fresh snapshot for the next poll
+            if pending:
+                time.sleep(poll)
+    engine.dispose()
+    return latencies, len(pending)
+
+def existing_orders(database_url: str, order_ids: List[str]) -> set:
+    engine = create_engine(_sync_url(database_url))
+    found = set()
+    with engine.connect() as conn:
+        for i in range(0, len(order_ids), POLL_CHUNK):
+            found.update(conn.execute(select(ORDER_RISK.c.order_id)
+                                      .where(ORDER_RISK.c.order_id.in_(order_ids[i:i + POLL_CHUNK]))).scalars())
+    engine.dispose()
+    return found
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--url", default="http://localhost:8000")
+    ap.add_argument("--input", help="recorded payloads (JSONL); synthetic orders if omitted")
+    ap.add_argument("--shop", help="shop domain for recorded payloads that do not name one")
+    ap.add_argument("--rate", default="50", help='webhooks/sec, or "A:B" to ramp from A to B')
+    ap.add_argument("--concurrency", type=int, help="closed loop with N senders instead of --rate")
+    ap.add_argument("--duration", type=float, default=60.0)
+    ap.add_argument("--orders", type=int, default=10**9, help="stop after this many sends")
+    ap.add_argument("--max-in-flight", type=int, default=512)
+    ap.add_argument("--dup-ratio", type=float, default=0.05)
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--secret", default=os.environ.get("SHOPIFY_WEBHOOK_SECRET"))
+    ap.add_argument("--database-url", default=os.environ.get("DATABASE_URL"),
+                    help="poll order_risk here for time to verdict (skipped if unset)")
+    ap.add_argument("--poll", type=float, default=0.25)
+    ap.add_argument("--verdict-timeout", type=float, default=120.0)
+    ap.add_argument("--out")
+    args = ap.parse_args()
+    if not args.secret:
+        sys.exit("set SHOPIFY_WEBHOOK_SECRET or --secret")
+
+    preexisting = set()
+    if args.input:
+        rows = recorded(args.input, args.shop)
+        if args.database_url:
+            # recorded streams may contain orders the target has already scored
+            preexisting = existing_orders(args.database_url, [str(p.get("id")) for _, p in rows])
+        source = iter(rows)
+    else:
+        source = synthetic(args.seed)
+    replay = Replay(args.url, args.secret, args.dup_ratio, random.Random(args.seed))
+    if args.concurrency:
+        elapsed = asyncio.run(closed_loop(replay, source, args.concurrency, args.duration, args.orders))
+    else:
+        elapsed = asyncio.run(open_loop(replay, source, args.rate, args.duration, args.orders, args.max_in_flight))
+
+    total = sum(replay.statuses.values())
+    report = {
+        "target": args.url,
+        "mode": f"closed:{args.concurrency}" if args.concurrency else f"open:{args.rate}/s",
+        "sent": total,
+        "elapsed_s": round(elapsed, 2),
+        "achieved_per_sec": round(total / elapsed, 1) if elapsed else None,
+        "statuses": replay.statuses,
+        "admission": _summary(replay.admission, "ms", 1000),
+        "dedup": {
+            "duplicates_sent": replay.dups_sent,
+            "deduped": replay.dups_deduped,
+            "false_admits": replay.dups_sent - replay.dups_deduped,
+            "false_dedups": replay.false_dedups,
+            "correct": replay.dups_sent == replay.dups_deduped and not replay.false_dedups,
+            **_summary(replay.dedup_latency, "ms", 1000),
+        },
+    }
+    if args.database_url and replay.admitted:
+        latencies, missing = wait_for_verdicts(args.database_url, replay.admitted, args.poll,
+                                               args.verdict_timeout, preexisting)
+        report["verdict"] = {"tracked": len(latencies) + missing, "completed": len(latencies),
+                             "missing": missing, "already_scored": len(preexisting & set(replay.admitted)),
+                             "resolution_s": args.poll, **_summary(latencies, "s", 1)}
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w") as fh:
+            fh.write(text + "\n")
+    if not report["dedup"]["correct"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Compiled ruleset vs the hand-written rules_basic it replaced.
+
+    python -m bench.rules --orders 5000 --repeat 20
+
+Prints ops/sec for both and exits non-zero if the compiled default ruleset
+is slower than the legacy function on the same orders.
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from typing import Dict, List, Tuple
+
+from app.rules.ruleset import DEFINITIONS_DIR
+from app.rules.engine import compile_ruleset
+
+def rules_basic_legacy(order: Dict) -> Tuple[float, List[str]]:
+    # verbatim copy of app/rules/ruleset.rules_basic before the rules engine
+    score = 0.0
+    reasons = []
+
+    if order.get("billing_country") and order.get("shipping_country"):
+        if order["billing_country"] != order["shipping_country"]:
+            score += 25; reasons.append("Country mismatch (billing vs shipping)")
+
+    if (order.get("total_price") or 0) > 500:
+        score += 15; reasons.append("High-value order")
+
+    email = (order.get("email") or "").lower()
+    if email.endswith(".ru") or email.endswith(".cn"):
+        score += 10; reasons.append("Suspicious email TLD")
+
+    ip = order.get("ip")
+    if ip in {"0.0.0.0", "127.0.0.1"}:
+        score += 20; reasons.append("Bogus IP")
+
+    if order.get("repeat_email", 0) > 3:
+        score += 20; reasons.append("Email seen high velocity")
+
+    if order.get("repeat_email_10m", 0) >= 3:
+        score += 20; reasons.append("Email burst (10m)")
+
+    if order.get("repeat_ip_1h", 0) >= 5:
+        score += 15; reasons.append("IP velocity (1h)")
+
+    if order.get("repeat_device_24h", 0) >= 5:
+        score += 15; reasons.append("Device velocity (24h)")
+
+    return min(score, 100.0), reasons
+
+def sample_orders(n: int, seed: int = 7) -> List[dict]:
+    rnd = random.Random(seed)
+    countries = ["US", "US", "US", "CA", "GB", "DE"]
+    tlds = [".com", ".com", ".net", ".ru", ".cn", ".io"]
+    return [{
+        "billing_country": rnd.choice(countries),
+        "shipping_country": rnd.choice(countries),
+        "total_price": round(rnd.lognormvariate(4.5, 1.0), 2),
+        "email": f"user{rnd.randrange(10**6)}@example{rnd.choice(tlds)}",
+        "ip": rnd.choice(["203.0.113.7", "198.51.100.2", "127.0.0.1"]),
+        "repeat_email": rnd.choice([0, 0, 0, 1, 2, 5]),
+        "repeat_email_10m": rnd.choice([0, 0, 0, 1, 3]),
+        "repeat_ip_1h": rnd.choice([0, 0, 1, 6]),
+        "repeat_device_24h": rnd.choice([0, 0, 2, 7]),
+    } for _ in range(n)]
+
+def _ops_per_sec(fns, orders, repeat) -> List[float]:
+    # interleave the candidates so CPU frequency drift hits both equally; keep the best pass
+    best = [float("inf")] * len(fns)
+    for _ in range(repeat):
+        for i, fn in enumerate(fns):
+            t = time.perf_counter()
+            for o in orders:
+                fn(o)
+            best[i] = min(best[i], time.perf_counter() - t)
+    return [len(orders) / b for b in best]
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--orders", type=int, default=5000)
+    ap.add_argument("--repeat", type=int, default=20)
+    args = ap.parse_args()
+
+    with open(f"{DEFINITIONS_DIR}/default.json") as fh:
+        compiled = compile_ruleset(json.load(fh))
+    orders = sample_orders(args.orders)
+    mismatched = [o for o in orders if rules_basic_legacy(o) != compiled.evaluate(o)]
+    if mismatched:
+        sys.exit(f"compiled ruleset disagrees with legacy on {len(mismatched)} orders, e.g. {mismatched[0]}")
+
+    legacy, fast = _ops_per_sec([rules_basic_legacy, compiled.evaluate], orders, args.repeat)
+    print(json.dumps({
+        "legacy_ops_per_sec": round(legacy),
+        "compiled_ops_per_sec": round(fast),
+        "speedup": round(fast / legacy, 3),
+        "rules": compiled.stats(),
+    }, indent=2))
+    if fast < legacy:
+        sys.exit("compiled ruleset is slower than the legacy function")
+
+if __name__ == "__main__":
+    main()
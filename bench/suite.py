@@ -0,0 +1,334 @@
+"""Benchmark suite over synthetic orders; one JSON document per run.
+
+    DATABASE_URL=sqlite:////tmp/bench.db python -m bench.suite --out base.json
+    ...change something...
+    DATABASE_URL=sqlite:////tmp/bench.db python -m bench.suite --compare base.json
+
+Scenarios (all by default, or pick with --only):
+- rules:   rules_basic and defender3d ops/sec on scoring inputs built from
+           the generated payloads (bench/orders.py)
+- vault:   observe_identities upserts, uncached and cached lookups
+- webhook: HMAC verification alone, then the orders/create route (HMAC,
+           Redis admission, enqueue to the batch queue) via ASGI: p50/p95/p99
+           sequentially and requests/sec under --concurrency
+- e2e:     process_order_async end to end (per-order task body), and the
+           batch consumer's process_batch
+- score:   POST /v1/score (checkout-time scoring within SCORE_BUDGET_MS)
+           via ASGI, with a cold vault count cache over half-known
+           identities: p50/p95/p99 one request at a time (the
+           one-worker target is p99 < 25 ms, so far measured only on
+           SQLite and fakeredis), requests/sec under --concurrency, and
+           the share of degraded answers
+
+Redis is an in-process fakeredis unless --real-redis (then REDIS_URL).
+The database is DATABASE_URL. SQLite files get their schema created.
+Postgres must be migrated, and should be a scratch database: the suite
+writes vault, order_risk and evidence rows. Every metric ends in _per_sec
+(higher is better) or _ms/_us (lower is better). --compare flags any
+metric that got worse by more than --tolerance and exits 1.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List
+
+from bench.orders import OrderGenerator
+
+SCENARIOS = ("rules", "vault", "webhook", "e2e", "score")
+
+def _pct(sorted_vals: List[float], p: float) -> float:
+    return sorted_vals[min(len(sorted_vals) - 1, int(len(sorted_vals) * p))]
+
+def _latency(samples: List[float], prefix: str = "") -> Dict[str, float]:
+    s = sorted(samples)
+    return {f"{prefix}p{int(p * 100)}_ms": round(_pct(s, p) * 1000, 3) for p in (0.5, 0.95, 0.99)}
+
+def _best_rate(fn: Callable[[], int], repeat: int) -> float:
+    """Items/sec of the fastest of `repeat` passes (fn returns the item count)."""
+    best = 0.0
+    for _ in range(repeat):
+        t = time.perf_counter()
+        n = fn()
+        best = max(best, n / (time.perf_counter() - t))
+    return round(best, 1)
+
+# ---------- backends ----------
+def setup_backends(real_redis: bool) -> dict:
+    from app import models  # noqa: F401  (registers the tables on Base.metadata)
+    from app.config import settings
+    from app.database import Base, get_engine
+    from app.utils import redis_client
+
+    if not real_redis:
+        import fakeredis
+        server = fakeredis.FakeServer()
+        redis_client._client = fakeredis.FakeRedis(server=server)
+        redis_client._async_client = fakeredis.FakeAsyncRedis(server=server)
+    engine = get_engine()
+    if engine.dialect.name == "sqlite":
+        Base.metadata.create_all(engine)
+    return {"database": engine.dialect.name, "redis": "redis" if real_redis else "fakeredis",
+            "evidence_format": settings.EVIDENCE_FORMAT}
+
+def _inputs(payloads: List[dict]) -> List[dict]:
+    from app.celery_worker import build_order_input
+    return [build_order_input(p["_shop"], p) for p in payloads]
+
+# ---------- scenarios ----------
+def bench_rules(payloads: List[dict], repeat: int) -> dict:
+    from app.rules.defender3d import defender3d
+    from app.rules.ruleset import rules_basic
+    import random
+
+    rnd = random.Random(1)
+    inputs = _inputs(payloads)
+    for d in inputs:  # plausible enrichment, so rules see non-zero counters
+        d.update(repeat_email=rnd.choice([0, 0, 0, 1, 4]), repeat_email_10m=rnd.choice([0, 0, 1, 3]),
+                 repeat_ip_1h=rnd.choice([0, 0, 2, 6]), repeat_device_24h=rnd.choice([0, 1, 6]),
+                 cluster_size=rnd.choice([1, 2, 2, 3, 8]))
+
+    def run(fn):
+        def once():
+            for d in inputs:
+                fn(d)
+            return len(inputs)
+        return once
+    return {"rules_basic_ops_per_sec": _best_rate(run(rules_basic), repeat),
+            "defender3d_ops_per_sec": _best_rate(run(defender3d), repeat)}
+
+def bench_vault(payloads: List[dict], batch: int) -> dict:
+    from app.celery_worker import identity_keys
+    from app.database import get_sessionmaker
+    from app.vault.cache import count_cache
+    from app.vault.repository import cached_lookup_counts, lookup_counts, observe_identities
+
+    per_order = [list(identity_keys(d).values()) for d in _inputs(payloads)]
+    batches = [per_order[i:i + batch] for i in range(0, len(per_order), batch)]
+    keys = sorted({k for keys in per_order for k in keys})
+    SessionLocal = get_sessionmaker()
+    out = {}
+    with SessionLocal() as db:
+        t = time.perf_counter()
+        for b in batches:
+            observe_identities(db, b)
+            db.commit()
+        elapsed = time.perf_counter() - t
+        out["observe_orders_per_sec"] = round(len(per_order) / elapsed, 1)
+        out["observe_identities_per_sec"] = round(sum(map(len, per_order)) / elapsed, 1)
+
+        chunks = [keys[i:i + batch * 3] for i in range(0, len(keys), batch * 3)]
+        t = time.perf_counter()
+        for c in chunks:
+            lookup_counts(db, c)
+        out["lookup_keys_per_sec"] = round(len(keys) / (time.perf_counter() - t), 1)
+
+        count_cache.clear()
+        for c in chunks:
+            cached_lookup_counts(db, c)  # fill
+        t = time.perf_counter()
+        for c in chunks:
+            cached_lookup_counts(db, c)
+        out["cached_lookup_keys_per_sec"] = round(len(keys) / (time.perf_counter() - t), 1)
+    return out
+
+def bench_webhook(payloads: List[dict], concurrency: int, repeat: int) -> dict:
+    import httpx
+    from fastapi import FastAPI
+    from app.config import settings
+    from app.routes import webhooks
+    from app.utils.shopify import verify_shopify_hmac
+
+    secret = os.environ["SHOPIFY_WEBHOOK_SECRET"]
+    run_id = datetime.now(timezone.utc).strftime("%H%M%S%f")
+    signed = [OrderGenerator.signed(p, secret, event_id=f"bench-{run_id}-{p['id']}") for p in payloads]
+    out = {"hmac_verify_ops_per_sec": _best_rate(
+        lambda: sum(verify_shopify_hmac(raw, h["X-Shopify-Hmac-Sha256"]) for raw, h in signed), repeat)}
+
+    app = FastAPI()
+    app.include_router(webhooks.router)
+    settings.ORDER_BATCH_MODE = True  # enqueue to the Redis order queue, not a Celery broker
+
+    async def drive(items, concurrency):
+        sem = asyncio.Semaphore(concurrency)
+        latencies, dedup = [], 0
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+            async def one(raw, headers):
+                nonlocal dedup
+                async with sem:
+                    t = time.perf_counter()
+                    r = await client.post("/webhooks/orders-create", content=raw, headers=headers)
+                    latencies.append(time.perf_counter() - t)
+                    r.raise_for_status()
+                    dedup += bool(r.json().get("dedup"))
+            start = time.perf_counter()
+            await asyncio.gather(*(one(raw, h) for raw, h in items))
+            return time.perf_counter() - start, latencies, dedup
+
+    half = len(signed) // 2
+    _, latencies, _ = asyncio.run(drive(signed[:half], 1))
+    out.update(_latency(latencies, "admission_"))
+    elapsed, _, _ = asyncio.run(drive(signed[half:], concurrency))
+    out["admission_requests_per_sec"] = round((len(signed) - half) / elapsed, 1)
+    _, latencies, dedup = asyncio.run(drive(signed[:half], 1))  # Shopify retries
+    if dedup != half:
+        raise RuntimeError(f"expected {half} duplicate webhooks, got {dedup}")
+    out.update(_latency(latencies, "dedup_"))
+    return out
+
+def bench_e2e(payloads: List[dict], batch: int) -> dict:
+    from app.batch_consumer import process_batch
+    from app.celery_worker import MF_SCHEDULED_PREFIX, process_order_async
+    from app.utils.redis_client import get_redis
+
+    r = get_redis()
+    for shop in {p["_shop"] for p in payloads}:
+        # a flush is "already scheduled", so metafield writes queue without a Celery broker
+        r.set(MF_SCHEDULED_PREFIX + shop, 1)
+    half = len(payloads) // 2
+    latencies = []
+    t = time.perf_counter()
+    for p in payloads[:half]:
+        s = time.perf_counter()
+        process_order_async.run(p["_shop"], p, None)
+        latencies.append(time.perf_counter() - s)
+    out = {"task_orders_per_sec": round(half / (time.perf_counter() - t), 1), **_latency(latencies, "task_")}
+
+    rest = payloads[half:]
+    t = time.perf_counter()
+    for i in range(0, len(rest), batch):
+        process_batch([{"shop_id": p["_shop"], "order": p, "event_id": None} for p in rest[i:i + batch]])
+    out["batch_orders_per_sec"] = round(len(rest) / (time.perf_counter() - t), 1)
+    return out
+
+def bench_score(payloads: List[dict], concurrency: int) -> dict:
+    import httpx
+    from fastapi import FastAPI
+    from app import scoring
+    from app.database import get_engine, get_sessionmaker
+    from app.routes import score
+    from app.vault.cache import count_cache
+    from app.vault.repository import observe_identities
+
+    inputs = _inputs(payloads)
+    with get_sessionmaker()() as db:  # every other order's identities are already in the vault
+        observe_identities(db, [scoring.identity_keys(d).values() for d in inputs[::2]])
+        db.commit()
+    if get_engine().dialect.name == "sqlite":
+        from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+        url = str(get_engine().url).replace("sqlite:", "sqlite+aiosqlite:", 1)
+        maker = async_sessionmaker(create_async_engine(url))
+        scoring.get_async_sessionmaker = lambda: maker
+    app = FastAPI()
+    app.include_router(score.router)
+    bodies = [{"shop_id": d["shop_id"], "order_id": d["order_id"], "email": d["email"], "ip": d["ip"],
+               "device_id": d["device_id"], "billing_country": d["billing_country"],
+               "shipping_country": d["shipping_country"], "total_price": d["total_price"],
+               "currency": d["currency"]} for d in inputs]
+
+    async def drive(items, concurrency):
+        sem = asyncio.Semaphore(concurrency)
+        latencies, degraded = [], 0
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+            async def one(body):
+                nonlocal degraded
+                async with sem:
+                    t = time.perf_counter()
+                    r = await client.post("/v1/score", json=body)
+                    latencies.append(time.perf_counter() - t)
+                    r.raise_for_status()
+                    degraded += bool(r.json()["degraded"])
+            start = time.perf_counter()
+            await asyncio.gather(*(one(b) for b in items))
+            return time.perf_counter() - start, latencies, degraded
+
+    count_cache.clear()
+    asyncio.run(drive(bodies[:50], 1))  # compile rulesets, open pools
+    count_cache.clear()
+    half = len(bodies) // 2
+    _, latencies, degraded = asyncio.run(drive(bodies[:half], 1))
+    out = _latency(latencies, "score_")
+    out["score_degraded_share"] = round(degraded / half, 4)
+    elapsed, _, _ = asyncio.run(drive(bodies[half:], concurrency))
+    out["score_requests_per_sec"] = round((len(bodies) - half) / elapsed, 1)
+    return out
+
+# ---------- reporting ----------
+def _git_rev() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def compare(current: dict, baseline: dict, tolerance: float) -> List[dict]:
+    """Metrics in both runs that moved the wrong way by more than `tolerance` (a fraction)."""
+    regressions = []
+    for scenario, metrics in current["results"].items():
+        for name, value in metrics.items():
+            old = baseline.get("results", {}).get(scenario, {}).get(name)
+            if not old or not isinstance(value, (int, float)):
+                continue
+            change = (value - old) / old
+            worse = -change if name.endswith("_per_sec") else change
+            if worse > tolerance:
+                regressions.append({"metric": f"{scenario}.{name}", "baseline": old, "current": value,
+                                    "change": round(change, 3)})
+    return regressions
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--only", action="append", choices=SCENARIOS)
+    ap.add_argument("--orders", type=int, default=4000)
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--batch", type=int, default=200)
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--concurrency", type=int, default=32)
+    ap.add_argument("--real-redis", action="store_true")
+    ap.add_argument("--out", help="also write the JSON here")
+    ap.add_argument("--compare", help="baseline JSON from an earlier run")
+    ap.add_argument("--tolerance", type=float, default=0.15)
+    args = ap.parse_args()
+
+    meta = {"git": _git_rev(), "python": platform.python_version(), "machine": platform.machine(),
+            "started": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "orders": args.orders, "seed": args.seed, "batch": args.batch,
+            **setup_backends(args.real_redis)}
+    logging.getLogger("fraudpop").setLevel(logging.WARNING)  # per-order INFO lines would dominate
+    payloads = list(OrderGenerator(seed=args.seed).orders(args.orders))
+
+    runners = {
+        "rules": lambda: bench_rules(payloads, args.repeat),
+        "vault": lambda: bench_vault(payloads, args.batch),
+        "webhook": lambda: bench_webhook(payloads, args.concurrency, args.repeat),
+        "e2e": lambda: bench_e2e(payloads, args.batch),
+        "score": lambda: bench_score(payloads, args.concurrency),
+    }
+    results = {}
+    for name in args.only or SCENARIOS:
+        t = time.perf_counter()
+        results[name] = runners[name]()
+        print(f"{name}: {time.perf_counter() - t:.1f}s", file=sys.stderr)
+    report = {"meta": meta, "results": results}
+
+    if args.compare:
+        with open(args.compare) as fh:
+            baseline = json.load(fh)
+        report["baseline"] = baseline["meta"].get("git")
+        report["regressions"] = compare(report, baseline, args.tolerance)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w") as fh:
+            fh.write(text + "\n")
+    if report.get("regressions"):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
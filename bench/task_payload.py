@@ -0,0 +1,89 @@
+"""Celery message size and (de)serialisation cost: full order vs projected.
+
+    python -m bench.task_payload --orders 2000
+
+For each payload variant (the full orders/create body, or project_order()
+of it) and each available serializer/compression pair, reports the mean
+and p95 message-body bytes, plus microseconds per message to encode
+(enqueue side) and decode (worker side). It uses kombu's own registry,
+as Celery does. msgpack rows appear only when msgpack is installed.
+"""
+import argparse
+import json
+import time
+from typing import Callable, List
+
+from kombu.compression import compress, decompress
+from kombu.serialization import dumps, loads
+
+from app.utils.order_payload import project_order
+from bench.orders import OrderGenerator
+
+def _codecs() -> List[tuple]:
+    out = [("json", None), ("json", "zlib")]
+    try:
+        import msgpack  # noqa: F401
+    except ImportError:
+        return out
+    return out + [("msgpack", None), ("msgpack", "zlib")]
+
+def _us(fn: Callable[[], None], n: int, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t)
+    return round(best / n * 1e6, 2)
+
+def measure(bodies: List[tuple], serializer: str, compression) -> dict:
+    def encode(body):
+        content_type, encoding, data = dumps(body, serializer=serializer)
+        compressed_as = None
+        if compression:
+            data, compressed_as = compress(data, compression)
+        return content_type, encoding, compressed_as, data
+
+    encoded = [encode(b) for b in bodies]
+    sizes = sorted(len(d) for *_, d in encoded)
+
+    def decode_all():
+        for content_type, encoding, compressed_as, data in encoded:
+            if compressed_as:
+                data = decompress(data, compressed_as)
+            loads(data, content_type, encoding)
+
+    def encode_all():
+        for b in bodies:
+            encode(b)
+    return {
+        "mean_bytes": round(sum(sizes) / len(sizes)),
+        "p95_bytes": sizes[int(len(sizes) * 0.95)],
+        "encode_us": _us(encode_all, len(bodies)),
+        "decode_us": _us(decode_all, len(bodies)),
+    }
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--orders", type=int, default=2000)
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+
+    payloads = list(OrderGenerator(seed=args.seed).orders(args.orders))
+    variants = {
+        # the task's Celery body: (args, kwargs, embed)
+        "full": [((p["_shop"], {k: v for k, v in p.items() if k != "_shop"}, f"wh-{p['id']}"), {}, {})
+                 for p in payloads],
+        "projected": [((p["_shop"], project_order(p), f"wh-{p['id']}"), {}, {}) for p in payloads],
+    }
+    results = {}
+    for name, bodies in variants.items():
+        for serializer, compression in _codecs():
+            results[f"{name}/{serializer}" + (f"+{compression}" if compression else "")] = \
+                measure(bodies, serializer, compression)
+    base = results["full/json"]["mean_bytes"]
+    for r in results.values():
+        r["bytes_vs_full_json"] = round(r["mean_bytes"] / base, 3)
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
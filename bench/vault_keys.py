@@ -0,0 +1,64 @@
+"""Per-identifier cost of vault lookup keys vs the Argon2id hasher.
+
+    python -m bench.vault_keys --values 100000 --argon2 20
+
+Reports microseconds per identifier for the keyed HMAC path (cold, i.e.
+every value new to the memo; warm; and the batch API), the pre-HMAC
+sha256 lookup key, and app/vault/hasher.hash_identifier.
+"""
+import argparse
+import hashlib
+import json
+import time
+
+from app.vault.hasher import hash_identifier
+from app.vault.keys import LEGACY_PEPPER, KeyDeriver
+
+def _us_per_item(fn, values) -> float:
+    t = time.perf_counter()
+    fn(values)
+    return (time.perf_counter() - t) / len(values) * 1e6
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--values", type=int, default=100_000)
+    ap.add_argument("--argon2", type=int, default=20, help="values to hash with Argon2id (slow)")
+    args = ap.parse_args()
+
+    values = [f"user{i}@example.com" for i in range(args.values)]
+    deriver = KeyDeriver({1: "bench-pepper"}, current=1, memo_size=args.values)
+
+    def one_by_one(vs):
+        for v in vs:
+            deriver.key(v, "email")
+
+    def legacy(vs):
+        for v in vs:
+            hashlib.sha256((LEGACY_PEPPER + v).encode("utf-8")).hexdigest()
+
+    def argon2(vs):
+        for v in vs:
+            hash_identifier(v)
+
+    cold = _us_per_item(one_by_one, values)
+    warm = _us_per_item(one_by_one, values)
+    batch = _us_per_item(lambda vs: deriver.keys(vs, "email"),
+                         [v.upper() for v in values])  # new raw strings, memo keyed on normalized value
+    fresh = KeyDeriver({1: "bench-pepper"}, current=1, memo_size=0)
+    uncached = _us_per_item(lambda vs: fresh.keys(vs, "email"), values)
+    sha = _us_per_item(legacy, values)
+    slow = _us_per_item(argon2, values[: args.argon2])
+    print(json.dumps({
+        "us_per_identifier": {
+            "hmac_cold": round(cold, 3),
+            "hmac_warm": round(warm, 3),
+            "hmac_batch_warm": round(batch, 3),
+            "hmac_no_memo": round(uncached, 3),
+            "legacy_sha256": round(sha, 3),
+            "argon2id": round(slow, 1),
+        },
+        "argon2_vs_hmac_cold": round(slow / cold),
+    }, indent=2))
+
+if __name__ == "__main__":
+    main()